@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict
+import asyncio
 
 class BaseAgent(ABC):
     name: str = "base"
@@ -8,19 +9,20 @@ class BaseAgent(ABC):
     def run(self, query: str, context: Dict[str, Any] | None = None) -> Dict[str, Any]:
         raise NotImplementedError
 
-def make_agent(intent: str) -> BaseAgent:
-    from .goal_agent import GoalAgent
-    from .analytics_agent import AnalyticsAgent
-    from .product_agent import ProductAgent
-    from .wellness_agent import WellnessAgent
-    from .general_agent import GeneralAgent
+    async def arun(self, query: str, context: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        # агенты без нативного async-пути выполняют run в пуле потоков, не блокируя цикл событий
+        return await asyncio.to_thread(self.run, query, context)
+
+    async def astream(self, query: str, context: Dict[str, Any] | None = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Потоковый вариант arun: события {"event": "token", "text": ...}, затем {"event": "done", "result": ...}.
+        По умолчанию весь ответ уходит одним куском; RAG-агенты стримят токены модели.
+        """
+        result = await self.arun(query, context)
+        yield {"event": "token", "text": str(result.get("answer", ""))}
+        yield {"event": "done", "result": result}
 
-    mapping = {
-        "goal_planning": GoalAgent,
-        "analytics": AnalyticsAgent,
-        "product_recommendation": ProductAgent,
-        "wellness": WellnessAgent,
-        "general_knowledge": GeneralAgent,
-    }
-    agent_cls = mapping.get(intent, GeneralAgent)
-    return agent_cls()
+def make_agent(intent: str) -> BaseAgent:
+    """Отдаёт долгоживущий агент из процессного пула (см. registry.AgentRegistry)."""
+    from .registry import registry
+    return registry.get(intent)
@@ -1,10 +1,12 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import date
-from openai import OpenAI
-import httpx, json
+import json
 
+from backend.agents.base import BaseAgent
+from backend.metrics import token_meter, tracing
 from backend.utils.settings import settings
+from backend.utils.clients import openai_client
 from backend.rag.retriever import Retriever
 from backend.agents.goal_slots import GoalSlots, feasibility
 from backend.memory.state import state
@@ -39,19 +41,13 @@ PLAN_SYSTEM = """You are a savings planning assistant. Use ONLY provided slots a
 If 'confirm' is not given, do not produce a plan yet. Ask for confirmation if needed.
 Keep answers concise and practical."""
 
-class GoalAgent:
+class GoalAgent(BaseAgent):
     name = "goal_planning"
 
-    def __init__(self):
-        self.client = OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_BASE_URL,
-            timeout=settings.REQUEST_TIMEOUT_SECONDS,
-            max_retries=2,
-            http_client=httpx.Client(timeout=settings.REQUEST_TIMEOUT_SECONDS),
-        )
+    def __init__(self, retriever: Retriever | None = None):
+        self.client = openai_client()
         self.model = settings.INTENT_MODEL
-        self.retriever = Retriever()
+        self.retriever = retriever or Retriever()
 
 
     def _extract_slots(self, user_text: str) -> Dict[str, Any]:
@@ -59,7 +55,8 @@ class GoalAgent:
             {"role": "system", "content": EXTRACT_SYSTEM},
             {"role": "user", "content": user_text}
         ]
-        resp = self.client.chat.completions.create(
+        resp = token_meter.metered(
+            f"agent:{self.name}", self.client.chat.completions.create,
             model=self.model, temperature=0,
             response_format={"type":"json_object"},
             messages=messages
@@ -86,7 +83,8 @@ class GoalAgent:
             {"role":"user","content":"Сформулируй 1-3 уточняющих вопроса (коротко, по делу), без советов."}
         ]
         try:
-            r = self.client.chat.completions.create(model=self.model, temperature=0.2, messages=prompt)
+            r = token_meter.metered(f"agent:{self.name}", self.client.chat.completions.create,
+                                   model=self.model, temperature=0.2, messages=prompt)
             text = (r.choices[0].message.content or "").strip()
 
             qs = [ln.strip("-• ").strip() for ln in text.split("\n") if ln.strip()]
@@ -111,15 +109,43 @@ class GoalAgent:
         return "\n".join(lines)
 
 
+    @tracing.traced("agent.run")
     def run(self, query: str, context: Dict[str, Any] | None = None) -> Dict[str, Any]:
         sid = (context or {}).get("session_id", "default")
+        extracted = self._extract_slots(query)  # LLM-вызов — до замка сессии
+        # шаг диалога (слоты + фаза) — под замком: параллельные реплики одной сессии не теряют изменений.
+        # Вопросы по БЗ (retrieval + LLM) — уже после замка: второй запрос сессии не ждёт сеть
+        with state.lock(sid):
+            out, kb = self._step(sid, query, extracted)
+        if kb is not None:
+            self._add_kb_questions(sid, out, *kb)
+        return out
+
+    def _add_kb_questions(self, sid: str, out: Dict[str, Any], topic: str, style: str):
+        kb_qs = self._kb_questions(topic)
+        if not kb_qs:
+            return
+        if style == "collect":
+            out["answer"] += "\n- " + "\n- ".join(kb_qs)
+            with state.lock(sid):
+                st = state.get(sid)
+                goal = st.get("goal", {})
+                if goal.get("phase") == "collect":
+                    goal["last_questions"] = goal.get("last_questions", []) + kb_qs
+                    state.update(sid, {"goal": goal})
+        elif style == "confirm":
+            out["answer"] += "\n" + "\n".join(kb_qs)
+        else:
+            out["answer"] += "\nДоп. вопросы для уточнения:\n- " + "\n- ".join(kb_qs)
+
+    def _step(self, sid: str, query: str, extracted: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Tuple[str, str]]]:
+        """Ответ + (тема, стиль) для вопросов по БЗ, которые run допишет после снятия замка."""
+        # слоты обновляем до чтения состояния: иначе st["goal"] = goal ниже затирал бы только что записанные слоты
+        slots = GoalSlots.update(sid, extracted)
         st = state.get(sid)
         goal = st.get("goal", {})
         phase = goal.get("phase") or "collect"
 
-        extracted = self._extract_slots(query)
-        slots = GoalSlots.update(sid, extracted)
-
         today_iso = date.today().isoformat()
         feas = feasibility(slots, today_iso)
         miss = GoalSlots.missing(slots)
@@ -130,8 +156,6 @@ class GoalAgent:
                 questions: List[str] = [CLARIFY_RU[m] for m in miss if m in CLARIFY_RU]
 
                 topic_hint = f"накопление {slots.get('goal_name','')} {slots.get('currency') or ''}"
-                kb_qs = self._kb_questions(topic_hint)
-                questions += kb_qs
 
                 goal.update({"phase":"collect","last_questions":questions})
                 st["goal"] = goal
@@ -141,7 +165,7 @@ class GoalAgent:
                     "slots": slots,
                     "phase": "collect",
                     "missing": miss
-                }
+                }, (topic_hint, "collect")
 
 
             goal.update({"phase":"confirm"})
@@ -156,7 +180,7 @@ class GoalAgent:
                 "slots": slots,
                 "phase": "confirm",
                 "missing": []
-            }
+            }, None
 
 
         if phase == "confirm":
@@ -179,15 +203,12 @@ class GoalAgent:
                     qopts = [
                         f"Ваш текущий взнос ниже требуемого (≈ {reqm:,.0f}). Можем увеличить взнос, продлить срок или снизить целевую сумму. Какой вариант предпочитаете?".replace(",", " "),
                     ]
-                
-                    kb_qs = self._kb_questions(f"накопления увеличение взноса сроки продукты {slots.get('currency') or ''}")
-                    qopts += kb_qs
                     return {
                         "answer": f"Промежуточная сводка:\n{summary}\n\n" + "\n".join(qopts),
                         "slots": slots,
                         "phase": "confirm",
                         "feasibility": feas
-                    }
+                    }, (f"накопления увеличение взноса сроки продукты {slots.get('currency') or ''}", "confirm")
 
             if goal.get("user_accepts_required_monthly") is True:
                 goal["phase"] = "plan"; st["goal"] = goal; state.update(sid, st)
@@ -199,16 +220,13 @@ class GoalAgent:
                     "slots": slots,
                     "phase": "confirm",
                     "feasibility": feas
-                }
+                }, None
 
         if phase in ("plan",) or state.get(sid).get("goal", {}).get("phase") == "plan":
             reqm = feas.get("required_monthly")
             months = feas.get("months")
             curr = slots.get("currency") or "KZT"
 
-            kb_qs = self._kb_questions(f"накопления шаги контроль прогресс автоматизация перевода {curr}")
-            kb_tail = ("\nДоп. вопросы для уточнения:\n- " + "\n- ".join(kb_qs)) if kb_qs else ""
-
             plan_text = (
                 f"План до цели (~{months} мес):\n"
                 f"1) Откладывать ≈ {reqm:,.0f} {curr} ежемесячно (или подтвердите свой взнос).\n"
@@ -218,15 +236,15 @@ class GoalAgent:
             ).replace(",", " ")
 
             return {
-                "answer": plan_text + kb_tail,
+                "answer": plan_text,
                 "slots": slots,
                 "phase": "plan",
                 "feasibility": feas
-            }
+            }, (f"накопления шаги контроль прогресс автоматизация перевода {curr}", "plan")
 
         return {
             "answer": "Давайте уточним параметры цели. Сформулируйте: цель, сумму, валюту и срок.",
             "slots": slots,
             "phase": "collect",
             "missing": GoalSlots.missing(slots)
-        }
+        }, None
@@ -175,12 +175,14 @@ class GoalSlots:
             if v is not None:
                 up["notes"] = str(v).strip()
 
-        st = state.get(sid)
-        cur = st.get(GoalSlots.KEY, {})
-        cur.update(up)
-        st[GoalSlots.KEY] = cur
-        state.update(sid, st)
-        return GoalSlots.get(sid)
+        # read-modify-write под замком сессии: параллельный запрос той же сессии не затрёт слоты
+        with state.lock(sid):
+            st = state.get(sid)
+            cur = st.get(GoalSlots.KEY, {})
+            cur.update(up)
+            st[GoalSlots.KEY] = cur
+            state.update(sid, st)
+            return GoalSlots.get(sid)
 
     @staticmethod
     def feasibility(slots: Dict[str, Any], today_iso: str) -> Dict[str, Any]:
@@ -210,9 +212,10 @@ class GoalSlots:
 
     @staticmethod
     def clear(sid: str):
-        st = state.get(sid)
-        st.pop(GoalSlots.KEY, None)
-        state.update(sid, st)
+        with state.lock(sid):
+            st = state.get(sid)
+            st.pop(GoalSlots.KEY, None)
+            state.update(sid, st)
 
     @staticmethod
     def missing(slots: Dict[str, Any]) -> List[str]:
@@ -0,0 +1,125 @@
+from __future__ import annotations
+from typing import Any, AsyncIterator, Dict, List
+import time
+
+from backend.agents.base import BaseAgent
+from backend.metrics import token_meter, tracing
+from backend.rag.answer_cache import answer_cache, answer_key
+from backend.rag.retriever import Retriever
+from backend.utils.clients import async_openai_client, openai_client
+
+class RAGAgent(BaseAgent):
+    """Общий каркас RAG-агентов: retrieve -> CONTEXT -> chat completion. Наследники задают name и system_prompt."""
+    name = "rag"
+    system_prompt = ""
+
+    def __init__(self, retriever: Retriever | None = None):
+        self.retriever = retriever or Retriever()
+        self.client = openai_client()
+        self.aclient = async_openai_client()
+        self.model = "gpt-4o-mini"
+        self.cache = answer_cache()
+
+    def _messages(self, query: str, hits: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        ctx = self.retriever.format_context(hits)
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "system", "content": f"CONTEXT:\n{ctx or '(no relevant context)'}"},
+            {"role": "user", "content": query},
+        ]
+
+    @staticmethod
+    def _result(answer: str, hits: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "answer": answer,
+            "used_docs": [
+                {"source": h.get("meta", {}).get("source"), "chunk": h.get("meta", {}).get("chunk"), "score": h.get("score")}
+                for h in hits
+            ]
+        }
+
+    def _kb_version(self) -> int:
+        store = self.retriever.store
+        return getattr(store, "kb_version", 0) if store is not None else 0
+
+    def _cached(self, query: str, hits: List[Dict[str, Any]]):
+        """(ключ, версия БЗ, готовый ответ или None); при выключенном кэше ключа нет."""
+        if self.cache is None:
+            return None, 0, None
+        version = self._kb_version()
+        key = answer_key(self.name, self.model, query, hits, version)
+        return key, version, self.cache.get(key, version)
+
+    def _remember(self, key: str | None, version: int, answer: str):
+        if key is not None and answer:
+            self.cache.put(key, version, answer)
+
+    def _cache_hit(self, answer: str, hits: List[Dict[str, Any]]) -> Dict[str, Any]:
+        out = self._result(answer, hits)
+        out["cache"] = "answer"
+        return out
+
+    @tracing.traced("agent.run")
+    def run(self, query: str, context: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        history = (context or {}).get("history") or []
+        hits = self.retriever.retrieve(query, history=history)
+        key, version, answer = self._cached(query, hits)
+        if answer is not None:
+            return self._cache_hit(answer, hits)
+        resp = token_meter.metered(
+            f"agent:{self.name}", self.client.chat.completions.create,
+            model=self.model, temperature=0.2, messages=self._messages(query, hits)
+        )
+        answer = resp.choices[0].message.content.strip()
+        self._remember(key, version, answer)
+        return self._result(answer, hits)
+
+    @tracing.traced("agent.run")
+    async def arun(self, query: str, context: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        history = (context or {}).get("history") or []
+        prefetch = (context or {}).get("prefetch")
+        # /route мог заранее запустить тот же retrieve параллельно с классификацией интента
+        hits = await prefetch if prefetch is not None else await self.retriever.aretrieve(query, history=history)
+        key, version, answer = self._cached(query, hits)
+        if answer is not None:
+            return self._cache_hit(answer, hits)
+        resp = await token_meter.ametered(
+            f"agent:{self.name}", self.aclient.chat.completions.create,
+            model=self.model, temperature=0.2, messages=self._messages(query, hits)
+        )
+        answer = resp.choices[0].message.content.strip()
+        self._remember(key, version, answer)
+        return self._result(answer, hits)
+
+    async def astream(self, query: str, context: Dict[str, Any] | None = None) -> AsyncIterator[Dict[str, Any]]:
+        history = (context or {}).get("history") or []
+        prefetch = (context or {}).get("prefetch")
+        hits = await prefetch if prefetch is not None else await self.retriever.aretrieve(query, history=history)
+        key, version, answer = self._cached(query, hits)
+        if answer is not None:
+            yield {"event": "token", "text": answer}
+            yield {"event": "done", "result": self._cache_hit(answer, hits)}
+            return
+
+        t0 = time.perf_counter()
+        # include_usage: последний чанк несёт usage всего ответа (для token_meter)
+        stream = await self.aclient.chat.completions.create(
+            model=self.model, temperature=0.2, messages=self._messages(query, hits), stream=True,
+            stream_options={"include_usage": True},
+        )
+        parts: List[str] = []
+        last = None
+        try:
+            async for chunk in stream:
+                last = chunk
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    parts.append(text)
+                    yield {"event": "token", "text": text}
+        finally:
+            # клиент мог отключиться посреди ответа — закрываем HTTP-поток к модели
+            await stream.close()
+            token_meter.record(f"agent:{self.name}", self.model, last, time.perf_counter() - t0)
+        answer = "".join(parts).strip()
+        self._remember(key, version, answer)
+        yield {"event": "done", "result": self._result(answer, hits)}
@@ -0,0 +1,101 @@
+# backend/agents/registry.py
+from __future__ import annotations
+from typing import Any, Callable, Dict, Optional
+import threading, time
+
+from backend.utils.logger import get_logger
+
+log = get_logger("agent-registry")
+
+DEFAULT_INTENT = "general_knowledge"
+
+class AgentRegistry:
+    """
+    Процессный пул долгоживущих агентов.
+    Агенты собираются один раз (в lifespan FastAPI или лениво при первом запросе),
+    RAG-агенты делят один Retriever (а значит один LocalVectorStore/Embedder).
+    Агенты не хранят состояние запроса, поэтому их можно отдавать параллельным воркерам threadpool.
+    """
+    def __init__(self):
+        self._agents: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._retriever = None
+        self._builds: Dict[str, int] = {}
+        self._reuses: Dict[str, int] = {}
+        self.warmup_seconds: Optional[float] = None
+
+    def _factories(self) -> Dict[str, Callable[[], Any]]:
+        from .goal_agent import GoalAgent
+        from .analytics_agent import AnalyticsAgent
+        from .product_agent import ProductAgent
+        from .wellness_agent import WellnessAgent
+        from .general_agent import GeneralAgent
+
+        return {
+            "goal_planning": lambda: GoalAgent(retriever=self._shared_retriever()),
+            "analytics": AnalyticsAgent,
+            "product_recommendation": lambda: ProductAgent(retriever=self._shared_retriever()),
+            "wellness": WellnessAgent,
+            "general_knowledge": lambda: GeneralAgent(retriever=self._shared_retriever()),
+        }
+
+    def _shared_retriever(self):
+        # вызывается под self._lock (из _build) — отдельная блокировка не нужна
+        if self._retriever is None:
+            from backend.rag.retriever import Retriever
+            self._retriever = Retriever()
+        return self._retriever
+
+    def retriever(self):
+        """Общий Retriever RAG-агентов (для спекулятивного prefetch в /route)."""
+        if self._retriever is not None:
+            return self._retriever
+        with self._lock:
+            return self._shared_retriever()
+
+    def _build(self, intent: str):
+        factories = self._factories()
+        if intent not in factories:
+            intent = DEFAULT_INTENT
+        agent = self._agents.get(intent)
+        if agent is None:
+            agent = factories[intent]()
+            self._agents[intent] = agent
+            self._builds[intent] = self._builds.get(intent, 0) + 1
+        return intent, agent
+
+    def get(self, intent: str):
+        agent = self._agents.get(intent)
+        if agent is not None:
+            with self._lock:
+                self._reuses[intent] = self._reuses.get(intent, 0) + 1
+            return agent
+        with self._lock:
+            key, agent = self._build(intent)
+            # неизвестные интенты отдаём через агент по умолчанию — тоже считаем повторным использованием
+            if key != intent:
+                self._reuses[key] = self._reuses.get(key, 0) + 1
+        return agent
+
+    def warm(self) -> float:
+        """Собирает все агенты заранее; возвращает время прогрева в секундах."""
+        t0 = time.perf_counter()
+        with self._lock:
+            for intent in self._factories():
+                self._build(intent)
+        self.warmup_seconds = time.perf_counter() - t0
+        log.info(f"agents warmed in {self.warmup_seconds:.3f}s: {sorted(self._agents)}")
+        return self.warmup_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "warmed": self.warmup_seconds is not None,
+                "warmup_seconds": self.warmup_seconds,
+                "agents": sorted(self._agents),
+                "builds": dict(self._builds),
+                "reuses": dict(self._reuses),
+            }
+
+# Singleton на процесс приложения
+registry = AgentRegistry()
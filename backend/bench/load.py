@@ -0,0 +1,170 @@
+# backend/bench/load.py
+# Нагрузочный прогон /route и /intent/classify без сети: поднимает stub OpenAI (backend.bench.stub_openai)
+# и для каждой комбинации QT_ENABLE / QT_MULTI / QT_HYDE / USE_RERANK — отдельный процесс приложения
+# (настройки читаются при импорте), затем гоняет запросы с заданной конкурентностью.
+# Отчёт: throughput и p50/p95/p99 по каждой комбинации и эндпоинту. Кэши по умолчанию выключены,
+# чтобы повторяющиеся запросы не превращали замер в замер кэша (--caches — оставить как в проде).
+#
+#   python -m backend.bench.load --requests 200 --concurrency 16
+#   python -m backend.bench.load --only QT_ENABLE=1 USE_RERANK=1 --chat-latency const:300 --json out.json
+from __future__ import annotations
+from typing import Any, Dict, Iterator, List, Optional
+import argparse, asyncio, itertools, json, os, subprocess, sys, tempfile, time
+
+import httpx
+import numpy as np
+
+from backend.bench.rerank import DEFAULT_QUERIES
+from backend.bench.stub_openai import add_latency_args
+
+COMBO_KEYS = ("QT_ENABLE", "QT_MULTI", "QT_HYDE", "USE_RERANK")
+ENDPOINTS = {"route": "/route", "intent": "/intent/classify"}
+
+_NO_CACHES = {"INTENT_CACHE": "0", "ANSWER_CACHE": "0", "RERANK_CACHE": "0", "EMB_CACHE": "0"}
+
+def combos(only: Optional[Dict[str, str]] = None) -> Iterator[Dict[str, str]]:
+    """Все осмысленные комбинации: без QT_ENABLE флаги QT_MULTI/QT_HYDE ни на что не влияют."""
+    for qt, multi, hyde, rerank in itertools.product("01", repeat=4):
+        if qt == "0" and (multi == "1" or hyde == "1"):
+            continue
+        combo = dict(zip(COMBO_KEYS, (qt, multi, hyde, rerank)))
+        if only and any(combo.get(k) != v for k, v in only.items()):
+            continue
+        yield combo
+
+def _spawn(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    # stderr во временный файл: PIPE, который никто не читает, заполнится логами и остановит процесс
+    log = tempfile.TemporaryFile()
+    proc = subprocess.Popen([sys.executable, "-m", *args], env={**os.environ, **env},
+                            stdout=subprocess.DEVNULL, stderr=log)
+    proc.log = log
+    return proc
+
+def _tail(proc: subprocess.Popen) -> str:
+    proc.log.seek(0)
+    return proc.log.read().decode(errors="replace")[-2000:]
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url}: process exited\n{_tail(proc)}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url}: not ready after {timeout}s")
+
+def _stop(proc: Optional[subprocess.Popen]):
+    if proc is not None and proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+def _pct(xs: List[float], p: float) -> float:
+    return round(float(np.percentile(xs, p)), 1) if xs else 0.0
+
+async def _load(base: str, path: str, queries: List[str], requests: int, concurrency: int,
+                sessions: int) -> Dict[str, Any]:
+    lat: List[float] = []
+    errors = 0
+    counter = itertools.count()
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            payload = {"text": queries[i % len(queries)], "session_id": f"load-{i % sessions}"}
+            t0 = time.perf_counter()
+            try:
+                r = await client.post(path, json=payload)
+                ok = r.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                lat.append((time.perf_counter() - t0) * 1000)
+            else:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, timeout=120.0, limits=limits) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(len(lat) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": _pct(lat, 50),
+        "p95_ms": _pct(lat, 95),
+        "p99_ms": _pct(lat, 99),
+    }
+
+def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    stub, stub_url = None, args.stub_url
+    if not stub_url:
+        stub_url = f"http://127.0.0.1:{args.stub_port}"
+        stub = _spawn(["backend.bench.stub_openai", "--port", str(args.stub_port),
+                       "--chat-latency", args.chat_latency, "--embed-latency", args.embed_latency,
+                       "--token-ms", str(args.token_ms), "--dim", str(args.dim)], {})
+    rows: List[Dict[str, Any]] = []
+    try:
+        if stub is not None:
+            _wait_ready(f"{stub_url}/health", stub)
+        only = dict(kv.split("=", 1) for kv in args.only) if args.only else None
+        for combo in combos(only):
+            env = {
+                "OPENAI_BASE_URL": f"{stub_url}/v1",
+                "OPENAI_API_KEY": "stub",
+                "LOG_LEVEL": "WARNING",
+                "TRACE_SAMPLE_RATE": "0",
+                "SESSION_BACKEND": "memory",
+                **({} if args.caches else _NO_CACHES),
+                **combo,
+            }
+            app = _spawn(["uvicorn", "backend.main:app", "--port", str(args.app_port), "--log-level", "warning"], env)
+            base = f"http://127.0.0.1:{args.app_port}"
+            try:
+                _wait_ready(f"{base}/health", app)
+                for name in args.endpoints:
+                    path = ENDPOINTS[name]
+                    if args.warmup:
+                        asyncio.run(_load(base, path, DEFAULT_QUERIES, args.warmup, min(args.warmup, args.concurrency),
+                                          args.sessions))
+                    row = {**{k: int(v) for k, v in combo.items()}, "endpoint": name}
+                    row.update(asyncio.run(_load(base, path, DEFAULT_QUERIES, args.requests, args.concurrency,
+                                                 args.sessions)))
+                    rows.append(row)
+                    print("  ".join(f"{k}={v}" for k, v in row.items()), flush=True)
+            finally:
+                _stop(app)
+    finally:
+        _stop(stub)
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон /route и /intent/classify против локального stub OpenAI")
+    parser.add_argument("--requests", type=int, default=200, help="запросов на комбинацию и эндпоинт")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--sessions", type=int, default=32, help="число разных session_id в нагрузке")
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=list(ENDPOINTS))
+    parser.add_argument("--only", nargs="*", default=None, help="фильтр комбинаций, например QT_ENABLE=1 USE_RERANK=0")
+    parser.add_argument("--caches", action="store_true", help="не выключать кэши интентов/ответов/rerank/эмбеддингов")
+    parser.add_argument("--stub-url", default=None, help="уже запущенный stub (иначе поднимается свой)")
+    parser.add_argument("--stub-port", type=int, default=8900)
+    parser.add_argument("--app-port", type=int, default=8901)
+    parser.add_argument("--json", default=None, help="сохранить строки отчёта в файл")
+    add_latency_args(parser)
+    args = parser.parse_args()
+
+    rows = run(args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,82 @@
+# backend/bench/rerank.py
+# Сравнение локального MMR-reranker (RERANK_MODE=mmr) с LLM-reranker на одних и тех же кандидатах.
+# LLM-ранжирование берётся за эталон: считаем совпадение top-1 и overlap@k, задержки и сетевые вызовы.
+#
+#   python -m backend.bench.rerank --queries data/eval/queries.txt --top-k 4
+from __future__ import annotations
+from typing import Dict, List
+import argparse, time
+import numpy as np
+
+from backend.rag.mmr import LocalReranker
+from backend.rag.reranker import Reranker
+from backend.rag.retriever import Retriever
+
+DEFAULT_QUERIES = [
+    "Что такое мурабаха?",
+    "Чем сукук отличается от облигации?",
+    "Как работает иджара при покупке авто?",
+    "Какие депозиты есть у Zaman Bank?",
+    "Можно ли получить карту без комиссии?",
+    "What is wakala deposit?",
+    "Is riba allowed in Islamic banking?",
+    "How does musharaka financing work?",
+]
+
+def _pct(xs: List[float], p: float) -> float:
+    return float(np.percentile(xs, p)) if xs else 0.0
+
+def run(queries: List[str], top_k: int = 4, candidates_k: int = 8) -> Dict[str, Dict[str, float]]:
+    retriever = Retriever(top_k=top_k)
+    local = LocalReranker(retriever.store)
+    llm = Reranker()
+    lat = {"mmr": [], "llm": []}
+    calls = {"mmr": 0, "llm": 0}
+    top1, overlap, n = 0, 0.0, 0
+    for q in queries:
+        # общие кандидаты: один dense+BM25 поиск без query transform
+        candidates, qvecs = retriever._local_candidates([q], candidates_k)
+        if not candidates:
+            continue
+        t0 = time.perf_counter()
+        mine = local.rank(q, candidates, qvecs, top_k=top_k)
+        lat["mmr"].append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        ref = llm.rerank(q, [c["text"] for c in candidates], top_k=top_k)
+        lat["llm"].append((time.perf_counter() - t0) * 1000)
+        calls["llm"] += 1
+        if not ref:
+            continue
+        a, b = [r["index"] for r in mine], [r["index"] for r in ref]
+        top1 += a[0] == b[0]
+        overlap += len(set(a) & set(b)) / max(1, min(top_k, len(b)))
+        n += 1
+
+    report = {}
+    for mode in ("mmr", "llm"):
+        report[mode] = {
+            "p50_ms": round(_pct(lat[mode], 50), 2),
+            "p95_ms": round(_pct(lat[mode], 95), 2),
+            "calls_per_query": round(calls[mode] / max(1, len(lat[mode])), 2),
+        }
+    report["agreement"] = {
+        "queries": n,
+        "top1": round(top1 / n, 3) if n else 0.0,
+        f"overlap@{top_k}": round(overlap / n, 3) if n else 0.0,
+    }
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MMR reranker vs LLM reranker: качество (LLM как эталон) и задержка")
+    parser.add_argument("--queries", default=None, help="файл с запросами, по одному в строке")
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--candidates", type=int, default=8)
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [ln.strip() for ln in f if ln.strip()]
+    for section, row in run(queries, args.top_k, args.candidates).items():
+        print(f"{section:>10}: " + "  ".join(f"{k}={v}" for k, v in row.items()))
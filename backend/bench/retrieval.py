@@ -0,0 +1,163 @@
+# backend/bench/retrieval.py
+# Качество поиска против задержки на золотом наборе (data/eval/golden.jsonl, RU/EN запросы к
+# data/knowledge_base/islamic_finance_kb.md). Для каждой пары «бэкенд стора × конфигурация Retriever»
+# считаем recall@k и MRR по id чанков, p50/p95 задержки запроса и число сетевых вызовов (из token_meter).
+#
+# Id чанка — "<имя файла>#<номер чанка>" из meta стора: не зависит от uuid записей и ОС, на которой шёл ingest.
+# Кэши эмбеддингов и rerank по умолчанию выключены, иначе вторая конфигурация получает векторы из кэша
+# первой и выглядит быстрее и «бесплатнее», чем есть (--caches — оставить).
+#
+#   python -m backend.bench.retrieval
+#   python -m backend.bench.retrieval --modes hybrid lexical --rerank none mmr llm --qt 0 1 --top-k 4 8
+#   python -m backend.bench.retrieval --backends float32/flat int8/flat float32/ivf --json out.json
+from __future__ import annotations
+from typing import Any, Dict, Iterator, List, Optional
+from contextlib import contextmanager
+import argparse, itertools, json, shutil, tempfile, time
+import numpy as np
+
+from backend.metrics import token_meter
+from backend.utils.settings import settings
+
+GOLDEN = "data/eval/golden.jsonl"
+
+def chunk_id(meta: Dict[str, Any]) -> str:
+    # source в сторе записан через os.path.relpath той ОС, где шёл ingest (бывает с обратными слешами)
+    source = str(meta.get("source", "")).replace("\\", "/").rsplit("/", 1)[-1]
+    return f"{source}#{meta.get('chunk')}"
+
+def load_golden(path: str = GOLDEN, lang: Optional[str] = None) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    return [it for it in items if lang is None or it.get("lang") == lang]
+
+def score_ranking(found: List[str], relevant: List[str], ks: List[int]) -> Dict[str, float]:
+    """recall@k по каждому k и reciprocal rank первого релевантного чанка."""
+    rel = set(relevant)
+    out = {f"recall@{k}": len(rel & set(found[:k])) / len(rel) for k in ks}
+    out["rr"] = next((1.0 / i for i, cid in enumerate(found, 1) if cid in rel), 0.0)
+    return out
+
+@contextmanager
+def overrides(**values):
+    """Временно подменить поля settings (Retriever и его компоненты читают их при создании и в вызовах)."""
+    old = {k: getattr(settings, k) for k in values}
+    for k, v in values.items():
+        setattr(settings, k, v)
+    try:
+        yield
+    finally:
+        for k, v in old.items():
+            setattr(settings, k, v)
+
+def configs(modes: List[str], qt: List[int], rerank: List[str], top_k: List[int],
+            min_score: List[float]) -> Iterator[Dict[str, Any]]:
+    for mode, q, rr, k, ms in itertools.product(modes, qt, rerank, top_k, min_score):
+        yield {"mode": mode, "qt": q, "rerank": rr, "top_k": k, "min_score": ms}
+
+def _config_settings(cfg: Dict[str, Any], hyde: bool) -> Dict[str, Any]:
+    return {
+        "RETRIEVAL_MODE": cfg["mode"],
+        "QT_ENABLE": bool(cfg["qt"]),
+        "QT_HYDE": bool(cfg["qt"]) and hyde,
+        "USE_RERANK": cfg["rerank"] != "none",
+        "RERANK_MODE": cfg["rerank"] if cfg["rerank"] != "none" else settings.RERANK_MODE,
+    }
+
+@contextmanager
+def open_backend(spec: str, store_dir: str):
+    """'<dtype>/<flat|ivf>' -> LocalVectorStore. IVF строится на копии стора (без порога VS_IVF_MIN_ROWS),
+    чтобы не оставлять ivf.npz в рабочем каталоге и проверить индекс даже на маленькой БЗ."""
+    from backend.rag.store import LocalVectorStore
+
+    dtype, _, index = spec.partition("/")
+    index = index or "flat"
+    if index != "ivf":
+        yield LocalVectorStore(store_dir, dtype=dtype, index=index, auto_compact=False)
+        return
+    tmp = tempfile.mkdtemp(prefix="bench-ivf-")
+    try:
+        shutil.copytree(store_dir, tmp, dirs_exist_ok=True)
+        with overrides(VS_IVF_MIN_ROWS=0):
+            yield LocalVectorStore(tmp, dtype=dtype, index=index, auto_compact=False)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def evaluate(retriever, golden: List[Dict[str, Any]], ks: List[int]) -> Dict[str, Any]:
+    lat: List[float] = []
+    calls: List[int] = []
+    by_component: Dict[str, int] = {}
+    sums: Dict[str, float] = {}
+    misses: List[str] = []
+    for item in golden:
+        m = token_meter.start()
+        t0 = time.perf_counter()
+        hits = retriever.retrieve(item["query"])
+        lat.append((time.perf_counter() - t0) * 1000)
+        calls.append(len(m.calls))
+        for component, *_ in m.calls:
+            by_component[component] = by_component.get(component, 0) + 1
+
+        found = [chunk_id(h.get("meta") or {}) for h in hits]
+        row = score_ranking(found, item["relevant"], ks)
+        for k, v in row.items():
+            sums[k] = sums.get(k, 0.0) + v
+        if row["rr"] == 0.0:
+            misses.append(item["id"])
+    token_meter.bind(None)
+
+    n = max(1, len(golden))
+    report: Dict[str, Any] = {f"recall@{k}": round(sums.get(f"recall@{k}", 0.0) / n, 3) for k in ks}
+    report["mrr"] = round(sums.get("rr", 0.0) / n, 3)
+    report.update({
+        "p50_ms": round(float(np.percentile(lat, 50)), 2) if lat else 0.0,
+        "p95_ms": round(float(np.percentile(lat, 95)), 2) if lat else 0.0,
+        "calls_per_query": round(sum(calls) / n, 2),
+        "calls_by_component": {k: round(v / n, 2) for k, v in sorted(by_component.items())},
+        "degraded": retriever.degraded,   # сколько запросов dense/hybrid ушли в BM25 из-за отказа embeddings
+        "misses": misses,
+    })
+    return report
+
+def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    from backend.rag.retriever import Retriever
+
+    golden = load_golden(args.golden, args.lang)
+    ks = sorted(set(args.k))
+    rows: List[Dict[str, Any]] = []
+    cache_off = {} if args.caches else {"EMB_CACHE": False, "RERANK_CACHE": False}
+    with overrides(**cache_off):
+        for backend in args.backends:
+            with open_backend(backend, args.store) as store:
+                for cfg in configs(args.modes, args.qt, args.rerank, args.top_k, args.min_score):
+                    with overrides(**_config_settings(cfg, args.hyde)):
+                        retriever = Retriever(top_k=cfg["top_k"], min_score=cfg["min_score"], store=store)
+                        report = evaluate(retriever, golden, ks)
+                    row = {"backend": backend, **cfg, "queries": len(golden), **report}
+                    rows.append(row)
+                    print("  ".join(f"{k}={v}" for k, v in row.items()
+                                    if k not in ("calls_by_component", "misses")), flush=True)
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="recall@k / MRR / задержка / сетевые вызовы по конфигурациям Retriever")
+    parser.add_argument("--golden", default=GOLDEN)
+    parser.add_argument("--lang", default=None, choices=["ru", "en"], help="только запросы на одном языке")
+    parser.add_argument("--store", default="data/embeddings")
+    parser.add_argument("--backends", nargs="+", default=["float32/flat", "int8/flat"],
+                        help="<dtype>/<flat|ivf>, dtype: float32 | float16 | int8")
+    parser.add_argument("--modes", nargs="+", default=["dense", "hybrid", "lexical"], choices=["dense", "hybrid", "lexical"])
+    parser.add_argument("--qt", nargs="+", type=int, default=[0], choices=[0, 1], help="query transform (rewrite + multi-query)")
+    parser.add_argument("--hyde", action="store_true", help="при qt=1 добавлять HyDE")
+    parser.add_argument("--rerank", nargs="+", default=["none", "mmr"], choices=["none", "mmr", "llm"])
+    parser.add_argument("--top-k", nargs="+", type=int, default=[4])
+    parser.add_argument("--min-score", nargs="+", type=float, default=[0.2])
+    parser.add_argument("--k", nargs="+", type=int, default=[1, 4], help="для каких k считать recall@k")
+    parser.add_argument("--caches", action="store_true", help="не выключать кэши эмбеддингов и rerank")
+    parser.add_argument("--json", default=None, help="сохранить полный отчёт (с промахами по запросам)")
+    args = parser.parse_args()
+
+    rows = run(args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
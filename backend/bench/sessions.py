@@ -0,0 +1,82 @@
+# backend/bench/sessions.py
+# Конкуренция за in-memory хранилища сессий при большом числе потоков (как sync-хендлеры FastAPI в threadpool).
+# Каждая операция — шаг /route: append_and_get в SessionMemory + read-modify-write счётчика в SessionState.
+# Сравниваем одну полосу (глобальный замок) и SESSION_LOCK_STRIPES полос, разные сессии и одну общую;
+# lost — сколько инкрементов потеряно (должно быть 0; режим --no-lock показывает, что без замка они теряются).
+#
+#   python -m backend.bench.sessions --threads 16 64 256 --ops 2000
+from __future__ import annotations
+from typing import Dict, List
+import argparse, threading, time
+import numpy as np
+
+from backend.memory.session import SessionMemory
+from backend.memory.state import SessionState
+from backend.utils.settings import settings
+
+def _step(mem: SessionMemory, st: SessionState, sid: str, locked: bool):
+    mem.append_and_get(sid, "user", "ping")
+    if locked:
+        with st.lock(sid):
+            cur = st.get(sid).get("n", 0)
+            time.sleep(0)  # уступаем GIL между чтением и записью, как при реальном I/O
+            st.update(sid, {"n": cur + 1})
+    else:
+        cur = st.get(sid).get("n", 0)
+        time.sleep(0)
+        st.update(sid, {"n": cur + 1})
+
+def run_case(threads: int, ops: int, stripes: int, shared: bool, locked: bool = True) -> Dict[str, float]:
+    mem = SessionMemory(max_messages=8, max_sessions=max(threads, 1) * 2, stripes=stripes)
+    st = SessionState(stripes=stripes)
+    sids = ["shared"] * threads if shared else [f"s{i}" for i in range(threads)]
+    lat: List[List[float]] = [[] for _ in range(threads)]
+    start = threading.Barrier(threads + 1)
+
+    def worker(i: int):
+        sid, out = sids[i], lat[i]
+        start.wait()
+        for _ in range(ops):
+            t0 = time.perf_counter()
+            _step(mem, st, sid, locked)
+            out.append(time.perf_counter() - t0)
+
+    pool = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(threads)]
+    for t in pool:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    expected = threads * ops
+    got = sum(st.get(sid).get("n", 0) for sid in set(sids))
+    all_lat = np.concatenate([np.asarray(x) for x in lat]) * 1000
+    return {
+        "ops_per_s": round(expected / elapsed, 1),
+        "p50_ms": round(float(np.percentile(all_lat, 50)), 3),
+        "p99_ms": round(float(np.percentile(all_lat, 99)), 3),
+        "lost": expected - got,
+    }
+
+def run(threads: List[int], ops: int, stripes: int, locked: bool = True) -> List[Dict[str, object]]:
+    rows = []
+    for n in threads:
+        for s in (1, stripes):
+            for shared in (False, True):
+                row = {"threads": n, "stripes": s, "sessions": "shared" if shared else "distinct"}
+                row.update(run_case(n, ops, s, shared, locked))
+                rows.append(row)
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Контеншн SessionMemory/SessionState: полосы замков vs глобальный замок")
+    parser.add_argument("--threads", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--ops", type=int, default=2000, help="операций на поток")
+    parser.add_argument("--stripes", type=int, default=settings.SESSION_LOCK_STRIPES)
+    parser.add_argument("--no-lock", action="store_true", help="read-modify-write без state.lock (для сравнения)")
+    args = parser.parse_args()
+
+    for row in run(args.threads, args.ops, args.stripes, locked=not args.no_lock):
+        print("  ".join(f"{k}={v}" for k, v in row.items()))
@@ -0,0 +1,169 @@
+# backend/bench/stub_openai.py
+# Локальный OpenAI-совместимый stub для нагрузочных тестов без сети:
+# /v1/chat/completions (обычный ответ, JSON-mode и stream=True) и /v1/embeddings
+# с настраиваемыми распределениями задержки. Ответы правдоподобны для каждого компонента
+# (интент-классификатор, query transform, reranker, извлечение слотов), чтобы пайплайн шёл по тем же веткам.
+#
+#   python -m backend.bench.stub_openai --port 8900 --chat-latency lognormal:400,0.4 --embed-latency lognormal:80,0.3
+#   OPENAI_BASE_URL=http://127.0.0.1:8900/v1 uvicorn backend.main:app
+from __future__ import annotations
+from typing import Any, AsyncIterator, Dict, List
+import argparse, asyncio, base64, hashlib, json, random, re, time, uuid
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from backend.nlp.intent_regex import fallback_predict
+
+class Latency:
+    """Распределение задержки в мс: const:50 | uniform:50,150 | normal:200,50 | lognormal:<медиана>,<sigma>."""
+    KINDS = ("const", "uniform", "normal", "lognormal")
+
+    def __init__(self, spec: str):
+        kind, _, args = spec.partition(":")
+        self.kind = kind.strip().lower()
+        self.args = [float(x) for x in args.split(",") if x.strip()]
+        if self.kind not in self.KINDS or not self.args:
+            raise ValueError(f"bad latency spec {spec!r}: expected one of {self.KINDS} with parameters")
+        self.spec = spec
+
+    def sample(self) -> float:
+        """Секунды."""
+        a = self.args
+        if self.kind == "const":
+            ms = a[0]
+        elif self.kind == "uniform":
+            ms = random.uniform(a[0], a[1] if len(a) > 1 else a[0])
+        elif self.kind == "normal":
+            ms = random.gauss(a[0], a[1] if len(a) > 1 else 0.0)
+        else:
+            ms = a[0] * float(np.exp(random.gauss(0.0, a[1] if len(a) > 1 else 0.5)))
+        return max(0.0, ms) / 1000.0
+
+_WORDS = ("мурабаха сукук иджара вклад депозит карта прибыль шариат договор срок сумма взнос "
+          "накопления цель банк продукт условия ставка риск доход").split()
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def _answer(seed: str, n_words: int) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(_WORDS) for _ in range(n_words)).capitalize() + "."
+
+def _reply(body: Dict[str, Any], answer_words: int) -> str:
+    """Содержимое ответа в зависимости от того, какой компонент спрашивает (по system-промпту)."""
+    msgs = body.get("messages") or []
+    system = " ".join(m.get("content") or "" for m in msgs if m.get("role") == "system")
+    user = next((m.get("content") or "" for m in reversed(msgs) if m.get("role") == "user"), "")
+
+    if "intent classifier" in system:
+        fb = fallback_predict(user)
+        return json.dumps({"intent": fb["intent"], "confidence": 0.9, "matched_reasons": fb.get("matched_rules", [])})
+    if "reranker" in system:
+        n = len(re.findall(r"^\[(\d+)\]", user, re.M))
+        rng = random.Random(user)
+        return json.dumps({"ranking": [{"index": i, "score": round(rng.random(), 3)} for i in range(n)]})
+    if "alternative phrasings" in system:
+        m = re.search(r"up to (\d+)", system)
+        k = int(m.group(1)) if m else 3
+        return json.dumps({"queries": [f"{user} {w}" for w in _WORDS[:k]]}, ensure_ascii=False)
+    if "goal-setting slots" in system:
+        return json.dumps({k: None for k in ("goal_name", "target_amount", "currency", "deadline_date",
+                                             "current_savings", "monthly_contribution", "expected_apr", "notes")})
+    if "rewrite the user's message" in system:
+        return user
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        return "{}"
+    return _answer(user, answer_words)
+
+def _embedding(text: str, dim: int, b64: bool = False) -> List[float] | str:
+    rng = np.random.default_rng(int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16))
+    v = rng.standard_normal(dim).astype(np.float32)
+    v /= np.linalg.norm(v)
+    # openai SDK при установленном numpy просит base64 (как и настоящий API отдаёт его быстрее списка float'ов)
+    return base64.b64encode(v.tobytes()).decode("ascii") if b64 else v.tolist()
+
+def make_app(chat: Latency, embed: Latency, token_ms: float = 15.0, dim: int = 1536, answer_words: int = 60) -> FastAPI:
+    app = FastAPI(title="OpenAI stub")
+    app.state.calls = {"chat": 0, "stream": 0, "embeddings": 0}
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok", "chat": chat.spec, "embed": embed.spec, "calls": app.state.calls}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        content = _reply(body, answer_words)
+        prompt_tokens = sum(_tokens(m.get("content") or "") for m in body.get("messages") or [])
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": _tokens(content),
+                 "total_tokens": prompt_tokens + _tokens(content)}
+        cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        await asyncio.sleep(chat.sample())  # время до первого токена / всего ответа
+
+        if not body.get("stream"):
+            app.state.calls["chat"] += 1
+            return JSONResponse({
+                "id": cid, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        app.state.calls["stream"] += 1
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        def chunk(delta: Dict[str, Any], finish: str | None = None, **extra) -> str:
+            choices = [{"index": 0, "delta": delta, "finish_reason": finish}] if delta is not None else []
+            data = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": choices, **extra}
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        async def events() -> AsyncIterator[str]:
+            yield chunk({"role": "assistant", "content": ""})
+            for i, word in enumerate(content.split(" ")):
+                if i and token_ms:
+                    await asyncio.sleep(token_ms / 1000.0)
+                yield chunk({"content": word if i == 0 else " " + word})
+            yield chunk({}, "stop")
+            if include_usage:
+                yield chunk(None, usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        await asyncio.sleep(embed.sample())
+        app.state.calls["embeddings"] += 1
+        tokens = sum(_tokens(t) for t in inputs)
+        b64 = body.get("encoding_format") == "base64"
+        return JSONResponse({
+            "object": "list", "model": body.get("model", "stub"),
+            "data": [{"object": "embedding", "index": i, "embedding": _embedding(t, dim, b64)} for i, t in enumerate(inputs)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    return app
+
+def add_latency_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--chat-latency", default="lognormal:400,0.4", help="задержка chat completions, мс")
+    parser.add_argument("--embed-latency", default="lognormal:80,0.3", help="задержка embeddings, мс")
+    parser.add_argument("--token-ms", type=float, default=15.0, help="пауза между токенами при stream=True")
+    parser.add_argument("--dim", type=int, default=1536, help="размерность эмбеддингов (как у стора)")
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI-совместимый stub с настраиваемыми задержками")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_latency_args(parser)
+    args = parser.parse_args()
+    app = make_app(Latency(args.chat_latency), Latency(args.embed_latency), args.token_ms, args.dim)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
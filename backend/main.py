@@ -1,9 +1,27 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from backend.routers import intents
 from backend.routers import router as processing_router
+from backend.agents.registry import registry
+from backend.memory.session import memory
+from backend.rag.embed_cache import embedding_cache
+from backend.nlp.intent_cache import intent_cache
+from backend.rag.answer_cache import answer_cache
+from backend.rag.reranker import rerank_cache
+from backend.metrics.token_meter import meter
+from backend.metrics import tracing
 
-app = FastAPI(title="Zaman AI — Intent/Router Service", version="0.2.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # собираем агентов (Retriever, стор, клиенты) один раз на процесс, до первого запроса
+    registry.warm()
+    memory.start_sweeper()
+    yield
+    memory.stop_sweeper()
+
+app = FastAPI(title="Zaman AI — Intent/Router Service", version="0.2.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,3 +37,38 @@ app.include_router(processing_router.router)
 @app.get("/health")
 def health():
     return {"status": "ok"}
+
+@app.get("/health/agents")
+def health_agents():
+    return registry.stats()
+
+@app.get("/health/sessions")
+def health_sessions():
+    return memory.stats()
+
+@app.get("/health/retrieval")
+def health_retrieval():
+    return registry.retriever().stats()
+
+@app.get("/health/caches")
+def health_caches():
+    emb = embedding_cache()
+    icache = intent_cache()
+    acache = answer_cache()
+    rcache = rerank_cache()
+    return {
+        "embeddings": emb.stats() if emb is not None else None,
+        "intents": icache.stats() if icache is not None else None,
+        "answers": acache.stats() if acache is not None else None,
+        "rerank": rcache.stats() if rcache is not None else None,
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Токены, стоимость и задержки LLM/embedding-вызовов по компонентам и моделям (формат Prometheus)."""
+    return PlainTextResponse(meter.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/traces")
+def debug_traces(limit: int = 50, slow_only: bool = False):
+    """Последние trace'ы /route (сэмплированные по TRACE_SAMPLE_RATE и все медленные) с разбивкой по стадиям."""
+    return {"stats": tracing.buffer.stats(), "traces": tracing.buffer.recent(limit, slow_only)}
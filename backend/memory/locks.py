@@ -0,0 +1,40 @@
+from __future__ import annotations
+from typing import Iterator, List
+from contextlib import contextmanager
+import threading, weakref, zlib
+
+def stripe_of(sid: str, n: int) -> int:
+    """Номер полосы для session_id: стабильный между процессами (в отличие от hash() со случайной солью)."""
+    return zlib.crc32(sid.encode("utf-8")) % n
+
+class SessionLocks:
+    """
+    Блокировки на уровне сессии для read-modify-write состояния (слоты целей и т.п.).
+    У каждой сессии свой RLock, поэтому разные сессии не ждут друг друга даже при совпадении полосы;
+    короткая блокировка полосы защищает только реестр замков. Замки хранятся по слабым ссылкам
+    и исчезают, когда их никто не держит, — реестр не растёт с числом сессий.
+    """
+    def __init__(self, stripes: int = 64):
+        self.n = max(1, int(stripes))
+        self._guards: List[threading.Lock] = [threading.Lock() for _ in range(self.n)]
+        self._locks: List["weakref.WeakValueDictionary[str, threading.RLock]"] = [
+            weakref.WeakValueDictionary() for _ in range(self.n)
+        ]
+
+    def get(self, sid: str):
+        i = stripe_of(sid, self.n)
+        with self._guards[i]:
+            lock = self._locks[i].get(sid)
+            if lock is None:
+                lock = threading.RLock()
+                self._locks[i][sid] = lock
+            return lock
+
+    @contextmanager
+    def hold(self, sid: str) -> Iterator[None]:
+        lock = self.get(sid)  # сильная ссылка живёт до выхода из блока
+        with lock:
+            yield
+
+    def __len__(self) -> int:
+        return sum(len(d) for d in self._locks)
@@ -0,0 +1,207 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterator, List, Optional
+from contextlib import contextmanager
+import asyncio, json, threading
+
+try:
+    import redis
+except Exception:  # redis нужен только при SESSION_BACKEND=redis
+    redis = None
+
+from backend.memory.session import Message, Role
+from backend.utils.settings import settings
+from backend.memory.summary import History, HistoryNote, render_line
+
+def _client(url: str):
+    if redis is None:
+        raise RuntimeError("SESSION_BACKEND=redis требует пакет redis (pip install redis)")
+    return redis.Redis.from_url(url, decode_responses=True, socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                                socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT)
+
+def _dump(role: str, content: str, meta: Optional[Dict]) -> str:
+    rec = {"r": role, "c": content}
+    if meta:
+        rec["m"] = meta
+    return json.dumps(rec, ensure_ascii=False, separators=(",", ":"))
+
+def _load(raw: str) -> Message:
+    rec = json.loads(raw)
+    return Message(rec["r"], rec["c"], rec.get("m"))
+
+class RedisSessionMemory:
+    """
+    Память диалогов в Redis (общая для всех воркеров/реплик): список JSON-сообщений на сессию.
+    Каждая операция — один pipelined round-trip; TTL продлевается на сервере при каждом обращении,
+    длина списка ограничивается LTRIM, так что ни sweeper, ни LRU в процессе не нужны.
+    Рядом лежит сводка истории: список готовых строк (RPUSH на append, без пересборки) и сжатая
+    LLM-часть — строки старше окна сворачивает HistoryCompactor, если он включён.
+    """
+    def __init__(self, client, max_messages: int = 16, ttl_seconds: int = 60*60*6, prefix: str = "zaman:",
+                 summary_window: int = 10, compactor=None):
+        self.r = client
+        self.max_messages = max_messages
+        self.ttl = int(ttl_seconds)
+        self.prefix = prefix
+        self.summary_window = summary_window
+        self.compactor = compactor
+        # с компактором строки старше окна ждут сжатия; запас на случай, если LLM недоступна
+        self._summary_cap = summary_window + (compactor.every * 4 if compactor is not None else 0)
+
+    @classmethod
+    def from_url(cls, url: str, **kw) -> "RedisSessionMemory":
+        return cls(_client(url), **kw)
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}msgs:{session_id}"
+
+    def _sum_keys(self, session_id: str):
+        return f"{self.prefix}sum:{session_id}", f"{self.prefix}sumc:{session_id}"
+
+    def _push(self, pipe, session_id: str, role: Role, content: str, meta: Optional[Dict]):
+        key = self._key(session_id)
+        pipe.rpush(key, _dump(role, content, meta))
+        pipe.ltrim(key, -self.max_messages, -1)
+        pipe.expire(key, self.ttl)
+        line = render_line(role, content)
+        if line is not None:
+            lines_key, _ = self._sum_keys(session_id)
+            pipe.rpush(lines_key, line)
+            pipe.ltrim(lines_key, -self._summary_cap, -1)
+            pipe.expire(lines_key, self.ttl)
+
+    def _read(self, pipe, session_id: str):
+        lines_key, compact_key = self._sum_keys(session_id)
+        pipe.lrange(self._key(session_id), 0, -1)
+        pipe.lrange(lines_key, -self.summary_window, -1)
+        pipe.get(compact_key)
+        pipe.llen(lines_key)
+
+    def _history(self, session_id: str, raw: List[str], lines: List[str], compact: Optional[str], n_lines: int) -> History:
+        if self.compactor is not None and n_lines - self.summary_window >= self.compactor.every:
+            self.compactor.submit(lambda: self._compact(session_id))
+        return History([_load(x) for x in raw], HistoryNote(compact or "", tuple(lines)))
+
+    def _compact(self, session_id: str):
+        lines_key, compact_key = self._sum_keys(session_id)
+        lock_key = f"{self.prefix}sumlock:{session_id}"
+        if not self.r.set(lock_key, "1", nx=True, ex=60):
+            return  # сессию уже сжимает другой воркер
+        try:
+            old = self.r.lrange(lines_key, 0, -(self.summary_window + 1))
+            if len(old) < self.compactor.every:
+                return
+            compact = self.compactor.compact(self.r.get(compact_key) or "", old)
+            pipe = self.r.pipeline(transaction=True)
+            pipe.set(compact_key, compact, ex=self.ttl)
+            pipe.ltrim(lines_key, len(old), -1)  # новые строки дописываются в хвост — срезаем ровно сжатые
+            pipe.execute()
+        finally:
+            self.r.delete(lock_key)
+
+    def append(self, session_id: str, role: Role, content: str, meta: Optional[Dict]=None):
+        pipe = self.r.pipeline(transaction=False)
+        self._push(pipe, session_id, role, content, meta)
+        pipe.execute()
+
+    def append_and_get(self, session_id: str, role: Role, content: str, meta: Optional[Dict]=None) -> History:
+        """append + get_messages одним round-trip (так /route пишет реплику пользователя и читает историю)."""
+        pipe = self.r.pipeline(transaction=True)
+        self._push(pipe, session_id, role, content, meta)
+        self._read(pipe, session_id)
+        return self._history(session_id, *pipe.execute()[-4:])
+
+    # async-хендлеры не должны ждать сеть Redis в цикле событий
+    async def aappend(self, session_id: str, role: Role, content: str, meta: Optional[Dict]=None):
+        await asyncio.to_thread(self.append, session_id, role, content, meta)
+
+    async def aappend_and_get(self, session_id: str, role: Role, content: str, meta: Optional[Dict]=None) -> History:
+        return await asyncio.to_thread(self.append_and_get, session_id, role, content, meta)
+
+    def get_messages(self, session_id: str) -> History:
+        pipe = self.r.pipeline(transaction=False)
+        self._read(pipe, session_id)
+        pipe.expire(self._key(session_id), self.ttl)
+        return self._history(session_id, *pipe.execute()[:4])
+
+    def clear(self, session_id: str):
+        self.r.delete(self._key(session_id), *self._sum_keys(session_id))
+
+    # протухание делает сам Redis (EXPIRE) — методы для совместимости с in-memory SessionMemory
+    def start_sweeper(self):
+        pass
+
+    def stop_sweeper(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        # число сессий не считаем: SCAN по msgs:* — O(всех ключей) общего Redis на каждую health-проверку;
+        # DBSIZE — O(1), но это все ключи базы, а не только сессии
+        return {"backend": "redis", "sessions": None, "db_keys": self.r.dbsize(), "max_messages": self.max_messages,
+                "ttl_seconds": self.ttl, "compactor": self.compactor.stats() if self.compactor is not None else None}
+
+class RedisSessionState:
+    """
+    Состояние сессии (слоты целей и т.п.) — JSON-строка с серверным TTL.
+    update() — read-modify-write под WATCH/MULTI: параллельные запросы одной сессии с разных воркеров
+    не теряют обновления друг друга. Для многошаговых изменений (GoalSlots, GoalAgent) — lock(sid):
+    распределённый замок Redis, реентерабельный внутри потока. Под замком — только чтение и запись
+    состояния, без сетевых вызовов к LLM: lock_timeout — и TTL замка, и сколько ждёт второй запрос.
+    """
+    def __init__(self, client, ttl_seconds: int = 60*60*12, prefix: str = "zaman:", lock_timeout: float = 5.0):
+        self.r = client
+        self.ttl = int(ttl_seconds)
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+        self._held = threading.local()
+
+    @classmethod
+    def from_url(cls, url: str, **kw) -> "RedisSessionState":
+        return cls(_client(url), **kw)
+
+    def _key(self, sid: str) -> str:
+        return f"{self.prefix}state:{sid}"
+
+    @contextmanager
+    def lock(self, sid: str) -> Iterator[None]:
+        held = self._held.__dict__.setdefault("sids", {})
+        if sid in held:  # повторный вход из того же потока (GoalAgent -> GoalSlots.update)
+            held[sid] += 1
+            try:
+                yield
+            finally:
+                held[sid] -= 1
+            return
+        # timeout — страховка от упавшего воркера: замок сам освободится
+        with self.r.lock(f"{self.prefix}lock:{sid}", timeout=self.lock_timeout, blocking_timeout=self.lock_timeout):
+            held[sid] = 1
+            try:
+                yield
+            finally:
+                del held[sid]
+
+    def get(self, sid: str) -> Dict[str, Any]:
+        key = self._key(sid)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.expire(key, self.ttl)
+        raw = pipe.execute()[0]
+        return json.loads(raw) if raw else {}
+
+    def update(self, sid: str, patch: Dict[str, Any]) -> Dict[str, Any]:
+        key = self._key(sid)
+        with self.r.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    st = json.loads(raw) if raw else {}
+                    st.update(patch or {})
+                    pipe.multi()
+                    pipe.set(key, json.dumps(st, ensure_ascii=False), ex=self.ttl)
+                    pipe.execute()
+                    return st
+                except redis.WatchError:
+                    continue  # ключ изменили между чтением и записью — повторяем
+
+    def clear(self, sid: str):
+        self.r.delete(self._key(sid))
@@ -1,45 +1,259 @@
 from __future__ import annotations
-from typing import Deque, Dict, List, Literal, Optional, Tuple
-from collections import deque
-import time
+from typing import Any, Deque, Dict, Iterator, List, Literal, Optional
+from collections import OrderedDict, deque
+import sys, threading, time
+
+from backend.memory.locks import stripe_of
+from backend.memory.summary import History, RollingSummary, history_compactor
+from backend.utils.settings import settings
+from backend.utils.logger import get_logger
+
+log = get_logger("session-memory")
 
 Role = Literal["user","assistant","system"]
 
+class Message:
+    """
+    Компактное сообщение истории: __slots__ вместо dict на каждое сообщение,
+    пустой meta не хранится. Поддерживает dict-доступ (m["role"], m.get("content")),
+    чтобы потребители истории (summarize_history, history_bucket, агенты) не менялись.
+    """
+    __slots__ = ("role", "content", "meta")
+    _FIELDS = ("role", "content", "meta")
+
+    def __init__(self, role: str, content: str, meta: Optional[Dict[str, Any]] = None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.meta = meta or None
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._FIELDS:
+            raise KeyError(key)
+        return self.get(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key == "meta":
+            return self.meta or {}
+        return getattr(self, key, default) if key in self._FIELDS else default
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._FIELDS
+
+    def keys(self):
+        return self._FIELDS
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"role": self.role, "content": self.content, "meta": self.meta or {}}
+
+    def nbytes(self) -> int:
+        n = sys.getsizeof(self) + sys.getsizeof(self.content)
+        if self.meta:
+            n += sys.getsizeof(self.meta) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self.meta.items())
+        return n
+
+    def __repr__(self) -> str:
+        return f"Message({self.role!r}, {self.content[:40]!r})"
+
+class _Session:
+    __slots__ = ("ts", "messages", "summary")
+
+    def __init__(self, ts: float, max_messages: int, window: int):
+        self.ts = ts
+        self.messages: Deque[Message] = deque(maxlen=max_messages)
+        self.summary = RollingSummary(window)
+
+class _Shard:
+    """Полоса SessionMemory: свой замок, своя LRU-очередь сессий и свои счётчики."""
+    __slots__ = ("lock", "store", "capacity", "evicted", "expired")
+
+    def __init__(self, capacity: int):
+        self.lock = threading.Lock()
+        # sid -> сессия; порядок = порядок активности
+        self.store: "OrderedDict[str, _Session]" = OrderedDict()
+        self.capacity = capacity
+        self.evicted = 0
+        self.expired = 0
+
 class SessionMemory:
     """
-    Простая in-memory память. Для продакшена замените на Redis/DB,
-    сохранив публичные методы: append(), get_messages(), clear().
+    In-memory память диалогов с ограничениями:
+    - не больше max_sessions сессий, вытесняется давно неактивная (LRU);
+    - фоновый sweeper раз в sweep_seconds удаляет сессии старше ttl, даже если к ним больше не обращаются.
+    Сессии разложены по stripes полосам (crc32(session_id) % stripes) со своими замками:
+    запросы разных сессий из threadpool почти не конкурируют, а операции одной сессии атомарны.
+    LRU и лимит max_sessions действуют внутри полосы (по max_sessions / stripes).
+    Вместе с сообщениями хранится сводка истории (RollingSummary), которая обновляется на append;
+    get_messages()/append_and_get() отдают History со снимком сводки, и summarize_history её не пересобирает.
+    Публичные методы: append(), get_messages(), clear(), stats().
     """
-    def __init__(self, max_messages: int = 16, ttl_seconds: int = 60*60*6):
-        self._store: Dict[str, Tuple[float, Deque[Dict]]] = {}
+    def __init__(self, max_messages: int = 16, ttl_seconds: int = 60*60*6, max_sessions: int = 10_000,
+                 sweep_seconds: float = 60.0, stripes: int = 64, summary_window: int = 10, compactor=None):
         self.max_messages = max_messages
+        self.summary_window = summary_window
+        self.compactor = compactor
         self.ttl = ttl_seconds
+        self.max_sessions = max_sessions
+        self.sweep_seconds = sweep_seconds
+        self.stripes = max(1, min(int(stripes), max_sessions))
+        per_shard = -(-max_sessions // self.stripes)
+        self._shards = [_Shard(per_shard) for _ in range(self.stripes)]
+        self._stop = threading.Event()
+        self._sweeper: threading.Thread | None = None
 
-    def _get_deque(self, session_id: str) -> Deque[Dict]:
+    @property
+    def evicted(self) -> int:
+        return sum(sh.evicted for sh in self._shards)
+
+    @property
+    def expired(self) -> int:
+        return sum(sh.expired for sh in self._shards)
+
+    def _shard(self, session_id: str) -> _Shard:
+        return self._shards[stripe_of(session_id, self.stripes)]
+
+    def _get_session(self, sh: _Shard, session_id: str) -> _Session:
+        # вызывается под sh.lock
         now = time.time()
-        if session_id in self._store:
-            ts, dq = self._store[session_id]
-            # протухание
-            if now - ts > self.ttl:
-                dq = deque(maxlen=self.max_messages)
-            self._store[session_id] = (now, dq)
-            return dq
-        dq = deque(maxlen=self.max_messages)
-        self._store[session_id] = (now, dq)
-        return dq
+        sess = sh.store.get(session_id)
+        if sess is None or now - sess.ts > self.ttl:
+            sess = _Session(now, self.max_messages, self.summary_window)
+            sh.store[session_id] = sess
+        sess.ts = now
+        sh.store.move_to_end(session_id)
+        while len(sh.store) > sh.capacity:
+            sh.store.popitem(last=False)
+            sh.evicted += 1
+        return sess
+
+    def _add(self, sh: _Shard, sess: _Session, role: Role, content: str, meta: Optional[Dict]):
+        # вызывается под sh.lock
+        sess.messages.append(Message(role, content, meta))
+        summary = sess.summary
+        if not summary.add(role, content, keep_evicted=self.compactor is not None) or self.compactor is None:
+            return
+        if not summary.compacting and self.compactor.due(len(summary.pending)):
+            previous, batch = summary.take_pending()
+            self.compactor.submit(lambda: self._compact(sh, summary, previous, batch))
+
+    def _compact(self, sh: _Shard, summary: RollingSummary, previous: str, batch: List[str]):
+        compact = None
+        try:
+            compact = self.compactor.compact(previous, batch)
+        finally:
+            with sh.lock:
+                summary.apply_compact(compact, len(batch))
 
     def append(self, session_id: str, role: Role, content: str, meta: Optional[Dict]=None):
-        dq = self._get_deque(session_id)
-        dq.append({"role": role, "content": content, "meta": meta or {}})
-        # обновим таймстемп активности
-        self._store[session_id] = (time.time(), dq)
+        sh = self._shard(session_id)
+        with sh.lock:
+            self._add(sh, self._get_session(sh, session_id), role, content, meta)
 
-    def get_messages(self, session_id: str) -> List[Dict]:
-        dq = self._get_deque(session_id)
-        return list(dq)
+    def append_and_get(self, session_id: str, role: Role, content: str, meta: Optional[Dict]=None) -> History:
+        """append + get_messages за одну операцию (для Redis-бэкенда — один round-trip)."""
+        sh = self._shard(session_id)
+        with sh.lock:
+            sess = self._get_session(sh, session_id)
+            self._add(sh, sess, role, content, meta)
+            return History(sess.messages, sess.summary.snapshot())
+
+    # память процесса — микросекунды под замком полосы, в поток не уводим (ср. RedisSessionMemory)
+    async def aappend(self, session_id: str, role: Role, content: str, meta: Optional[Dict]=None):
+        self.append(session_id, role, content, meta)
+
+    async def aappend_and_get(self, session_id: str, role: Role, content: str, meta: Optional[Dict]=None) -> History:
+        return self.append_and_get(session_id, role, content, meta)
+
+    def get_messages(self, session_id: str) -> History:
+        sh = self._shard(session_id)
+        with sh.lock:
+            sess = self._get_session(sh, session_id)
+            return History(sess.messages, sess.summary.snapshot())
 
     def clear(self, session_id: str):
-        self._store.pop(session_id, None)
+        sh = self._shard(session_id)
+        with sh.lock:
+            sh.store.pop(session_id, None)
+
+    # ---------- фоновая очистка ----------
+
+    def sweep(self) -> int:
+        """Удаляет протухшие сессии. В каждой полосе они в начале OrderedDict, проход останавливается на первой живой."""
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for sh in self._shards:
+            n = 0
+            with sh.lock:  # полосы чистятся по очереди — остальные в это время не блокируются
+                while sh.store:
+                    sid, sess = next(iter(sh.store.items()))
+                    if sess.ts > cutoff:
+                        break
+                    del sh.store[sid]
+                    n += 1
+                sh.expired += n
+            removed += n
+        return removed
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_seconds):
+            try:
+                removed = self.sweep()
+                if removed:
+                    log.info(f"swept {removed} expired sessions")
+            except Exception as e:
+                log.warning(f"session sweep failed: {e}")
+
+    def start_sweeper(self):
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._stop.clear()
+        self._sweeper = threading.Thread(target=self._sweep_loop, daemon=True, name="session-sweeper")
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join(timeout=1.0)
+            self._sweeper = None
+
+    # ---------- метрики ----------
+
+    def _iter_messages(self) -> Iterator[Message]:
+        for sh in self._shards:
+            with sh.lock:
+                batch = [m for sess in sh.store.values() for m in sess.messages]
+            yield from batch
+
+    def stats(self) -> Dict[str, Any]:
+        sessions = sum(len(sh.store) for sh in self._shards)
+        messages = list(self._iter_messages())
+        return {
+            "sessions": sessions,
+            "max_sessions": self.max_sessions,
+            "stripes": self.stripes,
+            "messages": len(messages),
+            "approx_bytes": sum(m.nbytes() for m in messages),
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "sweeper": self._sweeper is not None and self._sweeper.is_alive(),
+            "compactor": self.compactor.stats() if self.compactor is not None else None,
+        }
+
+def make_memory():
+    """SESSION_BACKEND=memory (по умолчанию) — память процесса; redis — общая для воркеров и реплик."""
+    if settings.SESSION_BACKEND == "redis":
+        from backend.memory.redis_store import RedisSessionMemory
+        return RedisSessionMemory.from_url(settings.REDIS_URL, max_messages=settings.SESSION_MAX_MESSAGES,
+                                           ttl_seconds=settings.SESSION_TTL_SECONDS, prefix=settings.REDIS_PREFIX,
+                                           summary_window=settings.HISTORY_WINDOW, compactor=history_compactor())
+    return SessionMemory(
+        max_messages=settings.SESSION_MAX_MESSAGES,
+        ttl_seconds=settings.SESSION_TTL_SECONDS,
+        max_sessions=settings.SESSION_MAX,
+        sweep_seconds=settings.SESSION_SWEEP_SECONDS,
+        stripes=settings.SESSION_LOCK_STRIPES,
+        summary_window=settings.HISTORY_WINDOW,
+        compactor=history_compactor(),
+    )
 
 # Singleton на процесс приложения
-memory = SessionMemory(max_messages=18, ttl_seconds=60*60*12)
+memory = make_memory()
@@ -1,36 +1,62 @@
 from __future__ import annotations
-from typing import Any, Dict, Optional
-import time
+from typing import Any, Dict, List
+import threading, time
+
+from backend.memory.locks import SessionLocks, stripe_of
+from backend.utils.settings import settings
 
 class SessionState:
     """
     Простейшее in-memory хранилище произвольного состояния по session_id.
+    Данные разложены по полосам (crc32(sid) % stripes) со своими замками — get/update разных сессий
+    не конкурируют. Для read-modify-write (прочитать состояние, поменять, записать) вызывающий
+    берёт lock(sid): параллельные запросы одной сессии тогда не теряют обновления друг друга.
     Для продакшена можно заменить на Redis/DB.
     """
-    def __init__(self, ttl_seconds: int = 60*60*12):
-        self._store: Dict[str, Dict[str, Any]] = {}
-        self._ts: Dict[str, float] = {}
+    def __init__(self, ttl_seconds: int = 60*60*12, stripes: int = 64):
         self.ttl = ttl_seconds
+        self.stripes = max(1, int(stripes))
+        self._guards = [threading.Lock() for _ in range(self.stripes)]
+        self._stores: List[Dict[str, Dict[str, Any]]] = [{} for _ in range(self.stripes)]
+        self._ts: List[Dict[str, float]] = [{} for _ in range(self.stripes)]
+        self._locks = SessionLocks(self.stripes)
 
-    def _touch(self, sid: str):
-        self._ts[sid] = time.time()
+    def lock(self, sid: str):
+        """Реентерабельный замок сессии: `with state.lock(sid): st = state.get(sid); ...; state.update(sid, st)`."""
+        return self._locks.hold(sid)
 
     def get(self, sid: str) -> Dict[str, Any]:
-        # TTL очистка по требованию
-        ts = self._ts.get(sid, 0.0)
-        if ts and (time.time() - ts) > self.ttl:
-            self._store.pop(sid, None)
-        self._touch(sid)
-        return self._store.setdefault(sid, {})
+        i = stripe_of(sid, self.stripes)
+        now = time.time()
+        with self._guards[i]:
+            store, ts = self._stores[i], self._ts[i]
+            # TTL очистка по требованию
+            last = ts.get(sid, 0.0)
+            if last and (now - last) > self.ttl:
+                store.pop(sid, None)
+            ts[sid] = now
+            return store.setdefault(sid, {})
 
     def update(self, sid: str, patch: Dict[str, Any]) -> Dict[str, Any]:
-        st = self.get(sid)
-        st.update(patch or {})
-        self._touch(sid)
-        return st
+        i = stripe_of(sid, self.stripes)
+        with self._guards[i]:
+            st = self._stores[i].setdefault(sid, {})
+            st.update(patch or {})
+            self._ts[i][sid] = time.time()
+            return st
 
     def clear(self, sid: str):
-        self._store.pop(sid, None)
-        self._ts.pop(sid, None)
+        i = stripe_of(sid, self.stripes)
+        with self._guards[i]:
+            self._stores[i].pop(sid, None)
+            self._ts[i].pop(sid, None)
+
+def make_state():
+    """Тот же выбор бэкенда, что и для SessionMemory (SESSION_BACKEND)."""
+    if settings.SESSION_BACKEND == "redis":
+        from backend.memory.redis_store import RedisSessionState
+        return RedisSessionState.from_url(settings.REDIS_URL, ttl_seconds=settings.SESSION_TTL_SECONDS,
+                                          prefix=settings.REDIS_PREFIX, lock_timeout=settings.SESSION_LOCK_TIMEOUT)
+    return SessionState(ttl_seconds=settings.SESSION_TTL_SECONDS, stripes=settings.SESSION_LOCK_STRIPES)
 
-state = SessionState()
+state = make_state()
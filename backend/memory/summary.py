@@ -0,0 +1,151 @@
+from __future__ import annotations
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import threading
+
+from backend.utils.settings import settings
+from backend.utils.clients import openai_client
+from backend.utils.logger import get_logger
+from backend.metrics import token_meter
+
+log = get_logger("history-summary")
+
+_LINE_CHARS = 200  # как в summarize_history: длинные реплики обрезаются
+
+def render_line(role: str, content: str) -> Optional[str]:
+    """Строка сводки для одного сообщения (None — сообщение в сводку не попадает)."""
+    if role not in ("user", "assistant"):
+        return None
+    content = (content or "").strip().replace("\n", " ")
+    if not content:
+        return None
+    if len(content) > _LINE_CHARS:
+        content = content[:_LINE_CHARS] + "…"
+    return f"{role}: {content}"
+
+class HistoryNote:
+    """Неизменяемый снимок сводки на момент запроса: сжатое начало диалога + последние реплики."""
+    __slots__ = ("compact", "lines", "_rendered")
+
+    def __init__(self, compact: str = "", lines: Tuple[str, ...] = ()):
+        self.compact = compact
+        self.lines = lines
+        self._rendered: Dict[int, str] = {}
+
+    def render(self, max_chars: int = 800) -> str:
+        out = self._rendered.get(max_chars)
+        if out is None:
+            out = "\n".join(self.lines)
+            if self.compact:
+                # сжатой части — не больше трети бюджета, последние реплики важнее
+                out = f"earlier: {self.compact[:max_chars // 3]}\n{out}"
+            out = out[:max_chars]
+            self._rendered[max_chars] = out
+        return out
+
+class History(list):
+    """Список сообщений сессии + снимок сводки (summarize_history берёт её, не проходя по сообщениям)."""
+    def __init__(self, messages=(), note: Optional[HistoryNote] = None):
+        super().__init__(messages)
+        self.note = note
+
+class RollingSummary:
+    """
+    Сводка истории, которая обновляется на каждом append за O(1): новая строка в окне последних реплик,
+    вытесненная из окна — в очередь на LLM-сжатие (если оно включено). Сама не синхронизирована:
+    SessionMemory вызывает её под замком полосы.
+    """
+    __slots__ = ("lines", "compact", "pending", "compacting")
+
+    def __init__(self, window: int = 10):
+        self.lines: Deque[str] = deque(maxlen=window)
+        self.compact = ""
+        self.pending: List[str] = []
+        self.compacting = False
+
+    def add(self, role: str, content: str, keep_evicted: bool = False) -> bool:
+        line = render_line(role, content)
+        if line is None:
+            return False
+        if keep_evicted and len(self.lines) == self.lines.maxlen:
+            self.pending.append(self.lines[0])
+        self.lines.append(line)
+        return True
+
+    def snapshot(self) -> HistoryNote:
+        return HistoryNote(self.compact, tuple(self.lines))
+
+    def take_pending(self) -> Tuple[str, List[str]]:
+        self.compacting = True
+        return self.compact, list(self.pending)
+
+    def apply_compact(self, compact: Optional[str], consumed: int):
+        """Результат фонового сжатия; при ошибке (compact=None) строки остаются в очереди до следующей попытки."""
+        self.compacting = False
+        if compact is not None:
+            self.compact = compact
+            del self.pending[:consumed]
+
+_COMPACT_SYSTEM = (
+    "You maintain a running summary of a conversation between a user and a banking assistant. "
+    "Merge the previous summary with the new turns. Keep facts that matter later: user goals, amounts, "
+    "currencies, dates, products discussed, open questions, language of the user. "
+    "Answer with the summary only, in the user's language, at most {chars} characters."
+)
+
+class HistoryCompactor:
+    """
+    Фоновое LLM-сжатие старых реплик (HISTORY_COMPACT=1): строки, вытесненные из окна сводки,
+    сворачиваются в короткий абзац, и контекст ранних реплик не теряется, а промпт не растёт.
+    Запросы пользователя его не ждут — задания идут в отдельный пул.
+    """
+    def __init__(self, model: str, every: int = 6, max_chars: int = 400, workers: int = 2):
+        self.client = openai_client()
+        self.model = model
+        self.every = max(1, every)
+        self.max_chars = max_chars
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="history-compact")
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+
+    def due(self, pending: int) -> bool:
+        return pending >= self.every
+
+    def compact(self, previous: str, lines: List[str]) -> str:
+        user = (f"Previous summary:\n{previous}\n\n" if previous else "") + "New turns:\n" + "\n".join(lines)
+        resp = token_meter.metered(
+            "history_compact", self.client.chat.completions.create,
+            model=self.model,
+            temperature=0.0,
+            messages=[
+                {"role": "system", "content": _COMPACT_SYSTEM.format(chars=self.max_chars)},
+                {"role": "user", "content": user},
+            ],
+        )
+        return (resp.choices[0].message.content or "").strip()[: self.max_chars]
+
+    def submit(self, job: Callable[[], None]):
+        def run():
+            try:
+                job()
+                with self._lock:
+                    self.runs += 1
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                log.warning(f"history compaction failed: {e}")
+        self._pool.submit(run)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"model": self.model, "every": self.every, "runs": self.runs, "failures": self.failures}
+
+@lru_cache(maxsize=None)
+def history_compactor() -> HistoryCompactor | None:
+    """Общий компактор процесса (None, если HISTORY_COMPACT=0)."""
+    if not settings.HISTORY_COMPACT:
+        return None
+    return HistoryCompactor(settings.HISTORY_COMPACT_MODEL, every=settings.HISTORY_COMPACT_EVERY,
+                            max_chars=settings.HISTORY_COMPACT_CHARS)
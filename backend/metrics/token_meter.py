@@ -0,0 +1,199 @@
+# backend/metrics/token_meter.py
+# Учёт токенов, стоимости и времени LLM/embedding-вызовов.
+# Каждый вызов идёт через metered()/ametered(): usage из ответа и wall time попадают
+# в метр текущего запроса (contextvar — без протаскивания через сигнатуры) и в агрегаты процесса,
+# которые /metrics отдаёт в текстовом формате Prometheus.
+from __future__ import annotations
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+from contextvars import ContextVar
+import bisect, threading, time
+
+from backend.utils.settings import settings
+from backend.metrics import tracing
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+def cost(prompt_tokens: int, completion_tokens: int) -> float:
+    return (prompt_tokens * settings.PRICE_PROMPT_PER_1K + completion_tokens * settings.PRICE_COMPLETION_PER_1K) / 1000.0
+
+def _usage(resp: Any) -> Tuple[int, int]:
+    u = getattr(resp, "usage", None)
+    if u is None:
+        return 0, 0
+    # у embeddings нет completion_tokens
+    return int(getattr(u, "prompt_tokens", 0) or 0), int(getattr(u, "completion_tokens", 0) or 0)
+
+class RequestMeter:
+    """Вызовы одного запроса: (component, model, prompt, completion, seconds, ok). list.append атомарен под GIL."""
+    __slots__ = ("calls", "t0")
+
+    def __init__(self):
+        self.calls: List[Tuple[str, str, int, int, float, bool]] = []
+        self.t0 = time.perf_counter()
+
+    def summary(self) -> Dict[str, Any]:
+        by: Dict[str, Dict[str, Any]] = {}
+        p_all = c_all = 0
+        for component, model, p, c, sec, ok in self.calls:
+            row = by.setdefault(f"{component}:{model}", {"calls": 0, "errors": 0, "prompt_tokens": 0,
+                                                         "completion_tokens": 0, "ms": 0.0})
+            row["calls"] += 1
+            row["errors"] += 0 if ok else 1
+            row["prompt_tokens"] += p
+            row["completion_tokens"] += c
+            row["ms"] += sec * 1000
+            p_all += p
+            c_all += c
+        for row in by.values():
+            row["ms"] = round(row["ms"], 1)
+        return {
+            "calls": len(self.calls),
+            "prompt_tokens": p_all,
+            "completion_tokens": c_all,
+            "cost": round(cost(p_all, c_all), 6),
+            "llm_ms": round(sum(x[4] for x in self.calls) * 1000, 1),
+            "total_ms": round((time.perf_counter() - self.t0) * 1000, 1),
+            "by_component": by,
+        }
+
+def _escape(value: str) -> str:
+    """Значение метки по текстовому формату Prometheus: \\, \" и перевод строки экранируются."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(comp: str, model: str) -> str:
+    # имена компонентов (agent:{name}) и моделей приходят из конфигурации
+    return f'component="{_escape(comp)}",model="{_escape(model)}"'
+
+class _Histogram:
+    __slots__ = ("bounds", "counts", "sum", "n")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.n = 0
+
+    def observe(self, v: float):
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.n += 1
+
+    def lines(self, name: str, labels: str) -> List[str]:
+        out, acc = [], 0
+        sep = "," if labels else ""
+        for b, c in zip(list(self.bounds) + ["+Inf"], self.counts):
+            acc += c
+            out.append(f'{name}_bucket{{{labels}{sep}le="{b}"}} {acc}')
+        lab = f"{{{labels}}}" if labels else ""
+        out.append(f"{name}_sum{lab} {self.sum:.6f}")
+        out.append(f"{name}_count{lab} {self.n}")
+        return out
+
+class MeterRegistry:
+    """Агрегаты процесса по (component, model): счётчики токенов/стоимости/ошибок и гистограммы задержек."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Tuple[str, str], List[float]] = {}   # calls, errors, prompt, completion, cost
+        self._latency: Dict[Tuple[str, str], _Histogram] = {}
+        self._req_seconds = _Histogram(LATENCY_BUCKETS)
+        self._req_tokens = _Histogram(TOKEN_BUCKETS)
+        self._req_cost = 0.0
+
+    def observe_call(self, component: str, model: str, p: int, c: int, seconds: float, ok: bool):
+        key = (component, model)
+        with self._lock:
+            row = self._calls.get(key)
+            if row is None:
+                row = self._calls[key] = [0, 0, 0, 0, 0.0]
+                self._latency[key] = _Histogram(LATENCY_BUCKETS)
+            row[0] += 1
+            row[1] += 0 if ok else 1
+            row[2] += p
+            row[3] += c
+            row[4] += cost(p, c)
+            self._latency[key].observe(seconds)
+
+    def observe_request(self, summary: Dict[str, Any]):
+        with self._lock:
+            self._req_seconds.observe(summary["total_ms"] / 1000)
+            self._req_tokens.observe(summary["prompt_tokens"] + summary["completion_tokens"])
+            self._req_cost += summary["cost"]
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (text/plain; version=0.0.4)."""
+        with self._lock:
+            lines = [
+                "# HELP llm_calls_total LLM/embedding calls by component and model",
+                "# TYPE llm_calls_total counter",
+            ]
+            rows = sorted(self._calls.items())
+            for (comp, model), r in rows:
+                lines.append(f'llm_calls_total{{{_labels(comp, model)}}} {r[0]}')
+            lines += ["# TYPE llm_errors_total counter"]
+            lines += [f'llm_errors_total{{{_labels(comp, model)}}} {r[1]}' for (comp, model), r in rows]
+            lines += ["# TYPE llm_tokens_total counter"]
+            for (comp, model), r in rows:
+                lines.append(f'llm_tokens_total{{{_labels(comp, model)},kind="prompt"}} {r[2]}')
+                lines.append(f'llm_tokens_total{{{_labels(comp, model)},kind="completion"}} {r[3]}')
+            lines += ["# TYPE llm_cost_total counter"]
+            lines += [f'llm_cost_total{{{_labels(comp, model)}}} {r[4]:.6f}' for (comp, model), r in rows]
+            lines += ["# HELP llm_call_seconds Wall time of a single call", "# TYPE llm_call_seconds histogram"]
+            for (comp, model), h in sorted(self._latency.items()):
+                lines += h.lines("llm_call_seconds", _labels(comp, model))
+            lines += ["# HELP route_request_seconds Wall time of /route requests", "# TYPE route_request_seconds histogram"]
+            lines += self._req_seconds.lines("route_request_seconds", "")
+            lines += ["# HELP route_request_tokens Tokens spent per /route request", "# TYPE route_request_tokens histogram"]
+            lines += self._req_tokens.lines("route_request_tokens", "")
+            lines += ["# TYPE route_cost_total counter", f"route_cost_total {self._req_cost:.6f}"]
+        return "\n".join(lines) + "\n"
+
+# Singleton на процесс приложения
+meter = MeterRegistry()
+
+_current: ContextVar[Optional[RequestMeter]] = ContextVar("request_meter", default=None)
+
+def start() -> RequestMeter:
+    """Новый метр для текущего запроса; задачи и to_thread, запущенные дальше, наследуют его через contextvar."""
+    m = RequestMeter()
+    _current.set(m)
+    return m
+
+def bind(m: RequestMeter):
+    """Привязать уже созданный метр к текущему контексту (генератор StreamingResponse)."""
+    _current.set(m)
+
+def finish(m: RequestMeter) -> Dict[str, Any]:
+    summary = m.summary()
+    meter.observe_request(summary)
+    return summary
+
+def record(component: str, model: str, resp: Any, seconds: float, ok: bool = True):
+    p, c = _usage(resp)
+    m = _current.get()
+    if m is not None:
+        m.calls.append((component, model, p, c, seconds, ok))
+    meter.observe_call(component, model, p, c, seconds, ok)
+    tracing.record(f"llm:{component}", time.perf_counter() - seconds, seconds, model=model, tokens=p + c,
+                   **({} if ok else {"error": True}))
+
+def metered(component: str, fn: Callable[..., Any], **kwargs) -> Any:
+    """fn(**kwargs) с учётом usage и времени; модель берётся из kwargs["model"]."""
+    t0 = time.perf_counter()
+    try:
+        resp = fn(**kwargs)
+    except Exception:
+        record(component, str(kwargs.get("model")), None, time.perf_counter() - t0, ok=False)
+        raise
+    record(component, str(kwargs.get("model")), resp, time.perf_counter() - t0)
+    return resp
+
+async def ametered(component: str, fn: Callable[..., Awaitable[Any]], **kwargs) -> Any:
+    t0 = time.perf_counter()
+    try:
+        resp = await fn(**kwargs)
+    except Exception:
+        record(component, str(kwargs.get("model")), None, time.perf_counter() - t0, ok=False)
+        raise
+    record(component, str(kwargs.get("model")), resp, time.perf_counter() - t0)
+    return resp
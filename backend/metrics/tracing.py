@@ -0,0 +1,171 @@
+# backend/metrics/tracing.py
+# Лёгкие span'ы по стадиям /route: классификация, сводка истории, query rewrite, embeddings,
+# поиск по стору, rerank, генерация. Текущий trace и родительский span лежат в contextvars,
+# поэтому задачи asyncio и asyncio.to_thread, запущенные внутри запроса, пишут в тот же trace.
+# Отобранные (TRACE_SAMPLE_RATE) и медленные (> TRACE_SLOW_MS) trace'ы попадают в кольцевой буфер
+# (/debug/traces), медленные ещё и логируются с разбивкой по стадиям.
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import asyncio, functools, itertools, random, threading, time, uuid
+
+from backend.utils.settings import settings
+from backend.utils.logger import get_logger
+
+log = get_logger("tracing")
+
+class Trace:
+    """Span'ы одного запроса: (id, parent, name, start_ms, dur_ms, attrs). list.append атомарен под GIL."""
+    __slots__ = ("trace_id", "name", "attrs", "ts", "t0", "spans", "duration_ms", "_ids")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.ts = time.time()
+        self.t0 = time.perf_counter()
+        self.spans: List[tuple] = []
+        self.duration_ms: Optional[float] = None
+        self._ids = itertools.count(1)
+
+    def add(self, parent: int, name: str, start: float, seconds: float, attrs: Dict[str, Any]) -> int:
+        sid = next(self._ids)
+        self.spans.append((sid, parent, name, (start - self.t0) * 1000, seconds * 1000, attrs))
+        return sid
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "ts": self.ts,
+            "duration_ms": round(self.duration_ms or 0.0, 2),
+            "attrs": self.attrs,
+            "spans": [
+                {"id": i, "parent": p, "name": n, "start_ms": round(s, 2), "duration_ms": round(d, 2), **({"attrs": a} if a else {})}
+                for i, p, n, s, d, a in sorted(self.spans, key=lambda x: x[3])
+            ],
+        }
+
+    def breakdown(self) -> str:
+        """Дерево стадий одной строкой на span — для лога медленных запросов."""
+        children: Dict[int, List[tuple]] = {}
+        for sp in sorted(self.spans, key=lambda x: x[3]):
+            children.setdefault(sp[1], []).append(sp)
+        lines: List[str] = []
+        def walk(parent: int, depth: int):
+            for sid, _, name, start, dur, attrs in children.get(parent, []):
+                extra = " " + " ".join(f"{k}={v}" for k, v in attrs.items()) if attrs else ""
+                lines.append(f"{'  ' * depth}{name}: {dur:.1f}ms (+{start:.1f}){extra}")
+                walk(sid, depth + 1)
+        walk(0, 1)
+        return "\n".join(lines)
+
+class TraceBuffer:
+    """Кольцевой буфер последних trace'ов (deque с maxlen — старые вытесняются сами)."""
+    def __init__(self, capacity: int = 200):
+        self._items: "deque[Trace]" = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.finished = 0
+        self.slow = 0
+
+    def add(self, trace: Trace):
+        with self._lock:
+            self._items.append(trace)
+
+    def recent(self, limit: int = 50, slow_only: bool = False) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = list(self._items)
+        if slow_only:
+            items = [t for t in items if (t.duration_ms or 0.0) > settings.TRACE_SLOW_MS]
+        return [t.to_dict() for t in reversed(items[-limit:] if limit else items)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.TRACE_ENABLE,
+            "sample_rate": settings.TRACE_SAMPLE_RATE,
+            "slow_ms": settings.TRACE_SLOW_MS,
+            "buffered": len(self._items),
+            "finished": self.finished,
+            "slow": self.slow,
+        }
+
+# Singleton на процесс приложения
+buffer = TraceBuffer(settings.TRACE_BUFFER)
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_parent: ContextVar[int] = ContextVar("trace_parent", default=0)
+
+def begin(name: str, **attrs) -> Optional[Trace]:
+    """Новый trace для запроса (None, если TRACE_ENABLE=0). Span'ы пишутся всегда — медленный запрос
+    должен попасть в лог целиком, даже если не прошёл сэмплирование; сэмплирование решает, что хранить."""
+    if not settings.TRACE_ENABLE:
+        return None
+    trace = Trace(name, attrs)
+    _trace.set(trace)
+    _parent.set(0)
+    return trace
+
+def bind(trace: Optional[Trace]):
+    """Привязать trace к текущему контексту (генератор StreamingResponse)."""
+    _trace.set(trace)
+    _parent.set(0)
+
+def end(trace: Optional[Trace], **attrs):
+    if trace is None:
+        return
+    trace.duration_ms = (time.perf_counter() - trace.t0) * 1000
+    trace.attrs.update(attrs)
+    buffer.finished += 1
+    slow = trace.duration_ms > settings.TRACE_SLOW_MS
+    if slow:
+        buffer.slow += 1
+        log.warning(f"slow {trace.name} {trace.duration_ms:.0f}ms trace={trace.trace_id} "
+                    f"{trace.attrs}\n{trace.breakdown()}")
+    if slow or random.random() < settings.TRACE_SAMPLE_RATE:
+        buffer.add(trace)
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Dict[str, Any]]]:
+    """Стадия запроса; вложенные span'ы становятся её детьми. Вне trace — почти бесплатный no-op.
+    Отдаёт attrs: их можно дополнить внутри блока (например, числом кандидатов)."""
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _parent.get()
+    sid = next(trace._ids)
+    token = _parent.set(sid)
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        try:
+            _parent.reset(token)
+        except ValueError:
+            pass  # async-генератор закрыли из другого контекста (клиент SSE отключился)
+        trace.spans.append((sid, parent, name, (t0 - trace.t0) * 1000, (time.perf_counter() - t0) * 1000, attrs))
+
+def record(name: str, start: float, seconds: float, **attrs):
+    """Уже завершённая стадия (например, LLM-вызов из token_meter) под текущим родителем."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(_parent.get(), name, start, seconds, attrs)
+
+def traced(name: str) -> Callable:
+    """Декоратор: весь вызов функции (sync или async) — один span."""
+    def deco(fn: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
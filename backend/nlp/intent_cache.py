@@ -0,0 +1,129 @@
+# backend/nlp/intent_cache.py
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+from functools import lru_cache
+import threading, time, zlib
+import numpy as np
+
+from ..utils.settings import settings
+
+def history_bucket(session_messages: Optional[List[Dict]]) -> str:
+    """
+    Корзина контекста: последний определённый интент в сессии ("" для новой сессии).
+    Одна и та же реплика в одном и том же состоянии диалога классифицируется одинаково,
+    а короткие follow-up'ы ("а на год?") не смешиваются между разными темами.
+    """
+    for m in reversed(session_messages or []):
+        meta = m.get("meta") or {}
+        if meta.get("intent"):
+            return str(meta["intent"])
+        content = m.get("content") or ""
+        if m.get("role") == "assistant" and content.startswith("[intent: "):
+            return content[len("[intent: "):].rstrip("]")
+    return ""
+
+class SemanticIntentCache:
+    """
+    Кэш классификаций по ближайшему соседу: эмбеддинг сообщения + корзина истории.
+    Попадание — косинус >= threshold в той же корзине и запись моложе ttl.
+    Векторы лежат в матрице слотов, которая растёт удвоением до capacity (а не выделяется сразу
+    на capacity × dim); вытеснение — LRU по слотам.
+    """
+    def __init__(self, threshold: float = 0.95, ttl_seconds: float = 3600, capacity: int = 10_000):
+        self.threshold = threshold
+        self.ttl = ttl_seconds
+        self.capacity = capacity
+        self._vecs: np.ndarray | None = None
+        self._bucket = np.zeros(0, dtype=np.int64)
+        self._ts = np.zeros(0, dtype=np.float64)      # 0 — пустой слот
+        self._results: List[Optional[Dict[str, Any]]] = []
+        self._lru: "OrderedDict[int, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    @staticmethod
+    def _bucket_id(bucket: str) -> int:
+        return zlib.crc32(bucket.encode("utf-8")) + 1
+
+    @staticmethod
+    def _unit(vec) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32)
+        return v / (np.linalg.norm(v) + 1e-12)
+
+    def get(self, vec, bucket: str) -> Optional[Dict[str, Any]]:
+        q = self._unit(vec)
+        now = time.time()
+        with self._lock:
+            if self._vecs is None or not self._lru:
+                self.misses += 1
+                return None
+            n = len(self._lru)   # слоты заполняются подряд: 0..n-1
+            sims = self._vecs[:n] @ q
+            live = (self._bucket[:n] == self._bucket_id(bucket)) & (self._ts[:n] > 0) & (now - self._ts[:n] <= self.ttl)
+            sims = np.where(live, sims, -1.0)
+            slot = int(np.argmax(sims))
+            if sims[slot] < self.threshold:
+                self.misses += 1
+                return None
+            self._lru.move_to_end(slot)
+            self.hits += 1
+            return dict(self._results[slot], cache="semantic", similarity=round(float(sims[slot]), 4))
+
+    def _grow(self, dim: int):
+        rows = 0 if self._vecs is None else len(self._vecs)
+        new = min(self.capacity, max(64, rows * 2))
+        vecs = np.zeros((new, dim), dtype=np.float32)
+        if rows:
+            vecs[:rows] = self._vecs
+        self._vecs = vecs
+        self._bucket = np.concatenate([self._bucket, np.zeros(new - rows, dtype=np.int64)])
+        self._ts = np.concatenate([self._ts, np.zeros(new - rows, dtype=np.float64)])
+        self._results += [None] * (new - rows)
+
+    def put(self, vec, bucket: str, result: Dict[str, Any]):
+        v = self._unit(vec)
+        now = time.time()
+        with self._lock:
+            n = len(self._lru)
+            # протухшие записи освобождают слоты раньше LRU-вытеснения: матрица не растёт за счёт мёртвых строк
+            expired = np.flatnonzero(now - self._ts[:n] > self.ttl) if n else ()
+            if len(expired):
+                slot = int(expired[0])
+                self.expired += 1
+            elif n < self.capacity:
+                slot = n
+                if self._vecs is None or slot >= len(self._vecs):
+                    self._grow(v.shape[0])
+            else:
+                slot, _ = self._lru.popitem(last=False)
+                self.evictions += 1
+            self._vecs[slot] = v
+            self._bucket[slot] = self._bucket_id(bucket)
+            self._ts[slot] = now
+            self._results[slot] = dict(result)
+            self._lru[slot] = None
+            self._lru.move_to_end(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "items": len(self._lru),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+@lru_cache(maxsize=None)
+def intent_cache() -> SemanticIntentCache | None:
+    """Общий кэш процесса (None, если выключен через INTENT_CACHE=0)."""
+    if not settings.INTENT_CACHE:
+        return None
+    return SemanticIntentCache(settings.INTENT_CACHE_THRESHOLD, settings.INTENT_CACHE_TTL, settings.INTENT_CACHE_SIZE)
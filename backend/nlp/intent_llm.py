@@ -1,10 +1,11 @@
 from typing import Dict, List
-from openai import OpenAI
-import json
-import httpx
+import asyncio, json, os, threading, time
 from ..utils.settings import settings
+from ..utils.clients import async_openai_client, openai_client
 from ..utils.logger import get_logger
+from ..metrics import token_meter
 from .intent_regex import fallback_predict
+from .intent_cache import history_bucket, intent_cache
 from typing import Dict, List, Optional
 
 log = get_logger("intent-llm")
@@ -49,8 +50,12 @@ FEW_SHOTS = [
 def summarize_history(messages: List[Dict], max_chars: int = 800) -> str:
     """
     Грубая сводка истории: берем последние N сообщений user/assistant и компактно формируем контекст,
-    без длинных ответов (обрезаем).
+    без длинных ответов (обрезаем). История из SessionMemory (History) уже несёт сводку,
+    обновлённую на append, — тогда сообщения не перебираются.
     """
+    note = getattr(messages, "note", None)
+    if note is not None:
+        return note.render(max_chars)
     if not messages: return ""
     lines = []
     for m in messages[-10:]:  # последние 10
@@ -65,54 +70,160 @@ def summarize_history(messages: List[Dict], max_chars: int = 800) -> str:
 
 class LLMIntentClassifier:
     def __init__(self):
-        self.client = OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_BASE_URL,
-            timeout=settings.REQUEST_TIMEOUT_SECONDS,
-            max_retries=2,
-            http_client=httpx.Client(timeout=settings.REQUEST_TIMEOUT_SECONDS)
-        )
+        self.client = openai_client()
+        self.aclient = async_openai_client()
         self.model = settings.INTENT_MODEL
+        self.local = self._load_local()
+        self.cache = intent_cache()
+        self.embedder = self._make_embedder() if self.cache is not None else None
+        self._log_lock = threading.Lock()
+
+    @staticmethod
+    def _make_embedder():
+        from ..rag.embedder import Embedder
+        return Embedder()
+
+    @staticmethod
+    def _load_local():
+        path = settings.INTENT_LOCAL_MODEL
+        if not path or not os.path.exists(path):
+            return None
+        from .intent_local import LocalIntentModel
+        log.info(f"local intent model loaded: {path}")
+        return LocalIntentModel.load(path)
+
+    def _local_predict(self, text: str) -> Optional[Dict]:
+        """Первая ступень: уверенный ответ локальной модели избавляет от вызова LLM."""
+        if self.local is None:
+            return None
+        from .intent_local import LOCAL_MODEL_NAME
+        intent, conf = self.local.predict(text)
+        if conf < settings.INTENT_LOCAL_THRESHOLD:
+            return None
+        return {"intent": intent, "confidence": conf, "matched_reasons": [], "llm": LOCAL_MODEL_NAME}
+
+    def _cache_lookup(self, vec, bucket: str) -> Optional[Dict]:
+        """Вторая ступень: похожее сообщение в том же контексте уже классифицировано."""
+        if vec is None:
+            return None
+        return self.cache.get(vec, bucket)
+
+    def _cache_store(self, vec, bucket: str, result: Dict):
+        if vec is not None:
+            self.cache.put(vec, bucket, result)
+
+    def _embed(self, text: str):
+        if self.embedder is None:
+            return None
+        try:
+            return self.embedder.encode([text])[0]
+        except Exception as e:
+            log.warning(f"intent cache embedding failed: {e}")
+            return None
+
+    async def _aembed(self, text: str):
+        if self.embedder is None:
+            return None
+        try:
+            return (await self.embedder.aencode([text]))[0]
+        except Exception as e:
+            log.warning(f"intent cache embedding failed: {e}")
+            return None
+
+    def _log_decision(self, text: str, result: Dict):
+        # лог решений LLM — обучающая выборка для intent_local
+        if not settings.INTENT_LOG_PATH:
+            return
+        rec = {"ts": time.time(), "text": text, "intent": result["intent"], "confidence": result["confidence"], "llm": self.model}
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(settings.INTENT_LOG_PATH)), exist_ok=True)
+            with self._log_lock, open(settings.INTENT_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        except OSError as e:
+            log.warning(f"intent log write failed: {e}")
+
+    def _request(self, text: str, session_messages: Optional[List[Dict]]) -> Dict:
+        history_note = summarize_history(session_messages or [])
+        history_block = f"\n\nConversation history (recent turns):\n{history_note}" if history_note else ""
+
+        system = SYSTEM_PROMPT + history_block
+
+        messages = [{"role":"system","content": system}]
+        messages += FEW_SHOTS
+        messages.append({"role":"user","content": text})
+        return dict(
+            model=self.model,
+            temperature=0.0,
+            response_format={"type":"json_object"},
+            messages=messages
+        )
+
+    def _parse(self, raw: str) -> Dict:
+        data = json.loads(raw)
+
+        intent = data.get("intent","general_knowledge")
+        conf = float(data.get("confidence", 0.7))
+        reasons = data.get("matched_reasons", [])
+        if intent not in INTENTS:
+            intent = "general_knowledge"
+
+        return {
+            "intent": intent,
+            "confidence": max(0.0, min(conf, 1.0)),
+            "matched_reasons": reasons,
+            "llm": self.model
+        }
+
+    def _fallback(self, text: str, language: str | None, e: Exception) -> Dict:
+        log.warning(f"LLM intent failed: {e}. Falling back to regex.")
+        fb = fallback_predict(text, language=language)
+        fb["llm"] = None
+        fb["fallback"] = "regex"
+        return fb
 
     def predict(self, text: str, language: str | None = None, session_messages: Optional[List[Dict]] = None) -> Dict:
         if not text or not text.strip():
             return {"intent":"general_knowledge","confidence":0.1,"matched_reasons":[],"llm":self.model}
 
+        local = self._local_predict(text)
+        if local is not None:
+            return local
+
+        bucket = history_bucket(session_messages)
+        vec = self._embed(text)
+        cached = self._cache_lookup(vec, bucket)
+        if cached is not None:
+            return cached
+
         try:
-            history_note = summarize_history(session_messages or [])
-            history_block = f"\n\nConversation history (recent turns):\n{history_note}" if history_note else ""
-
-            system = SYSTEM_PROMPT + history_block
-
-            messages = [{"role":"system","content": system}]
-            messages += FEW_SHOTS
-            messages.append({"role":"user","content": text})
-
-            resp = self.client.chat.completions.create(
-                model=self.model,
-                temperature=0.0,
-                response_format={"type":"json_object"},
-                messages=messages
-            )
-            raw = resp.choices[0].message.content
-            data = json.loads(raw)
-
-            intent = data.get("intent","general_knowledge")
-            conf = float(data.get("confidence", 0.7))
-            reasons = data.get("matched_reasons", [])
-            if intent not in INTENTS:
-                intent = "general_knowledge"
-
-            return {
-                "intent": intent,
-                "confidence": max(0.0, min(conf, 1.0)),
-                "matched_reasons": reasons,
-                "llm": self.model
-            }
+            resp = token_meter.metered("intent", self.client.chat.completions.create, **self._request(text, session_messages))
+            result = self._parse(resp.choices[0].message.content)
+        except Exception as e:
+            return self._fallback(text, language, e)
+        self._log_decision(text, result)
+        self._cache_store(vec, bucket, result)
+        return result
+
+    async def apredict(self, text: str, language: str | None = None, session_messages: Optional[List[Dict]] = None) -> Dict:
+        if not text or not text.strip():
+            return {"intent":"general_knowledge","confidence":0.1,"matched_reasons":[],"llm":self.model}
 
+        local = self._local_predict(text)
+        if local is not None:
+            return local
+
+        bucket = history_bucket(session_messages)
+        vec = await self._aembed(text)
+        cached = self._cache_lookup(vec, bucket)
+        if cached is not None:
+            return cached
+
+        try:
+            resp = await token_meter.ametered("intent", self.aclient.chat.completions.create, **self._request(text, session_messages))
+            result = self._parse(resp.choices[0].message.content)
         except Exception as e:
-            log.warning(f"LLM intent failed: {e}. Falling back to regex.")
-            fb = fallback_predict(text, language=language)
-            fb["llm"] = None
-            fb["fallback"] = "regex"
-            return fb
+            return self._fallback(text, language, e)
+        # makedirs + дозапись под threading.Lock — файловый I/O, не в цикле событий
+        await asyncio.to_thread(self._log_decision, text, result)
+        self._cache_store(vec, bucket, result)
+        return result
@@ -0,0 +1,157 @@
+# backend/nlp/intent_local.py
+# Локальный классификатор интентов: hashed char n-grams + softmax-регрессия на NumPy.
+# Учится на логах решений LLM (INTENT_LOG_PATH), отвечает за доли миллисекунды;
+# LLMIntentClassifier зовёт LLM только если уверенность модели ниже INTENT_LOCAL_THRESHOLD.
+#
+#   python -m backend.nlp.intent_local train --data data/logs/intent_llm.jsonl --out data/models/intent_local.npz
+#   python -m backend.nlp.intent_local eval  --data data/logs/intent_llm.jsonl --model data/models/intent_local.npz
+from __future__ import annotations
+from typing import Dict, List, Sequence, Tuple
+from collections import Counter
+import argparse, json, os, re, uuid, zlib
+import numpy as np
+
+from .intent_llm import INTENTS
+
+LOCAL_MODEL_NAME = "local-ngram"
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+def _features(text: str, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Разреженный вектор: char 2..4-граммы по словам + словарные униграммы, crc32-хэш в dim корзин, L2-норма."""
+    words = _WORD.findall((text or "").lower())
+    padded = " " + " ".join(words) + " "
+    grams = Counter(padded[i:i + n] for n in (2, 3, 4) for i in range(len(padded) - n + 1))
+    grams.update("w:" + w for w in words)
+    if not grams:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    idx = np.fromiter((zlib.crc32(g.encode("utf-8")) % dim for g in grams), dtype=np.int64, count=len(grams))
+    val = np.fromiter(grams.values(), dtype=np.float32, count=len(grams))
+    idx, inv = np.unique(idx, return_inverse=True)
+    val = np.bincount(inv, weights=val).astype(np.float32)
+    val /= np.linalg.norm(val) + 1e-12
+    return idx, val
+
+def _softmax(z: np.ndarray) -> np.ndarray:
+    z = z - z.max()
+    e = np.exp(z)
+    return e / e.sum()
+
+class LocalIntentModel:
+    def __init__(self, W: np.ndarray, b: np.ndarray, labels: Sequence[str] = INTENTS):
+        self.W = W
+        self.b = b
+        self.labels = list(labels)
+        self.dim = int(W.shape[0])
+
+    def proba(self, text: str) -> np.ndarray:
+        idx, val = _features(text, self.dim)
+        return _softmax(val @ self.W[idx] + self.b)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        p = self.proba(text)
+        k = int(np.argmax(p))
+        return self.labels[k], float(p[k])
+
+    @classmethod
+    def train(cls, texts: Sequence[str], labels: Sequence[str], dim: int = 1 << 18, epochs: int = 8,
+              lr: float = 0.5, l2: float = 1e-6, seed: int = 0) -> "LocalIntentModel":
+        """Softmax-регрессия, AdaGrad по разреженным признакам (обновляются только задействованные строки W)."""
+        classes = list(INTENTS)
+        y = np.array([classes.index(l) for l in labels], dtype=np.int64)
+        feats = [_features(t, dim) for t in texts]
+        C = len(classes)
+        W = np.zeros((dim, C), dtype=np.float32)
+        b = np.zeros(C, dtype=np.float32)
+        gW = np.full((dim, C), 1e-8, dtype=np.float32)
+        gb = np.full(C, 1e-8, dtype=np.float32)
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            for i in rng.permutation(len(feats)):
+                idx, val = feats[i]
+                if len(idx) == 0:
+                    continue
+                p = _softmax(val @ W[idx] + b)
+                p[y[i]] -= 1.0
+                grad = np.outer(val, p) + l2 * W[idx]
+                gW[idx] += grad * grad
+                W[idx] -= lr * grad / np.sqrt(gW[idx])
+                gb += p * p
+                b -= lr * p / np.sqrt(gb)
+        return cls(W, b, classes)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp-{uuid.uuid4().hex[:8]}.npz"
+        np.savez_compressed(tmp, W=self.W, b=self.b, labels=np.array(self.labels))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LocalIntentModel":
+        with np.load(path) as z:
+            return cls(z["W"], z["b"], [str(l) for l in z["labels"]])
+
+def load_log(path: str) -> Tuple[List[str], List[str]]:
+    """Строки лога LLM-решений: {"text": ..., "intent": ...}; неизвестные интенты пропускаются."""
+    texts, labels = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            if rec.get("intent") in INTENTS and (rec.get("text") or "").strip():
+                texts.append(rec["text"])
+                labels.append(rec["intent"])
+    return texts, labels
+
+def evaluate(model: LocalIntentModel, texts: Sequence[str], labels: Sequence[str],
+             thresholds: Sequence[float] = (0.5, 0.7, 0.8, 0.85, 0.9, 0.95)) -> List[Dict[str, float]]:
+    """
+    agreement — совпадение с LLM на всех примерах;
+    avoided — доля запросов, которые локальная модель закрыла бы сама (уверенность >= порога);
+    agreement_avoided — совпадение с LLM именно на закрытых локально.
+    """
+    preds = [model.predict(t) for t in texts]
+    ok = np.array([p[0] == l for p, l in zip(preds, labels)])
+    conf = np.array([p[1] for p in preds])
+    rows = []
+    for th in thresholds:
+        m = conf >= th
+        rows.append({
+            "threshold": th,
+            "agreement": round(float(ok.mean()), 4) if len(ok) else 0.0,
+            "avoided": round(float(m.mean()), 4) if len(m) else 0.0,
+            "agreement_avoided": round(float(ok[m].mean()), 4) if m.any() else 0.0,
+        })
+    return rows
+
+def _print_report(rows: List[Dict[str, float]], n: int):
+    print(f"examples: {n}")
+    print(f"{'threshold':>9} {'agreement':>10} {'avoided':>8} {'agree@avoided':>14}")
+    for r in rows:
+        print(f"{r['threshold']:>9.2f} {r['agreement']:>10.3f} {r['avoided']:>8.3f} {r['agreement_avoided']:>14.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обучение/оценка локального классификатора интентов по логам LLM")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_train = sub.add_parser("train")
+    p_train.add_argument("--data", required=True, help="JSONL лог решений LLM (INTENT_LOG_PATH)")
+    p_train.add_argument("--out", default="data/models/intent_local.npz")
+    p_train.add_argument("--holdout", type=float, default=0.2, help="доля примеров для оценки")
+    p_train.add_argument("--epochs", type=int, default=8)
+    p_eval = sub.add_parser("eval")
+    p_eval.add_argument("--data", required=True)
+    p_eval.add_argument("--model", default="data/models/intent_local.npz")
+    args = parser.parse_args()
+
+    texts, labels = load_log(args.data)
+    if args.cmd == "train":
+        order = np.random.default_rng(0).permutation(len(texts))
+        n_test = int(len(texts) * args.holdout)
+        test, train = order[:n_test], order[n_test:]
+        model = LocalIntentModel.train([texts[i] for i in train], [labels[i] for i in train], epochs=args.epochs)
+        model.save(args.out)
+        print(f"OK: обучено на {len(train)} примерах -> {args.out}")
+        if n_test:
+            _print_report(evaluate(model, [texts[i] for i in test], [labels[i] for i in test]), n_test)
+    else:
+        _print_report(evaluate(LocalIntentModel.load(args.model), texts, labels), len(texts))
@@ -0,0 +1,93 @@
+# backend/rag/ann.py
+from __future__ import annotations
+from typing import List, Optional
+import os, uuid
+import numpy as np
+
+from backend.utils.logger import get_logger
+
+log = get_logger("ann-index")
+
+_BLOCK_ROWS = 16384
+
+def _assign(X: np.ndarray, C: np.ndarray) -> np.ndarray:
+    """Ближайший центроид (по косинусу, X и C нормированы) — блоками, чтобы не держать N×nlist целиком."""
+    out = np.empty(X.shape[0], dtype=np.int32)
+    for s in range(0, X.shape[0], _BLOCK_ROWS):
+        out[s:s + _BLOCK_ROWS] = np.argmax(np.asarray(X[s:s + _BLOCK_ROWS], dtype=np.float32) @ C.T, axis=1)
+    return out
+
+class IVFIndex:
+    """
+    Inverted-file индекс на чистом NumPy: сферический k-means по нормированным векторам,
+    у каждого центроида — список сквозных номеров строк стора.
+    Поиск отдаёт кандидатов из nprobe ближайших списков; точный скоринг делает сам стор.
+    Больше nprobe — выше recall и медленнее поиск (nprobe == nlist ~ полный перебор).
+    """
+    def __init__(self, centroids: np.ndarray, lists: Optional[List[List[np.ndarray]]] = None, rows: int = 0):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nlist = int(self.centroids.shape[0])
+        # у каждого списка — куски номеров строк; инкрементальные вставки просто дописывают кусок
+        self._lists: List[List[np.ndarray]] = lists or [[] for _ in range(self.nlist)]
+        self.rows = rows
+
+    @classmethod
+    def build(cls, X: np.ndarray, nlist: int = 0, iters: int = 10, sample: int = 64, seed: int = 0) -> "IVFIndex":
+        n = int(X.shape[0])
+        nlist = max(1, min(nlist or int(4 * np.sqrt(n)), n))
+        rng = np.random.default_rng(seed)
+        # k-means учим на подвыборке (до sample точек на центроид), затем раскладываем все строки
+        train_idx = np.sort(rng.choice(n, size=min(n, nlist * sample), replace=False))
+        T = np.asarray(X[train_idx], dtype=np.float32)
+        C = T[rng.choice(T.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(iters):
+            a = _assign(T, C)
+            # суммы по кластерам: сортировка + reduceat (np.add.at на порядок медленнее)
+            order = np.argsort(a, kind="stable")
+            counts = np.bincount(a, minlength=nlist)
+            sums = np.zeros_like(C)
+            nz = counts > 0
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nz]
+            sums[nz] = np.add.reduceat(T[order], starts, axis=0)
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = T[rng.choice(T.shape[0], size=int(empty.sum()), replace=False)]
+            C = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-12)
+        index = cls(C)
+        index.add(X, start_row=0)
+        return index
+
+    def add(self, X: np.ndarray, start_row: int):
+        """Инкрементальная вставка строк [start_row, start_row + len(X)) без переобучения центроидов."""
+        if len(X) == 0:
+            return
+        a = _assign(X, self.centroids)
+        rows = np.arange(start_row, start_row + len(X), dtype=np.int64)
+        order = np.argsort(a, kind="stable")
+        a_sorted = a[order]
+        bounds = np.flatnonzero(np.diff(a_sorted)) + 1
+        for chunk in np.split(order, bounds):
+            self._lists[int(a[chunk[0]])].append(rows[chunk])
+        self.rows = max(self.rows, start_row + len(X))
+
+    def candidates(self, qn: np.ndarray, nprobe: int) -> np.ndarray:
+        probe = np.argsort(-(self.centroids @ qn))[:max(1, min(nprobe, self.nlist))]
+        parts = [c for l in probe for c in self._lists[int(l)]]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+    def save(self, path: str):
+        lists = [np.concatenate(l) if l else np.empty(0, dtype=np.int64) for l in self._lists]
+        starts = np.cumsum([0] + [len(l) for l in lists]).astype(np.int64)
+        tmp = f"{path}.tmp-{uuid.uuid4().hex[:8]}.npz"
+        np.savez(tmp, centroids=self.centroids, rows_by_list=np.concatenate(lists), starts=starts,
+                 rows=np.array(self.rows, dtype=np.int64))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as z:
+            C, flat, starts, rows = z["centroids"], z["rows_by_list"], z["starts"], int(z["rows"])
+        lists = [[flat[starts[i]:starts[i + 1]]] if starts[i + 1] > starts[i] else [] for i in range(C.shape[0])]
+        return cls(C, lists, rows)
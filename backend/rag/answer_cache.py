@@ -0,0 +1,88 @@
+# backend/rag/answer_cache.py
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+from functools import lru_cache
+import hashlib, re, threading, time, unicodedata
+
+from backend.utils.settings import settings
+
+_PUNCT = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES = re.compile(r"\s+")
+
+def normalize_query(query: str) -> str:
+    """Регистр, ё/е, пунктуация и пробелы не влияют на ответ — «почти точные» повторы совпадают."""
+    q = unicodedata.normalize("NFKC", query or "").lower().replace("ё", "е")
+    return _SPACES.sub(" ", _PUNCT.sub(" ", q)).strip()
+
+def answer_key(agent: str, model: str, query: str, hits: List[Dict[str, Any]], kb_version: int) -> str:
+    # порядок чанков в CONTEXT почти не меняет ответ — берём множество id
+    ids = sorted(str(h.get("id") or (h.get("meta") or {}).get("source", "")) for h in hits)
+    raw = "\x00".join([agent, model, normalize_query(query), ",".join(ids), str(kb_version)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class AnswerCache:
+    """
+    Кэш сгенерированных ответов RAG-агентов: (агент, модель, нормализованный запрос, id чанков, версия БЗ).
+    Смена kb_version стора сбрасывает кэш целиком; записи живут не дольше ttl, размер ограничен LRU.
+    """
+    def __init__(self, ttl_seconds: float = 3600, capacity: int = 2000):
+        self.ttl = ttl_seconds
+        self.capacity = capacity
+        self._items: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._kb_version: Optional[int] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, kb_version: int):
+        if self._kb_version != kb_version:
+            if self._items:
+                self.invalidations += 1
+            self._items.clear()
+            self._kb_version = kb_version
+
+    def get(self, key: str, kb_version: int) -> Optional[str]:
+        with self._lock:
+            self._check_version(kb_version)
+            item = self._items.get(key)
+            if item is None or time.time() - item[0] > self.ttl:
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: str, kb_version: int, answer: str):
+        with self._lock:
+            self._check_version(kb_version)
+            self._items[key] = (time.time(), answer)
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "items": len(self._items),
+                "capacity": self.capacity,
+                "kb_version": self._kb_version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+@lru_cache(maxsize=None)
+def answer_cache() -> AnswerCache | None:
+    """Общий кэш процесса (None, если выключен через ANSWER_CACHE=0)."""
+    if not settings.ANSWER_CACHE:
+        return None
+    return AnswerCache(settings.ANSWER_CACHE_TTL, settings.ANSWER_CACHE_SIZE)
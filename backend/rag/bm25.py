@@ -0,0 +1,161 @@
+# backend/rag/bm25.py
+# Инвертированный BM25-индекс по записям LocalVectorStore (строится в ingest, лежит рядом со стором).
+# Лексический поиск полностью локальный: точные термины ("мурабаха", "сукук") без похода в embeddings API.
+#
+#   python -m backend.rag.bm25 --dir data/embeddings
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from collections import Counter
+import argparse, os, re, uuid
+import numpy as np
+
+from backend.utils.logger import get_logger
+
+log = get_logger("bm25")
+
+BM25_FILE = "bm25.npz"
+_WORD = re.compile(r"\w+", re.UNICODE)
+_STEM = 6  # грубый стемминг: окончание + усечение, "мурабахи"/"мурабаха" -> "мураба", "сукуки"/"сукук" -> "сукук"
+_ENDING = re.compile(r"(ами|ями|ого|его|ому|ему|ыми|ими|ах|ях|ам|ям|ов|ев|ой|ей|ом|ем|ую|юю|ая|яя|ые|ие|ый|ий|es|а|я|ы|и|у|ю|е|о|ь|s)$")
+
+# служебные слова вопросов ("что такое ...", "what is ...") не должны перевешивать термин
+_STOP = frozenset("""
+и в во на с со по к о об от до из за для не но а или ли же бы то это что как такое такой какой какая какие
+где когда почему зачем можно мне меня мой моя я ты вы он она они есть был быть
+the a an of to in on for and or is are be what how which who why can do does my me i you it this that
+""".split())
+
+def _stem(word: str) -> str:
+    base = _ENDING.sub("", word)
+    return (base if len(base) >= 4 else word)[:_STEM]
+
+def tokenize(text: str) -> List[str]:
+    words = _WORD.findall((text or "").lower().replace("ё", "е"))
+    return [_stem(w) for w in words if w not in _STOP and (len(w) > 1 or w.isdigit())]
+
+class BM25Index:
+    """
+    Постинги в CSR-виде: для терма t — строки стора rows[starts[t]:starts[t+1]]
+    и заранее посчитанные веса idf * tf*(k1+1) / (tf + k1*(1-b+b*dl/avgdl)).
+    Запрос = сумма весов своих термов по плотному вектору длиной N (N — число строк стора).
+    """
+    def __init__(self, vocab: Dict[str, int], starts: np.ndarray, rows: np.ndarray, weights: np.ndarray,
+                 n_docs: int, kb_version: int = 0):
+        self.vocab = vocab
+        self.starts = starts
+        self.rows = rows
+        self.weights = weights
+        self.n_docs = n_docs
+        self.kb_version = kb_version
+
+    @classmethod
+    def build(cls, texts: Iterable[str], kb_version: int = 0, k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths: List[int] = []
+        for row, text in enumerate(texts):
+            toks = tokenize(text)
+            lengths.append(len(toks))
+            for term, tf in Counter(toks).items():
+                postings.setdefault(term, []).append((row, tf))
+        n = len(lengths)
+        dl = np.asarray(lengths, dtype=np.float32)
+        avgdl = float(dl.mean()) if n else 0.0
+
+        vocab: Dict[str, int] = {}
+        starts = [0]
+        rows_parts, w_parts = [], []
+        for term, plist in postings.items():
+            vocab[term] = len(vocab)
+            r = np.fromiter((p[0] for p in plist), dtype=np.int64, count=len(plist))
+            tf = np.fromiter((p[1] for p in plist), dtype=np.float32, count=len(plist))
+            idf = np.log(1.0 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            norm = k1 * (1.0 - b + b * dl[r] / (avgdl or 1.0))
+            rows_parts.append(r)
+            w_parts.append((idf * tf * (k1 + 1.0) / (tf + norm)).astype(np.float32))
+            starts.append(starts[-1] + len(plist))
+        return cls(
+            vocab,
+            np.asarray(starts, dtype=np.int64),
+            np.concatenate(rows_parts) if rows_parts else np.empty(0, dtype=np.int64),
+            np.concatenate(w_parts) if w_parts else np.empty(0, dtype=np.float32),
+            n, kb_version,
+        )
+
+    @classmethod
+    def from_store(cls, store) -> "BM25Index":
+        dead = set(store.deleted.tolist())   # удалённые строки остаются в нумерации, но без термов
+        texts = ("" if i in dead else rec.get("text") or "" for i, rec in enumerate(store.records()))
+        return cls.build(texts, kb_version=store.kb_version)
+
+    def scores(self, query: str) -> np.ndarray:
+        out = np.zeros(self.n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is not None:
+                s, e = self.starts[t], self.starts[t + 1]
+                out[self.rows[s:e]] += self.weights[s:e]  # строки внутри постинга уникальны
+        return out
+
+    def search_multi(self, queries: Sequence[str], top_k: int = 4) -> Tuple[np.ndarray, np.ndarray]:
+        """Лучшие строки по максимуму BM25 среди вариантов запроса (как search_multi у стора); нулевые отбрасываются."""
+        if not self.n_docs or not queries:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        sc = np.max([self.scores(q) for q in queries], axis=0)
+        k = min(top_k, self.n_docs)
+        idx = np.argpartition(-sc, k - 1)[:k]
+        idx = idx[np.argsort(-sc[idx])]
+        idx = idx[sc[idx] > 0]
+        return idx, sc[idx]
+
+    def save(self, path: str):
+        terms = np.array(sorted(self.vocab, key=self.vocab.get)) if self.vocab else np.array([], dtype=str)
+        tmp = f"{path}.tmp-{uuid.uuid4().hex[:8]}.npz"
+        np.savez(tmp, terms=terms, starts=self.starts, rows=self.rows, weights=self.weights,
+                 n_docs=np.array(self.n_docs, dtype=np.int64), kb_version=np.array(self.kb_version, dtype=np.int64))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path) as z:
+            vocab = {str(t): i for i, t in enumerate(z["terms"])}
+            return cls(vocab, z["starts"], z["rows"], z["weights"], int(z["n_docs"]), int(z["kb_version"]))
+
+def index_path(store) -> str:
+    return os.path.join(store.dir, BM25_FILE)
+
+def build_for_store(store) -> BM25Index:
+    """Перестраивает и сохраняет индекс рядом со стором (вызывается из ingest)."""
+    index = BM25Index.from_store(store)
+    index.save(index_path(store))
+    log.info(f"bm25 built: {index.n_docs} docs, {len(index.vocab)} terms (kb_version={index.kb_version})")
+    return index
+
+def index_key(store) -> Tuple[int, Optional[float]]:
+    """(версия БЗ, mtime файла индекса) — поменялось одно из них, есть смысл пробовать загрузку снова."""
+    path = index_path(store)
+    return store.kb_version, os.path.getmtime(path) if os.path.exists(path) else None
+
+def load_for_store(store) -> Optional[BM25Index]:
+    """Сохранённый индекс, если он соответствует текущей версии БЗ, иначе None.
+    Перестройка — только в ingest или `python -m backend.rag.bm25`: на пути запроса это O(N) по всем записям."""
+    path = index_path(store)
+    if not os.path.exists(path):
+        return None
+    try:
+        index = BM25Index.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        log.warning(f"bm25 load failed: {e}")
+        return None
+    if index.kb_version != store.kb_version or index.n_docs != len(store):
+        return None
+    return index
+
+if __name__ == "__main__":
+    from backend.rag.store import LocalVectorStore
+
+    parser = argparse.ArgumentParser(description="Перестроить BM25-индекс по записям LocalVectorStore")
+    parser.add_argument("--dir", default="data/embeddings")
+    args = parser.parse_args()
+    store = LocalVectorStore(args.dir, auto_compact=False)
+    index = build_for_store(store)
+    print(f"OK: {index.n_docs} docs, {len(index.vocab)} terms -> {index_path(store)}")
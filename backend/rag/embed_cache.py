@@ -0,0 +1,153 @@
+# backend/rag/embed_cache.py
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Sequence
+from collections import OrderedDict
+from functools import lru_cache
+import hashlib, os, sqlite3, threading, time
+import numpy as np
+
+from backend.utils.settings import settings
+from backend.utils.logger import get_logger
+
+log = get_logger("embed-cache")
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    Контентно-адресуемый кэш эмбеддингов по ключу (model, sha256(text)).
+    Два уровня: LRU в памяти процесса и SQLite на диске (общий для воркеров и ingest).
+    Оба уровня ограничены по числу записей; на диске вытесняются давно не читанные.
+    _lock держится только вокруг LRU в памяти; у SQLite своя блокировка соединения (_db_lock),
+    так что попадания в память не ждут дискового I/O других потоков.
+    """
+    def __init__(self, path: str | None = None, mem_items: int = 4096, disk_items: int = 200_000):
+        self.mem_items = mem_items
+        self.disk_items = disk_items
+        self._mem: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self.hits_mem = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self._db: sqlite3.Connection | None = None
+        # atime прочитанных с диска ключей пишется не на каждый hit, а пачкой вместе со следующей записью
+        self._touched: Dict[str, float] = {}
+        self._disk_count = 0  # приблизительно (INSERT OR REPLACE может не добавлять строку) — уточняется при вытеснении
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS emb (key TEXT PRIMARY KEY, vec BLOB NOT NULL, atime REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS emb_atime ON emb(atime)")
+            self._disk_count = self._db.execute("SELECT COUNT(*) FROM emb").fetchone()[0]
+
+    def _mem_put(self, key: str, vec: np.ndarray):
+        self._mem[key] = vec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_items:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        keys = [cache_key(model, t) for t in texts]
+        out: List[Optional[np.ndarray]] = [None] * len(keys)
+        missing: Dict[str, List[int]] = {}
+        with self._lock:
+            for i, k in enumerate(keys):
+                v = self._mem.get(k)
+                if v is not None:
+                    self._mem.move_to_end(k)
+                    out[i] = v
+                    self.hits_mem += 1
+                else:
+                    missing.setdefault(k, []).append(i)
+
+        found: Dict[str, np.ndarray] = {}
+        if missing and self._db is not None:
+            try:
+                with self._db_lock:
+                    found = self._db_get(list(missing))
+            except sqlite3.Error as e:
+                log.warning(f"disk tier read failed: {e}")
+
+        with self._lock:
+            for k, v in found.items():
+                self._mem_put(k, v)
+                for i in missing.pop(k):
+                    out[i] = v
+                    self.hits_disk += 1
+            self.misses += sum(len(v) for v in missing.values())
+        return out
+
+    def _db_get(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        for s in range(0, len(keys), 500):  # лимит параметров SQLite
+            part = keys[s:s + 500]
+            q = f"SELECT key, vec FROM emb WHERE key IN ({','.join('?' * len(part))})"
+            for k, blob in self._db.execute(q, part):
+                found[k] = np.frombuffer(blob, dtype=np.float32)
+        now = time.time()
+        for k in found:
+            self._touched[k] = now
+        return found
+
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany("UPDATE emb SET atime=? WHERE key=?", [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+
+    def put_many(self, model: str, texts: Sequence[str], vecs: Sequence[Sequence[float]]):
+        rows = []
+        now = time.time()
+        with self._lock:
+            for t, v in zip(texts, vecs):
+                k = cache_key(model, t)
+                arr = np.asarray(v, dtype=np.float32)
+                self._mem_put(k, arr)
+                rows.append((k, arr.tobytes(), now))
+        if self._db is not None and rows:
+            try:
+                with self._db_lock:
+                    self._flush_touched()
+                    self._db.executemany("INSERT OR REPLACE INTO emb(key, vec, atime) VALUES (?,?,?)", rows)
+                    self._disk_count += len(rows)
+                    if self._disk_count > self.disk_items:
+                        self._db_evict()
+            except sqlite3.Error as e:
+                log.warning(f"disk tier write failed: {e}")
+
+    def _db_evict(self):
+        n = self._db.execute("SELECT COUNT(*) FROM emb").fetchone()[0]
+        self._disk_count = n
+        if n <= self.disk_items:
+            return
+        # вытесняем с запасом 10%, чтобы не платить за DELETE на каждой вставке
+        drop = n - int(self.disk_items * 0.9)
+        self._db.execute("DELETE FROM emb WHERE key IN (SELECT key FROM emb ORDER BY atime LIMIT ?)", (drop,))
+        self._disk_count -= drop
+        self.disk_evictions += drop
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits_mem + self.hits_disk + self.misses
+            return {
+                "mem_items": len(self._mem),
+                "disk_items": self._disk_count,
+                "hits_mem": self.hits_mem,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "evictions": self.evictions + self.disk_evictions,
+                "hit_rate": round((self.hits_mem + self.hits_disk) / total, 4) if total else 0.0,
+            }
+
+@lru_cache(maxsize=None)
+def embedding_cache() -> EmbeddingCache | None:
+    """Общий кэш процесса (None, если выключен через EMB_CACHE=0)."""
+    if not settings.EMB_CACHE:
+        return None
+    return EmbeddingCache(settings.EMB_CACHE_PATH or None, settings.EMB_CACHE_MEM_ITEMS, settings.EMB_CACHE_DISK_ITEMS)
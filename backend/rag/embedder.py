@@ -1,20 +1,50 @@
 from typing import List
-from openai import OpenAI
-import httpx
-from backend.utils.settings import settings
+import asyncio
+from backend.metrics import token_meter
+from backend.utils.clients import async_openai_client, openai_client
+from backend.rag.embed_cache import embedding_cache
 
 class Embedder:
     def __init__(self, model: str = "text-embedding-3-small", timeout: int | None = None):
         self.model = model
-        self.client = OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_BASE_URL,
-            timeout=timeout or settings.REQUEST_TIMEOUT_SECONDS,
-            max_retries=2,
-            http_client=httpx.Client(timeout=timeout or settings.REQUEST_TIMEOUT_SECONDS),
-        )
+        self.client = openai_client(timeout)
+        self.aclient = async_openai_client(timeout)
+        self.cache = embedding_cache()
 
-    def encode(self, texts: List[str]) -> List[List[float]]:
+    def _encode_remote(self, texts: List[str]) -> List[List[float]]:
         # OpenAI embeddings API поддерживает батчи
-        resp = self.client.embeddings.create(model=self.model, input=texts)
+        resp = token_meter.metered("embed", self.client.embeddings.create, model=self.model, input=texts)
+        return [d.embedding for d in resp.data]
+
+    async def _aencode_remote(self, texts: List[str]) -> List[List[float]]:
+        resp = await token_meter.ametered("embed", self.aclient.embeddings.create, model=self.model, input=texts)
         return [d.embedding for d in resp.data]
+
+    def _lookup(self, texts: List[str]):
+        cached = self.cache.get_many(self.model, texts)
+        # в сеть уходят только уникальные промахи; повторы внутри батча считаются один раз
+        miss = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+        return cached, miss
+
+    def _merge(self, texts: List[str], cached, miss: List[str], vecs: List[List[float]]) -> List[List[float]]:
+        fresh = {}
+        if miss:
+            self.cache.put_many(self.model, miss, vecs)
+            fresh = dict(zip(miss, vecs))
+        return [v.tolist() if v is not None else fresh[t] for t, v in zip(texts, cached)]
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        if self.cache is None:
+            return self._encode_remote(texts)
+        cached, miss = self._lookup(texts)
+        return self._merge(texts, cached, miss, self._encode_remote(miss) if miss else [])
+
+    async def aencode(self, texts: List[str]) -> List[List[float]]:
+        if self.cache is None:
+            return await self._aencode_remote(texts)
+        # SQLite-уровень кэша (общий файл воркеров, замок, busy timeout) — не в цикле событий
+        cached, miss = await asyncio.to_thread(self._lookup, texts)
+        vecs = await self._aencode_remote(miss) if miss else []
+        if not miss:
+            return self._merge(texts, cached, miss, vecs)
+        return await asyncio.to_thread(self._merge, texts, cached, miss, vecs)
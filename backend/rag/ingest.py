@@ -1,9 +1,34 @@
 # backend/rag/ingest.py
-import os, argparse
-from typing import List, Dict
+# Загрузка документов в LocalVectorStore: файлы, каталоги и glob-маски.
+# Разбор и нарезка идут в пуле процессов, эмбеддинги — батчами (лимит по числу чанков и по токенам)
+# с ограниченным числом одновременных запросов к API. Готовые документы пишутся в стор пачками,
+# после каждой пачки обновляется checkpoint — упавший прогон при повторном запуске продолжает с места сбоя.
+#
+#   python -m backend.rag.ingest --file data/knowledge_base/islamic_finance_kb.md
+#   python -m backend.rag.ingest --dir docs/regulations --glob "docs/products/**/*.html" --concurrency 8
+from __future__ import annotations
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import os, argparse, glob, hashlib, json, time, uuid
 from bs4 import BeautifulSoup
+from backend.rag import bm25
 from backend.rag.embedder import Embedder
 from backend.rag.store import LocalVectorStore
+from backend.utils.settings import settings
+from backend.utils.logger import get_logger
+
+try:
+    import tiktoken
+    _ENC = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENC = None
+
+log = get_logger("ingest")
+
+EXTENSIONS = (".md", ".markdown", ".txt", ".html", ".htm")
+CHECKPOINT = "ingest_checkpoint.json"
+_CHARS_PER_TOKEN = 3  # оценка без tiktoken, как в reranker
 
 def read_text_file(path: str) -> str:
     with open(path, "r", encoding="utf-8", errors="ignore") as f:
@@ -46,34 +71,303 @@ def chunk_markdown(md: str, chunk_size: int = 900, overlap: int = 150) -> List[s
             chunks.extend(sliding(b))
     return chunks
 
-def ingest_single_file(file_path: str):
-    if not os.path.exists(file_path):
-        print(f"File not found: {file_path}")
-        return
+def count_tokens(text: str) -> int:
+    if _ENC is not None:
+        return len(_ENC.encode(text, disallowed_special=()))
+    return len(text) // _CHARS_PER_TOKEN + 1
 
-    ext = os.path.splitext(file_path)[1].lower()
-    if ext in [".html", ".htm"]:
-        text = read_html_file(file_path)
-    else:
-        text = read_text_file(file_path)
+# ---------- поиск файлов и разбор (в процессах пула) ----------
 
-    chunks = chunk_markdown(text)
+def discover(files: Iterable[str] = (), dirs: Iterable[str] = (), patterns: Iterable[str] = ()) -> List[str]:
+    """Пути документов без повторов, в стабильном порядке (от него зависят номера сегментов и checkpoint)."""
+    found: List[str] = []
+    for f in files:
+        if os.path.isfile(f):
+            found.append(f)
+        else:
+            log.warning(f"file not found: {f}")
+    for d in dirs:
+        for root, _, names in os.walk(d):
+            found += [os.path.join(root, n) for n in sorted(names) if n.lower().endswith(EXTENSIONS)]
+    for p in patterns:
+        found += [f for f in sorted(glob.glob(p, recursive=True)) if os.path.isfile(f) and f.lower().endswith(EXTENSIONS)]
+    return list(dict.fromkeys(os.path.relpath(f) for f in found))
 
-    if not chunks:
-        print("Файл пустой или не распарсен.")
+def _parse(path: str, known_sha: Optional[str], chunk_size: int, overlap: int) -> Dict[str, Any]:
+    """Хэш + текст + чанки одного файла. Если хэш совпал с checkpoint, разбор не нужен."""
+    with open(path, "rb") as f:
+        sha = hashlib.sha1(f.read()).hexdigest()
+    if sha == known_sha:
+        return {"path": path, "sha1": sha, "chunks": None, "bytes": 0}
+    ext = os.path.splitext(path)[1].lower()
+    text = read_html_file(path) if ext in (".html", ".htm") else read_text_file(path)
+    chunks = [c for c in chunk_markdown(text, chunk_size, overlap) if c.strip()]
+    return {"path": path, "sha1": sha, "chunks": chunks, "tokens": [count_tokens(c) for c in chunks],
+            "bytes": len(text.encode("utf-8"))}
+
+def _parse_star(args: Tuple[str, Optional[str], int, int]) -> Dict[str, Any]:
+    return _parse(*args)
+
+# ---------- checkpoint ----------
+
+class Checkpoint:
+    """Какие файлы (и в какой версии по sha1) уже целиком записаны в стор. Пишется атомарно, как manifest стора."""
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+
+    def sha1(self, path: str) -> Optional[str]:
+        return (self.files.get(path) or {}).get("sha1")
+
+    def mark(self, docs: List["_Doc"], kb_version: int):
+        for d in docs:
+            self.files[d.path] = {"sha1": d.sha1, "chunks": len(d.chunks), "kb_version": kb_version}
+        tmp = f"{self.path}.tmp-{uuid.uuid4().hex[:8]}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def reset(self):
+        self.files = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# ---------- эмбеддинги ----------
+
+class _Doc:
+    __slots__ = ("path", "sha1", "chunks", "vecs", "left", "replaces")
+
+    def __init__(self, path: str, sha1: str, chunks: List[str], replaces: bool = False):
+        self.path = path
+        self.replaces = replaces   # файл уже был в сторе в другой версии — прежние чанки удаляются при записи
+        self.sha1 = sha1
+        self.chunks = chunks
+        self.vecs: List[Optional[List[float]]] = [None] * len(chunks)
+        self.left = len(chunks)
+
+class Batcher:
+    """Копит чанки (из разных документов) в батч, пока он не упрётся в лимит по числу или по токенам."""
+    def __init__(self, max_items: int, max_tokens: int):
+        self.max_items = max(1, max_items)
+        self.max_tokens = max(1, max_tokens)
+        self.items: List[Tuple[_Doc, int]] = []
+        self.tokens = 0
+
+    def add(self, doc: _Doc, i: int, tokens: int) -> Optional[List[Tuple[_Doc, int]]]:
+        """Возвращает готовый батч, если новый чанк в текущий уже не помещается."""
+        out = None
+        if self.items and (len(self.items) >= self.max_items or self.tokens + tokens > self.max_tokens):
+            out = self.flush()
+        self.items.append((doc, i))
+        self.tokens += tokens
+        return out
+
+    def flush(self) -> Optional[List[Tuple[_Doc, int]]]:
+        out, self.items, self.tokens = self.items or None, [], 0
+        return out
+
+class _EmbedStats:
+    __slots__ = ("requests", "retries", "splits")
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.splits = 0
+
+def embed_batch(embedder, texts: List[str], retries: int, stats: _EmbedStats, backoff: float = 0.5) -> List[List[float]]:
+    """Батч с повторами; если он так и не прошёл (лимит размера запроса, битый текст) — делим пополам."""
+    for attempt in range(retries + 1):
+        try:
+            stats.requests += 1
+            return embedder.encode(texts)
+        except Exception as e:
+            if attempt == retries:
+                if len(texts) == 1:
+                    raise
+                log.warning(f"embedding batch of {len(texts)} failed ({e}); splitting")
+                stats.splits += 1
+                mid = len(texts) // 2
+                return (embed_batch(embedder, texts[:mid], retries, stats, backoff)
+                        + embed_batch(embedder, texts[mid:], retries, stats, backoff))
+            stats.retries += 1
+            time.sleep(backoff * 2 ** attempt)
+    raise RuntimeError("unreachable")
+
+# ---------- пайплайн ----------
+
+def _parsed(paths: List[str], ckpt: Checkpoint, workers: int, chunk_size: int, overlap: int) -> Iterator[Dict[str, Any]]:
+    jobs = [(p, ckpt.sha1(p), chunk_size, overlap) for p in paths]
+    if workers <= 1 or len(jobs) <= 1:
+        yield from map(_parse_star, jobs)
         return
+    # pool.map отправил бы в пул сразу все файлы, и разобранные чанки копились бы в памяти быстрее, чем уходят
+    # в эмбеддинги; держим окно из 2 × workers задач и добавляем новую по мере того, как забираем результат
+    todo = iter(jobs)
+    pending: "deque[Future]" = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            for job in todo:
+                pending.append(pool.submit(_parse_star, job))
+                if len(pending) >= 2 * workers:
+                    break
+            while pending:
+                parsed = pending.popleft().result()
+                job = next(todo, None)
+                if job is not None:
+                    pending.append(pool.submit(_parse_star, job))
+                yield parsed
+        finally:
+            # потребитель упал или бросил генератор — не разбираем файлы, которые уже никто не заберёт
+            for fut in pending:
+                fut.cancel()
+
+def ingest(paths: List[str], store_dir: str = "data/embeddings", embedder=None, workers: int | None = None,
+           concurrency: int | None = None, batch_size: int | None = None, batch_tokens: int | None = None,
+           flush_rows: int | None = None, retries: int | None = None, resume: bool = True) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    workers = workers or settings.INGEST_WORKERS or os.cpu_count() or 1
+    concurrency = max(1, concurrency or settings.INGEST_CONCURRENCY)
+    flush_rows = flush_rows or settings.INGEST_FLUSH_ROWS
+    retries = settings.INGEST_RETRIES if retries is None else retries
+
+    embedder = embedder or Embedder()           # text-embedding-3-small
+    store = LocalVectorStore(store_dir)
+    ckpt = Checkpoint(os.path.join(store_dir, CHECKPOINT))
+    if not resume:
+        ckpt.reset()
+
+    batcher = Batcher(batch_size or settings.INGEST_BATCH_SIZE, batch_tokens or settings.INGEST_BATCH_TOKENS)
+    stats = _EmbedStats()
+    report = {"files": len(paths), "skipped": 0, "empty": 0, "replaced": 0, "ingested": 0, "chunks": 0, "tokens": 0, "bytes": 0}
+    ready: List[_Doc] = []
+    ready_rows = 0
+    write_failed = False
+
+    def commit():
+        nonlocal ready, ready_rows, write_failed
+        if not ready or write_failed:
+            return
+        docs, ready, ready_rows = ready, [], 0
+        texts = [c for d in docs for c in d.chunks]
+        vecs = [v for d in docs for v in d.vecs]
+        metas = [{"source": d.path, "chunk": i} for d in docs for i in range(len(d.chunks))]
+        try:
+            store.add_texts(texts, vecs, metas, replace_sources=[d.path for d in docs if d.replaces])
+            # checkpoint — только после того, как manifest стора уже указывает на новый сегмент
+            ckpt.mark(docs, store.kb_version)
+        except Exception:
+            # стор или checkpoint в неизвестном состоянии: больше не пишем, повторный запуск сверится с checkpoint
+            write_failed = True
+            raise
+        report["ingested"] += len(docs)
+
+    def collect(fut: Future, batch: List[Tuple[_Doc, int]]):
+        nonlocal ready_rows
+        for (doc, i), v in zip(batch, fut.result()):
+            doc.vecs[i] = v
+            doc.left -= 1
+            if doc.left == 0:
+                ready.append(doc)
+                ready_rows += len(doc.chunks)
+        if ready_rows >= flush_rows:
+            commit()
 
-    embedder = Embedder()                     # text-embedding-3-small
-    store = LocalVectorStore("data/embeddings")
+    inflight: Dict[Future, List[Tuple[_Doc, int]]] = {}
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ingest-embed") as pool:
+        def submit(batch: Optional[List[Tuple[_Doc, int]]]):
+            if not batch:
+                return
+            # не больше concurrency запросов в полёте: разбор не убегает вперёд и не держит в памяти весь корпус
+            while len(inflight) >= concurrency:
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    collect(fut, inflight.pop(fut))
+            texts = [doc.chunks[i] for doc, i in batch]
+            inflight[pool.submit(embed_batch, embedder, texts, retries, stats)] = batch
 
-    vecs = embedder.encode(chunks)
-    metas: List[Dict] = [{"source": os.path.relpath(file_path), "chunk": i} for i in range(len(chunks))]
-    store.add_texts(chunks, vecs, metas)
+        try:
+            for parsed in _parsed(paths, ckpt, workers, settings.CHUNK_SIZE, settings.CHUNK_OVERLAP):
+                if parsed["chunks"] is None:
+                    report["skipped"] += 1
+                    continue
+                if not parsed["chunks"]:
+                    report["empty"] += 1
+                    continue
+                changed = bool(ckpt.sha1(parsed["path"]))
+                if changed:
+                    # те же (source, chunk) у старой и новой версии: старые строки помечаются удалёнными
+                    # в той же записи manifest, что и новые, — устаревший текст и «хвосты» не попадут в выдачу
+                    log.info(f"{parsed['path']} changed since last ingest; replacing its chunks")
+                    report["replaced"] += 1
+                doc = _Doc(parsed["path"], parsed["sha1"], parsed["chunks"], replaces=changed)
+                report["chunks"] += len(doc.chunks)
+                report["tokens"] += sum(parsed["tokens"])
+                report["bytes"] += parsed["bytes"]
+                for i, tokens in enumerate(parsed["tokens"]):
+                    submit(batcher.add(doc, i, tokens))
+            submit(batcher.flush())
+            for fut in list(inflight):
+                collect(fut, inflight.pop(fut))
+        finally:
+            # при ошибке эмбеддингов или разбора сохраняем всё, что успело посчитаться: повторный запуск начнёт
+            # с остального; после сбоя записи в стор — ничего не дописываем
+            if not write_failed:
+                for fut in [f for f in inflight if f.done() and not f.exception()]:
+                    collect(fut, inflight.pop(fut))
+                commit()
+            store.wait_compaction()  # фоновая компакция не должна оборваться на выходе процесса
 
-    print(f"OK: добавлено {len(chunks)} фрагментов из {file_path}.")
+    if report["ingested"]:
+        bm25.build_for_store(store)
+
+    elapsed = time.perf_counter() - t0
+    report.update({
+        "embed_requests": stats.requests,
+        "retries": stats.retries,
+        "splits": stats.splits,
+        "seconds": round(elapsed, 2),
+        "files_per_s": round(report["ingested"] / elapsed, 2),
+        "chunks_per_s": round(report["chunks"] / elapsed, 1),
+        "tokens_per_s": round(report["tokens"] / elapsed, 1),
+        "mb_per_s": round(report["bytes"] / elapsed / 1e6, 3),
+        "store_rows": len(store),
+    })
+    return report
+
+def ingest_single_file(file_path: str):
+    if not os.path.exists(file_path):
+        print(f"File not found: {file_path}")
+        return
+    report = ingest([os.path.relpath(file_path)], workers=1)
+    if report["skipped"]:
+        print(f"Файл {file_path} не менялся с прошлой загрузки (см. {CHECKPOINT}).")
+        return
+    if not report["chunks"]:
+        print("Файл пустой или не распарсен.")
+        return
+    print(f"OK: добавлено {report['chunks']} фрагментов из {file_path}.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--file", required=True, help="Путь к вашему .md/.txt/.html")
+    parser.add_argument("--file", action="append", default=[], help="Путь к вашему .md/.txt/.html (можно несколько раз)")
+    parser.add_argument("--dir", action="append", default=[], help="Каталог: рекурсивно все .md/.txt/.html")
+    parser.add_argument("--glob", action="append", default=[], help='Маска, например "docs/**/*.md"')
+    parser.add_argument("--store", default="data/embeddings")
+    parser.add_argument("--workers", type=int, default=None, help="процессов для разбора (по умолчанию INGEST_WORKERS)")
+    parser.add_argument("--concurrency", type=int, default=None, help="одновременных запросов к embeddings API")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--batch-tokens", type=int, default=None)
+    parser.add_argument("--no-resume", action="store_true", help="игнорировать checkpoint и загрузить всё заново")
     args = parser.parse_args()
-    ingest_single_file(args.file)
+
+    paths = discover(args.file, args.dir, args.glob)
+    if not paths:
+        parser.error("нет файлов: укажите --file, --dir или --glob")
+    report = ingest(paths, args.store, workers=args.workers, concurrency=args.concurrency,
+                    batch_size=args.batch_size, batch_tokens=args.batch_tokens, resume=not args.no_resume)
+    print("  ".join(f"{k}={v}" for k, v in report.items()))
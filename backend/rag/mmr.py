@@ -0,0 +1,61 @@
+# backend/rag/mmr.py
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+
+from backend.rag.bm25 import tokenize
+from backend.utils.settings import settings
+
+def lexical_overlap(query: str, texts: Sequence[str]) -> np.ndarray:
+    """Доля (стемированных) термов запроса, встречающихся в тексте кандидата."""
+    q = set(tokenize(query))
+    if not q:
+        return np.zeros(len(texts), dtype=np.float32)
+    return np.array([len(q & set(tokenize(t))) / len(q) for t in texts], dtype=np.float32)
+
+class LocalReranker:
+    """
+    Локальный reranker без сетевых вызовов (RERANK_MODE=mmr).
+    Релевантность = (1 - w) * косинус с вариантами запроса + w * лексическое перекрытие;
+    порядок — maximal marginal relevance: lambda * rel - (1 - lambda) * max сходство с уже выбранными,
+    чтобы в CONTEXT не попадали почти одинаковые чанки. Векторы берутся из LocalVectorStore по номеру строки.
+    Ответ в формате LLM-Reranker: [{"index", "score"}].
+    """
+    def __init__(self, store=None, lam: float | None = None, lex_weight: float | None = None):
+        self.store = store
+        self.lam = settings.MMR_LAMBDA if lam is None else lam
+        self.lex_weight = settings.MMR_LEX_WEIGHT if lex_weight is None else lex_weight
+
+    def _doc_vectors(self, candidates: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+        rows = [c.get("row") for c in candidates]
+        if self.store is None or any(r is None for r in rows):
+            return None
+        return self.store.vectors(np.asarray(rows, dtype=np.int64))
+
+    def rank(self, query: str, candidates: List[Dict[str, Any]], query_vecs: Optional[List[List[float]]] = None,
+             top_k: int = 5) -> List[Dict[str, Any]]:
+        if not candidates:
+            return []
+        lex = lexical_overlap(query, [c.get("text") or "" for c in candidates])
+        D = self._doc_vectors(candidates)
+
+        # без векторов запроса (BM25-only) релевантность чисто лексическая
+        if D is not None and query_vecs is not None and len(query_vecs):
+            Q = np.atleast_2d(np.asarray(query_vecs, dtype=np.float32))
+            Q = Q / (np.linalg.norm(Q, axis=1, keepdims=True) + 1e-12)
+            dense = (D @ Q.T).max(axis=1)
+            rel = (1.0 - self.lex_weight) * dense + self.lex_weight * lex
+        else:
+            rel = lex
+        sim = D @ D.T if D is not None else np.zeros((len(candidates), len(candidates)), dtype=np.float32)
+
+        selected: List[int] = []
+        best_sim = np.zeros(len(candidates), dtype=np.float32)  # max сходство с выбранными
+        remaining = np.ones(len(candidates), dtype=bool)
+        for _ in range(min(top_k, len(candidates))):
+            mmr = np.where(remaining, self.lam * rel - (1.0 - self.lam) * best_sim, -np.inf)
+            i = int(np.argmax(mmr))
+            selected.append(i)
+            remaining[i] = False
+            best_sim = np.maximum(best_sim, sim[i])
+        return [{"index": i, "score": float(rel[i])} for i in selected]
@@ -0,0 +1,80 @@
+# backend/rag/packed.py
+# Упакованный формат стора, который воркеры делят через page cache:
+#   records.bin      — JSON-записи (UTF-8) подряд, без разделителей
+#   records.idx.npy  — uint64 смещения записей (N+1), открываются через mmap
+#   <name>.npy       — массивы векторов, открываются np.load(mmap_mode="r")
+# Открытие не зависит от размера KB: ничего не парсится, записи декодируются лениво по индексу.
+from __future__ import annotations
+from typing import Any, Dict, Iterable, Iterator
+import os, json, mmap, shutil, uuid
+import numpy as np
+
+RECORDS_BIN = "records.bin"
+RECORDS_IDX = "records.idx.npy"
+
+class PackedRecords:
+    """Read-only последовательность записей поверх mmap; record[i] декодируется по требованию."""
+    def __init__(self, dir_path: str):
+        self.dir = dir_path
+        self._idx = np.load(os.path.join(dir_path, RECORDS_IDX), mmap_mode="r")
+        self._f = open(os.path.join(dir_path, RECORDS_BIN), "rb")
+        size = os.fstat(self._f.fileno()).st_size
+        # mmap нулевой длины не создаётся — пустой стор читаем как пустую последовательность
+        self._buf = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return max(0, int(self._idx.shape[0]) - 1)
+
+    def raw(self, i: int) -> bytes:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._buf[int(self._idx[i]):int(self._idx[i + 1])]
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        return json.loads(self.raw(i))
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        self._f.close()
+
+def exists(dir_path: str) -> bool:
+    return os.path.exists(os.path.join(dir_path, RECORDS_IDX))
+
+def load_array(dir_path: str, name: str) -> np.ndarray | None:
+    path = os.path.join(dir_path, f"{name}.npy")
+    return np.load(path, mmap_mode="r") if os.path.exists(path) else None
+
+def write_packed(dir_path: str, records: Iterable[Dict[str, Any]], arrays: Dict[str, np.ndarray]) -> None:
+    """
+    Пишет упакованный каталог целиком во временный каталог и подменяет им dir_path.
+    Уже открытые mmap старой версии остаются валидными (файлы живут до закрытия).
+    """
+    parent = os.path.dirname(os.path.abspath(dir_path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = f"{dir_path}.tmp-{uuid.uuid4().hex[:8]}"
+    os.makedirs(tmp)
+
+    offsets = [0]
+    with open(os.path.join(tmp, RECORDS_BIN), "wb") as f:
+        for rec in records:
+            b = json.dumps(rec, ensure_ascii=False).encode("utf-8")
+            f.write(b)
+            offsets.append(offsets[-1] + len(b))
+    np.save(os.path.join(tmp, RECORDS_IDX), np.asarray(offsets, dtype=np.uint64))
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(arr))
+
+    old = None
+    if os.path.exists(dir_path):
+        old = f"{dir_path}.old-{uuid.uuid4().hex[:8]}"
+        os.rename(dir_path, old)
+    os.rename(tmp, dir_path)
+    if old:
+        shutil.rmtree(old, ignore_errors=True)
@@ -1,10 +1,11 @@
 from __future__ import annotations
 from typing import List, Dict, Any, Optional
-from openai import OpenAI
-import httpx, json, re
+import asyncio, json, re
 
 from backend.utils.settings import settings
+from backend.utils.clients import async_openai_client, openai_client
 from backend.utils.logger import get_logger
+from backend.metrics import token_meter, tracing
 
 log = get_logger("query-transform")
 
@@ -18,7 +19,7 @@ _SYS_REWRITE = """You rewrite the user's message into a single standalone search
 _SYS_MULTI = """Generate up to {k} alternative phrasings or keyword-style variants for the following query.
 - Cover synonyms, domain terms, and likely KB wording.
 - Prefer short, retrieval-friendly strings (no extra punctuation).
-Return a JSON object: {"queries": ["q1","q2",...]}"""
+Return a JSON object: {{"queries": ["q1","q2",...]}}"""
 
 _SYS_HYDE = """Write a short hypothetical answer/passage (5-7 lines) likely to appear in the KB for the query below.
 Neutral, factual tone. No hallucinated brand claims. Return plain text only (no JSON)."""
@@ -32,77 +33,68 @@ def _lang_mirror(q: str) -> Optional[str]:
         return f"English equivalent of: {q}"
     return f"Русский эквивалент запроса: {q}"
 
+def _parse_multi(raw: str, k: int) -> List[str]:
+    try:
+        data = json.loads(raw)
+        qs = data.get("queries")
+        if not isinstance(qs, list):
+            raise ValueError("'queries' not a list")
+        out = [q.strip() for q in qs if isinstance(q, str) and q.strip()]
+        if out:
+            return out
+        raise ValueError("empty queries")
+    except Exception:
+    
+        guess = [ln.strip("-• ").strip() for ln in raw.splitlines() if ln.strip()]
+        guess = [g for g in guess if len(g) > 1]
+        if len(guess) <= 1 and raw:
+            parts = [p.strip() for p in raw.split(",") if p.strip()]
+            if len(parts) > 1:
+                guess = parts
+        # ограничим k
+        guess = guess[:k]
+        return guess
+
 class QueryTransformer:
     """Историо-осознанный rewrite + multi-query expansion + (опц.) HyDE."""
     def __init__(self):
-        self.client = OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_BASE_URL,
-            timeout=settings.REQUEST_TIMEOUT_SECONDS,
-            max_retries=2,
-            http_client=httpx.Client(timeout=settings.REQUEST_TIMEOUT_SECONDS),
-        )
+        self.client = openai_client()
+        self.aclient = async_openai_client()
         self.model = settings.INTENT_MODEL
 
-    def history_aware_rewrite(self, query: str, history_note: str = "") -> str:
+    def _rewrite_kwargs(self, query: str, history_note: str) -> Dict[str, Any]:
         sys = _SYS_REWRITE + (f"\n\nConversation context:\n{history_note}" if history_note else "")
-        r = self.client.chat.completions.create(
+        return dict(
             model=self.model, temperature=0.0,
             messages=[{"role":"system","content":sys},{"role":"user","content":query}]
         )
-        return (r.choices[0].message.content or "").strip()
-
 
-    def multi_expand(self, rewritten: str, k: int) -> List[str]:
-        sys = _SYS_MULTI.format(k=k)
-        r = self.client.chat.completions.create(
-            model=self.model, temperature=0.2,
-            response_format={"type":"json_object"},
-            messages=[{"role":"system","content":sys},{"role":"user","content":rewritten}]
-        )
-        raw = (r.choices[0].message.content or "").strip()
-        try:
-            data = json.loads(raw)
-            qs = data.get("queries")
-            if not isinstance(qs, list):
-                raise ValueError("'queries' not a list")
-            out = [q.strip() for q in qs if isinstance(q, str) and q.strip()]
-            if out:
-                return out
-            raise ValueError("empty queries")
-        except Exception:
-        
-            guess = [ln.strip("-• ").strip() for ln in raw.splitlines() if ln.strip()]
-            guess = [g for g in guess if len(g) > 1]
-            if len(guess) <= 1 and raw:
-                parts = [p.strip() for p in raw.split(",") if p.strip()]
-                if len(parts) > 1:
-                    guess = parts
-            # ограничим k
-            guess = guess[:k]
-            return guess
-
-    # def multi_expand(self, rewritten: str, k: int) -> List[str]:
-        sys = _SYS_MULTI.format(k=k)
-        r = self.client.chat.completions.create(
+    def _multi_kwargs(self, rewritten: str, k: int) -> Dict[str, Any]:
+        return dict(
             model=self.model, temperature=0.2,
             response_format={"type":"json_object"},
-            messages=[{"role":"system","content":sys},{"role":"user","content":rewritten}]
+            messages=[{"role":"system","content":_SYS_MULTI.format(k=k)},{"role":"user","content":rewritten}]
         )
-        try:
-            data = json.loads(r.choices[0].message.content)
-        except Exception:
-            return []
-        qs = [q.strip() for q in data.get("queries", []) if isinstance(q, str) and q.strip()]
-        return qs
 
-    def hyde(self, rewritten: str) -> str:
-        r = self.client.chat.completions.create(
+    def _hyde_kwargs(self, rewritten: str) -> Dict[str, Any]:
+        return dict(
             model=self.model, temperature=0.2,
             messages=[{"role":"system","content":_SYS_HYDE},{"role":"user","content":rewritten}]
         )
+
+    def history_aware_rewrite(self, query: str, history_note: str = "") -> str:
+        r = token_meter.metered("query_transform", self.client.chat.completions.create, **self._rewrite_kwargs(query, history_note))
+        return (r.choices[0].message.content or "").strip()
+
+    def multi_expand(self, rewritten: str, k: int) -> List[str]:
+        r = token_meter.metered("query_transform", self.client.chat.completions.create, **self._multi_kwargs(rewritten, k))
+        return _parse_multi((r.choices[0].message.content or "").strip(), k)
+
+    def hyde(self, rewritten: str) -> str:
+        r = token_meter.metered("query_transform", self.client.chat.completions.create, **self._hyde_kwargs(rewritten))
         return (r.choices[0].message.content or "").strip()
 
+    @tracing.traced("query_transform")
     def transform(self, query: str, history_note: str = "") -> Dict[str, Any]:
         """
         Returns:
@@ -128,3 +120,43 @@ class QueryTransformer:
             except Exception as e:
                 log.warning(f"hyde failed: {e}")
         return {"primary": primary, "alternatives": alts, "mirror": mirror, "hyde": hyde_text}
+
+    # ---------- async ----------
+
+    async def ahistory_aware_rewrite(self, query: str, history_note: str = "") -> str:
+        r = await token_meter.ametered("query_transform", self.aclient.chat.completions.create, **self._rewrite_kwargs(query, history_note))
+        return (r.choices[0].message.content or "").strip()
+
+    async def amulti_expand(self, rewritten: str, k: int) -> List[str]:
+        r = await token_meter.ametered("query_transform", self.aclient.chat.completions.create, **self._multi_kwargs(rewritten, k))
+        return _parse_multi((r.choices[0].message.content or "").strip(), k)
+
+    async def ahyde(self, rewritten: str) -> str:
+        r = await token_meter.ametered("query_transform", self.aclient.chat.completions.create, **self._hyde_kwargs(rewritten))
+        return (r.choices[0].message.content or "").strip()
+
+    @tracing.traced("query_transform")
+    async def atransform(self, query: str, history_note: str = "") -> Dict[str, Any]:
+        """То же, что transform, но multi_expand и HyDE (оба зависят только от rewrite) идут параллельно."""
+        primary = await self.ahistory_aware_rewrite(query, history_note=history_note)
+
+        async def _alts() -> List[str]:
+            if not (settings.QT_MULTI and settings.QT_MULTI_K > 0):
+                return []
+            try:
+                return await self.amulti_expand(primary, settings.QT_MULTI_K)
+            except Exception as e:
+                log.warning(f"multi_expand failed: {e}")
+                return []
+
+        async def _hyde() -> Optional[str]:
+            if not settings.QT_HYDE:
+                return None
+            try:
+                return await self.ahyde(primary)
+            except Exception as e:
+                log.warning(f"hyde failed: {e}")
+                return None
+
+        alts, hyde_text = await asyncio.gather(_alts(), _hyde())
+        return {"primary": primary, "alternatives": alts, "mirror": _lang_mirror(primary), "hyde": hyde_text}
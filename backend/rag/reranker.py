@@ -1,62 +1,216 @@
 # backend/rag/reranker.py
 from __future__ import annotations
-from typing import List, Dict, Any
-from openai import OpenAI
-import httpx, json
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import asyncio, contextvars, hashlib, json, threading, time
 from backend.utils.settings import settings
+from backend.utils.clients import async_openai_client, openai_client
 from backend.utils.logger import get_logger
+from backend.metrics import token_meter, tracing
+
+try:
+    import tiktoken
+    _ENC = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENC = None
 
 log = get_logger("reranker")
 
+_CHARS_PER_TOKEN = 3  # оценка без tiktoken (для кириллицы токен короче, чем для английского)
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """Обрезает пассаж до budget токенов (tiktoken, если установлен; иначе по оценке символов)."""
+    text = (text or "").strip()
+    if budget <= 0:
+        return text
+    if _ENC is not None:
+        toks = _ENC.encode(text)
+        return text if len(toks) <= budget else _ENC.decode(toks[:budget]) + "…"
+    limit = budget * _CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[:limit] + "…"
+
+class ScoreCache:
+    """Оценки релевантности по (хэш запроса, id чанка): TTL + LRU. Пары (запрос, чанк) повторяются постоянно."""
+    def __init__(self, ttl_seconds: float = 3600, capacity: int = 20_000):
+        self.ttl = ttl_seconds
+        self.capacity = capacity
+        self._items: "OrderedDict[Tuple[str, str], Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, keys: Sequence[Tuple[str, str]]) -> List[Optional[float]]:
+        now = time.time()
+        out: List[Optional[float]] = []
+        with self._lock:
+            for k in keys:
+                item = self._items.get(k)
+                if item is None or now - item[0] > self.ttl:
+                    out.append(None)
+                    self.misses += 1
+                    continue
+                self._items.move_to_end(k)
+                out.append(item[1])
+                self.hits += 1
+        return out
+
+    def put_many(self, pairs: Sequence[Tuple[Tuple[str, str], float]]):
+        now = time.time()
+        with self._lock:
+            for k, score in pairs:
+                self._items[k] = (now, score)
+                self._items.move_to_end(k)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "items": len(self._items),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+@lru_cache(maxsize=None)
+def rerank_pool() -> ThreadPoolExecutor:
+    """Общий пул процесса для параллельных пачек sync-rerank (а не новый пул на каждый вызов)."""
+    return ThreadPoolExecutor(max_workers=max(1, settings.RERANK_CONCURRENCY), thread_name_prefix="rerank")
+
+@lru_cache(maxsize=None)
+def rerank_cache() -> ScoreCache | None:
+    """Общий кэш процесса (None, если выключен через RERANK_CACHE=0)."""
+    if not settings.RERANK_CACHE:
+        return None
+    return ScoreCache(settings.RERANK_CACHE_TTL, settings.RERANK_CACHE_SIZE)
+
 class Reranker:
+    """
+    LLM-reranker с бюджетом: каждый пассаж обрезается до RERANK_PASSAGE_TOKENS,
+    уже оценённые пары (запрос, чанк) берутся из кэша, остальные режутся на пачки
+    по RERANK_BATCH_SIZE и оцениваются параллельными вызовами — задержка и стоимость
+    не растут линейно с числом кандидатов.
+    """
     def __init__(self):
-        self.client = OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_BASE_URL,  
-            timeout=settings.REQUEST_TIMEOUT_SECONDS,
-            max_retries=2,
-            http_client=httpx.Client(timeout=settings.REQUEST_TIMEOUT_SECONDS),
-        )
+        self.client = openai_client()
+        self.aclient = async_openai_client()
         self.model = getattr(settings, "RERANK_MODEL", "gpt-4o-mini")
+        self.cache = rerank_cache()
+        self.batch_size = max(1, settings.RERANK_BATCH_SIZE)
+        self.passage_tokens = settings.RERANK_PASSAGE_TOKENS
+
+    def _request(self, query: str, docs: List[str]) -> Dict[str, Any]:
+        system_msg = (
+            "You are a reranker model. "
+            "Given a user query and several document passages, "
+            "assign each document a relevance score from 0.0 to 1.0. "
+            "Return a JSON object: {\"ranking\": [{\"index\":int,\"score\":float}]} with one entry per document. "
+            "Score should reflect how relevant each passage is to the query."
+        )
+        joined_docs = "\n\n".join([f"[{i}] {truncate_tokens(t, self.passage_tokens)}" for i, t in enumerate(docs)])
+        user_msg = f"Query: {query}\n\nDocuments:\n{joined_docs}"
+        return dict(
+            model=self.model,
+            temperature=0.0,
+            messages=[
+                {"role": "system", "content": system_msg},
+                {"role": "user", "content": user_msg},
+            ],
+            response_format={"type": "json_object"},
+        )
+
+    @staticmethod
+    def _parse(raw: str, top_k: int) -> List[Dict[str, Any]]:
+        data = json.loads(raw)
+        if isinstance(data, dict) and "ranking" in data:
+            data = data["ranking"]
+        if not isinstance(data, list):
+            raise ValueError("no list in response")
+        results = []
+        for r in data:
+            if isinstance(r, dict) and "index" in r and "score" in r:
+                results.append({"index": int(r["index"]), "score": float(r["score"])})
+
+        results.sort(key=lambda x: -x["score"])
+        return results[:top_k]
+
+    def _keys(self, query: str, docs: List[str], ids: Optional[Sequence[Any]]) -> List[Tuple[str, str]]:
+        qh = hashlib.sha256(f"{self.model}\x00{' '.join(query.lower().split())}".encode("utf-8")).hexdigest()[:24]
+        # без id чанка ключом служит хэш текста — для одного и того же чанка он тоже стабилен
+        return [(qh, str(i) if i is not None else hashlib.sha256(d.encode("utf-8")).hexdigest()[:24])
+                for i, d in zip(ids or [None] * len(docs), docs)]
+
+    def _plan(self, query: str, docs: List[str], ids: Optional[Sequence[Any]]):
+        """(ключи, оценки из кэша, пачки индексов непосчитанных документов)."""
+        keys = self._keys(query, docs, ids)
+        scores = self.cache.get_many(keys) if self.cache is not None else [None] * len(docs)
+        todo = [i for i, sc in enumerate(scores) if sc is None]
+        batches = [todo[s:s + self.batch_size] for s in range(0, len(todo), self.batch_size)]
+        return keys, scores, batches
+
+    def _batch_scores(self, raw: str, batch: List[int]) -> Dict[int, float]:
+        # индексы в ответе — внутри пачки; переводим в индексы исходного списка
+        return {batch[r["index"]]: r["score"] for r in self._parse(raw, len(batch)) if 0 <= r["index"] < len(batch)}
 
-    def rerank(self, query: str, docs: List[str], top_k: int = 5) -> List[Dict[str, Any]]:
-    
+    def _score_batch(self, query: str, docs: List[str], batch: List[int]) -> Dict[int, float]:
+        resp = token_meter.metered("rerank", self.client.chat.completions.create, **self._request(query, [docs[i] for i in batch]))
+        return self._batch_scores(resp.choices[0].message.content or "", batch)
+
+    async def _ascore_batch(self, query: str, docs: List[str], batch: List[int]) -> Dict[int, float]:
+        resp = await token_meter.ametered("rerank", self.aclient.chat.completions.create, **self._request(query, [docs[i] for i in batch]))
+        return self._batch_scores(resp.choices[0].message.content or "", batch)
+
+    def _finish(self, keys, scores: List[Optional[float]], results: List[Any], top_k: int) -> List[Dict[str, Any]]:
+        fresh: Dict[int, float] = {}
+        for res in results:
+            if isinstance(res, Exception):
+                log.warning(f"Rerank batch failed: {res}")
+            else:
+                fresh.update(res)
+        if self.cache is not None and fresh:
+            self.cache.put_many([(keys[i], sc) for i, sc in fresh.items()])
+        for i, sc in fresh.items():
+            scores[i] = sc
+        if all(sc is None for sc in scores):
+            return []
+        # документы из упавших пачек остаются в конце в исходном порядке
+        ranked = sorted((i for i, sc in enumerate(scores) if sc is not None), key=lambda i: -scores[i])
+        ranked += [i for i, sc in enumerate(scores) if sc is None]
+        return [{"index": i, "score": float(scores[i] or 0.0)} for i in ranked[:top_k]]
+
+    @tracing.traced("rerank")
+    def rerank(self, query: str, docs: List[str], top_k: int = 5, ids: Optional[Sequence[Any]] = None) -> List[Dict[str, Any]]:
         if not docs:
             return []
-        try:
-            system_msg = (
-                "You are a reranker model. "
-                "Given a user query and several document passages, "
-                "assign each document a relevance score from 0.0 to 1.0. "
-                "Return a JSON array of objects: [{\"index\":int,\"score\":float}]. "
-                "Score should reflect how relevant each passage is to the query."
-            )
-            joined_docs = "\n\n".join([f"[{i}] {t.strip()}" for i, t in enumerate(docs)])
-            user_msg = f"Query: {query}\n\nDocuments:\n{joined_docs}"
-
-            resp = self.client.chat.completions.create(
-                model=self.model,
-                temperature=0.0,
-                messages=[
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": user_msg},
-                ],
-                response_format={"type": "json_object"},
-            )
-
-            raw = resp.choices[0].message.content or ""
-            data = json.loads(raw)
-            if isinstance(data, dict) and "ranking" in data:
-                data = data["ranking"]
-            if not isinstance(data, list):
-                raise ValueError("no list in response")
-            results = []
-            for r in data:
-                if isinstance(r, dict) and "index" in r and "score" in r:
-                    results.append({"index": int(r["index"]), "score": float(r["score"])})
-
-            results.sort(key=lambda x: -x["score"])
-            return results[:top_k]
-        except Exception as e:
-            log.warning(f"Rerank failed: {e}")
+        keys, scores, batches = self._plan(query, docs, ids)
+        results: List[Any] = []
+        if len(batches) == 1:
+            try:
+                results.append(self._score_batch(query, docs, batches[0]))
+            except Exception as e:
+                results.append(e)
+        elif batches:
+            pool = rerank_pool()
+            # copy_context: вызовы из пула учитываются в метре текущего запроса
+            futures = [pool.submit(contextvars.copy_context().run, self._score_batch, query, docs, b) for b in batches]
+            for f in futures:
+                try:
+                    results.append(f.result())
+                except Exception as e:
+                    results.append(e)
+        return self._finish(keys, scores, results, top_k)
+
+    @tracing.traced("rerank")
+    async def arerank(self, query: str, docs: List[str], top_k: int = 5, ids: Optional[Sequence[Any]] = None) -> List[Dict[str, Any]]:
+        if not docs:
             return []
+        keys, scores, batches = self._plan(query, docs, ids)
+        results = await asyncio.gather(*(self._ascore_batch(query, docs, b) for b in batches), return_exceptions=True)
+        return self._finish(keys, scores, list(results), top_k)
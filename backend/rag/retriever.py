@@ -1,12 +1,17 @@
 from __future__ import annotations
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio, time
+import numpy as np
 
+from backend.rag import bm25
 from backend.rag.embedder import Embedder
+from backend.rag.mmr import LocalReranker
 from backend.rag.store import LocalVectorStore
 from backend.rag.reranker import Reranker
 from backend.rag.query_transform import QueryTransformer
 from backend.utils.settings import settings
 from backend.utils.logger import get_logger
+from backend.metrics import tracing
 
 try:
     from backend.rag.vector_api import VectorStoreAPI
@@ -17,23 +22,38 @@ from backend.nlp.intent_llm import summarize_history
 
 log = get_logger("retriever")
 
+MODES = ("dense", "hybrid", "lexical")
+
 class Retriever:
-    def __init__(self, top_k: int = 4, min_score: float = 0.2):
+    def __init__(self, top_k: int = 4, min_score: float = 0.2, store: Optional[LocalVectorStore] = None):
         self.top_k = top_k
         self.min_score = min_score
 
         self.use_vector_api = getattr(settings, "USE_VECTOR_API", False)
-        if self.use_vector_api and 'VectorStoreAPI' in globals() and VectorStoreAPI is not None:
+        if store is None and self.use_vector_api and 'VectorStoreAPI' in globals() and VectorStoreAPI is not None:
             self.vs = VectorStoreAPI()
             self.embedder = None
             self.store = None
         else:
             self.vs = None
-            self.store = LocalVectorStore()
+            # свой стор — для бенчмарков по разным dtype/индексам поверх одних данных
+            self.store = store if store is not None else LocalVectorStore()
             self.embedder = Embedder()
 
+        self.mode = settings.RETRIEVAL_MODE if settings.RETRIEVAL_MODE in MODES else "dense"
+        # BM25 нужен и в dense-режиме (на него переключаемся, когда embeddings API медленный или лежит),
+        # но грузится лениво, при первом обращении, и только сохранённый ingest'ом индекс
+        self.bm25: Optional[bm25.BM25Index] = None
+        self._bm25_missing: Optional[Tuple[int, Optional[float]]] = None
+        self._dense_down_until = 0.0
+        self._dense_failures = 0
+        self.degraded = 0
+
         self.use_rerank = getattr(settings, "USE_RERANK", False)
-        self.reranker = Reranker() if self.use_rerank else None
+        # RERANK_MODE=mmr — локальный MMR по векторам стора вместо лишнего вызова LLM
+        self.rerank_mode = settings.RERANK_MODE if settings.RERANK_MODE in ("llm", "mmr") else "llm"
+        self.reranker = Reranker() if self.use_rerank and self.rerank_mode == "llm" else None
+        self.local_reranker = LocalReranker(self.store) if self.use_rerank and self.rerank_mode == "mmr" else None
 
         self.qt_enable = getattr(settings, "QT_ENABLE", False)
         self.qt = QueryTransformer() if self.qt_enable else None
@@ -51,84 +71,252 @@ class Retriever:
         return merged
 
     def _prefilter(self, items: List[Dict[str, Any]], min_score: float) -> List[Dict[str, Any]]:
-        return [d for d in items if float(d.get("score", 0.0)) >= min_score]
+        # порог — по косинусу; BM25-хиты без векторов запроса (lexical / деградация) сравнивать не с чем
+        out = []
+        for d in items:
+            cos = d.get("dense_score", d.get("score"))
+            if cos is None or float(cos) >= min_score:
+                out.append(d)
+        return out
 
-    def retrieve(self, query: str, history: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
-       
-        queries: List[str] = [query]
-        hyde_vec = None
+    def _variants(self, query: str, qt: Optional[Dict[str, Any]]) -> Tuple[List[str], Optional[str]]:
+        """Варианты запроса после QueryTransformer + текст HyDE (если включён)."""
+        if not qt:
+            return [query], None
+        queries = [qt["primary"]] + qt.get("alternatives", [])
+        if qt.get("mirror"):
+            queries.append(qt["mirror"])
+        hyde_text = qt["hyde"] if settings.QT_HYDE and qt.get("hyde") else None
+        return queries, hyde_text
+
+    def _vs_candidates(self, queries: List[str], topk_candidates: int) -> List[Dict[str, Any]]:
+        all_candidates: List[Dict[str, Any]] = []
+        for q in queries:
+            try:
+                all_candidates += self.vs.search(q, top_k=topk_candidates)
+            except Exception as e:
+                log.warning(f"VectorStore search failed for '{q}': {e}")
+        return self._dedup(all_candidates)[:topk_candidates]
+
+    # ---------- локальный поиск: dense / BM25 / гибрид ----------
+
+    def _dense_available(self) -> bool:
+        return self.mode != "lexical" and time.monotonic() >= self._dense_down_until
+
+    def _dense_ok(self):
+        self._dense_failures = 0
+
+    def _dense_failed(self, reason: str):
+        # единичный сбой — только этот запрос идёт в BM25; после EMBED_FAILURES_TO_TRIP подряд — пауза для dense,
+        # пока она идёт, запросы не ждут таймаута и сразу уходят в BM25
+        self._dense_failures += 1
+        if self._dense_failures < settings.EMBED_FAILURES_TO_TRIP:
+            log.warning(f"dense retrieval failed ({reason}); {self._dense_failures}/{settings.EMBED_FAILURES_TO_TRIP}")
+            return
+        self._dense_failures = 0
+        self._dense_down_until = time.monotonic() + settings.EMBED_COOLDOWN_SECONDS
+        log.warning(f"dense retrieval unavailable ({reason}); lexical-only for {settings.EMBED_COOLDOWN_SECONDS}s")
+
+    def _load_bm25(self) -> Optional[bm25.BM25Index]:
+        key = bm25.index_key(self.store)
+        if key == self._bm25_missing:
+            return None   # уже проверяли: ни версия БЗ, ни файл индекса с тех пор не менялись
+        index = bm25.load_for_store(self.store)
+        if index is None:
+            self._bm25_missing = key
+            if len(self.store):
+                log.warning(f"bm25 index missing or stale for kb_version={self.store.kb_version}; lexical search off "
+                            f"until ingest or `python -m backend.rag.bm25` rebuilds it")
+        return index
+
+    def _lexical(self, texts: List[str], k: int) -> List[Dict[str, Any]]:
+        if self.bm25 is None or self.bm25.kb_version != self.store.kb_version:
+            # первое обращение или стор дописали — берём индекс с диска, не строим его на пути запроса
+            self.bm25 = self._load_bm25()
+        if self.bm25 is None:
+            return []
+        with tracing.span("bm25"):
+            rows, scores = self.bm25.search_multi(texts, top_k=k)
+        hits = self.store.hits(rows, scores)
+        for h in hits:
+            h["bm25_score"] = h["score"]
+            h["dense_score"] = None
+        return self._dedup(hits)[:k]
+
+    def _cosine(self, rows: List[int], vecs: List[List[float]]) -> np.ndarray:
+        """Косинус строк стора с ближайшим вариантом запроса — как score у dense-хитов."""
+        Q = np.atleast_2d(np.asarray(vecs, dtype=np.float32))
+        Q = Q / (np.linalg.norm(Q, axis=1, keepdims=True) + 1e-12)
+        return (self.store.vectors(np.asarray(rows, dtype=np.int64)) @ Q.T).max(axis=1)
+
+    def _fuse(self, dense: List[Dict[str, Any]], lexical: List[Dict[str, Any]], k: int,
+              vecs: List[List[float]]) -> List[Dict[str, Any]]:
+        """Reciprocal rank fusion: порядок — по rrf, score остаётся косинусом (его же сравниваем с min_score)."""
+        rrf_k = settings.RRF_K
+        fused: Dict[Any, Dict[str, Any]] = {}
+        for ranked in (dense, lexical):
+            for rank, h in enumerate(ranked):
+                meta = h.get("meta", {})
+                item = fused.setdefault((meta.get("source"), meta.get("chunk")), dict(h, rrf=0.0, bm25_score=0.0))
+                item["rrf"] += 1.0 / (rrf_k + rank + 1)
+                if ranked is dense:
+                    item["dense_score"] = float(h.get("score", 0.0))
+                else:
+                    item["bm25_score"] = h["bm25_score"]
+        out = sorted(fused.values(), key=lambda x: -x["rrf"])[:k]
+        # найденные только BM25 — досчитываем косинус по векторам стора
+        lex_only = [item for item in out if item.get("dense_score") is None and item.get("row") is not None]
+        if lex_only:
+            for item, cos in zip(lex_only, self._cosine([item["row"] for item in lex_only], vecs)):
+                item["dense_score"] = float(cos)
+        for item in out:
+            if item.get("dense_score") is not None:
+                item["score"] = item["dense_score"]
+        return out
+
+    def _combine(self, texts: List[str], dense: Optional[List[Dict[str, Any]]], k: int,
+                 vecs: Optional[List[List[float]]] = None) -> List[Dict[str, Any]]:
+        if dense is None:
+            if self.mode != "lexical":
+                self.degraded += 1
+            return self._lexical(texts, k)
+        if self.mode == "dense":
+            return dense
+        return self._fuse(dense, self._lexical(texts, k), k, vecs)
+
+    def _dense_search(self, vecs: List[List[float]], k: int) -> List[Dict[str, Any]]:
+        with tracing.span("vector_search", queries=len(vecs)):
+            return self._dedup(self.store.search_multi(vecs, top_k=k))[:k]
+
+    def _local_candidates(self, texts: List[str], k: int) -> Tuple[List[Dict[str, Any]], Optional[List[List[float]]]]:
+        """Кандидаты + векторы вариантов запроса (None, если dense не участвовал) — их переиспользует MMR."""
+        dense, vecs = None, None
+        if self._dense_available():
+            t0 = time.perf_counter()
+            try:
+                # все варианты запроса (+ HyDE) — одним батчем в embeddings API и одним проходом по матрице
+                vecs = self.embedder.encode(texts)
+                dense = self._dense_search(vecs, k)
+            except Exception as e:
+                self._dense_failed(str(e))
+                vecs = None
+            else:
+                if time.perf_counter() - t0 > settings.EMBED_TIMEOUT_MS / 1000:
+                    self._dense_failed("slow embeddings")
+                else:
+                    self._dense_ok()
+        return self._combine(texts, dense, k, vecs), vecs
+
+    async def _alocal_candidates(self, texts: List[str], k: int) -> Tuple[List[Dict[str, Any]], Optional[List[List[float]]]]:
+        dense, vecs = None, None
+        if self._dense_available():
+            try:
+                vecs = await asyncio.wait_for(self.embedder.aencode(texts), settings.EMBED_TIMEOUT_MS / 1000)
+                # полный проход по матрице (сотни тысяч строк, rescoring int8) — CPU не в цикле событий
+                dense = await asyncio.to_thread(self._dense_search, vecs, k)
+            except asyncio.TimeoutError:
+                self._dense_failed(f"embeddings slower than {settings.EMBED_TIMEOUT_MS}ms")
+            except Exception as e:
+                self._dense_failed(str(e))
+                vecs = None
+            else:
+                self._dense_ok()
+        # BM25 и слияние рангов — тоже CPU по всему индексу
+        return await asyncio.to_thread(self._combine, texts, dense, k, vecs), vecs
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": "vector_api" if self.vs is not None else self.mode,
+            "rerank": self.rerank_mode if self.use_rerank else None,
+            "bm25_docs": self.bm25.n_docs if self.bm25 is not None else 0,
+            "bm25_terms": len(self.bm25.vocab) if self.bm25 is not None else 0,
+            "dense_down": time.monotonic() < self._dense_down_until,
+            "degraded": self.degraded,
+        }
+
+    def _rank_locally(self, query: str, candidates: List[Dict[str, Any]], qvecs) -> List[Dict[str, Any]]:
+        if not self.local_reranker:
+            return []
+        with tracing.span("mmr", candidates=len(candidates)):
+            return self.local_reranker.rank(query, candidates, qvecs, top_k=self.top_k)
+
+    def _shortlist(self, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        pre_min = max(self.min_score * 0.75, 0.05)
+        return self._prefilter(candidates, pre_min) or candidates
 
+    def _apply_ranking(self, candidates: List[Dict[str, Any]], ranking: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if ranking:
+            ordered: List[Dict[str, Any]] = []
+            for r in ranking:
+                idx = r.get("index")
+                if idx is None or not isinstance(idx, int) or idx < 0 or idx >= len(candidates):
+                    continue
+                item = dict(candidates[idx])
+                item["rerank_score"] = float(r.get("score", 0.0))
+                ordered.append(item)
+            return ordered[: self.top_k]
+        return candidates[: self.top_k]
+
+    @tracing.traced("retrieve")
+    def retrieve(self, query: str, history: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        qt = None
         if self.qt:
-            hist_note = summarize_history(history or [], max_chars=400)
+            with tracing.span("history_summary"):
+                hist_note = summarize_history(history or [], max_chars=400)
             qt = self.qt.transform(query, history_note=hist_note)
-            queries = [qt["primary"]] + qt.get("alternatives", [])
-            if qt.get("mirror"):
-                queries.append(qt["mirror"])
-
-            if settings.QT_HYDE and qt.get("hyde") and self.embedder is not None:
-                try:
-                    hyde_vec = self.embedder.encode([qt["hyde"]])[0]
-                except Exception as e:
-                    log.warning(f"hyde embedding failed: {e}")
+        queries, hyde_text = self._variants(query, qt)
 
         topk_candidates = max(self.top_k, 8)
 
+        qvecs = None
         if self.vs is not None:
-            all_candidates: List[Dict[str, Any]] = []
-            for q in queries:
-                try:
-                    all_candidates += self.vs.search(q, top_k=topk_candidates)
-                except Exception as e:
-                    log.warning(f"VectorStore search failed for '{q}': {e}")
-            if not all_candidates:
+            initial = self._vs_candidates(queries, topk_candidates)
+        else:
+            if self.embedder is None or self.store is None:
+                log.warning("Local mode selected but embedder/store not initialized.")
                 return []
+            initial, qvecs = self._local_candidates(queries + ([hyde_text] if hyde_text else []), topk_candidates)
+
+        if not initial:
+            return []
+        candidates = self._shortlist(initial)
+
+        ranking = self._rank_locally(query, candidates, qvecs)
+        if self.reranker:
+            ranking = self.reranker.rerank(query, [c["text"] for c in candidates], top_k=self.top_k,
+                                           ids=[c.get("id") for c in candidates])
+        return self._apply_ranking(candidates, ranking)
 
-            merged = self._dedup(all_candidates)
-            initial = merged[:topk_candidates]
+    @tracing.traced("retrieve")
+    async def aretrieve(self, query: str, history: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """Асинхронный вариант retrieve: сетевые вызовы не занимают поток threadpool."""
+        qt = None
+        if self.qt:
+            with tracing.span("history_summary"):
+                hist_note = summarize_history(history or [], max_chars=400)
+            qt = await self.qt.atransform(query, history_note=hist_note)
+        queries, hyde_text = self._variants(query, qt)
+
+        topk_candidates = max(self.top_k, 8)
 
+        qvecs = None
+        if self.vs is not None:
+            initial = await asyncio.to_thread(self._vs_candidates, queries, topk_candidates)
         else:
             if self.embedder is None or self.store is None:
                 log.warning("Local mode selected but embedder/store not initialized.")
                 return []
+            initial, qvecs = await self._alocal_candidates(queries + ([hyde_text] if hyde_text else []), topk_candidates)
 
-            all_candidates: List[Dict[str, Any]] = []
-            for q in queries:
-                try:
-                    qv = self.embedder.encode([q])[0]
-                    all_candidates += self.store.search(qv, top_k=topk_candidates)
-                except Exception as e:
-                    log.warning(f"Local search failed for '{q}': {e}")
-
-            if hyde_vec is not None:
-                try:
-                    all_candidates += self.store.search(hyde_vec, top_k=topk_candidates)
-                except Exception as e:
-                    log.warning(f"Local search (HyDE) failed: {e}")
-
-            if not all_candidates:
-                return []
-
-            merged = self._dedup(all_candidates)
-            initial = merged[:topk_candidates]
-
-        pre_min = max(self.min_score * 0.75, 0.05)
-        candidates = self._prefilter(initial, pre_min) or initial
+        if not initial:
+            return []
+        candidates = self._shortlist(initial)
 
+        ranking = await asyncio.to_thread(self._rank_locally, query, candidates, qvecs) if self.local_reranker else []
         if self.reranker:
-            docs = [c["text"] for c in candidates]
-            ranking = self.reranker.rerank(query, docs, top_k=self.top_k)
-            if ranking:
-                ordered: List[Dict[str, Any]] = []
-                for r in ranking:
-                    idx = r.get("index")
-                    if idx is None or not isinstance(idx, int) or idx < 0 or idx >= len(candidates):
-                        continue
-                    item = dict(candidates[idx])
-                    item["rerank_score"] = float(r.get("score", 0.0))
-                    ordered.append(item)
-                return ordered[: self.top_k]
-
-        return candidates[: self.top_k]
+            ranking = await self.reranker.arerank(query, [c["text"] for c in candidates], top_k=self.top_k,
+                                                  ids=[c.get("id") for c in candidates])
+        return self._apply_ranking(candidates, ranking)
 
     @staticmethod
     def format_context(chunks: List[Dict[str, Any]], max_chars: int = 3000) -> str:
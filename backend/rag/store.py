@@ -1,70 +1,487 @@
 from __future__ import annotations
-from typing import List, Dict, Any
-import os, json, uuid
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Sequence, Tuple
+import os, json, uuid, argparse, shutil, threading, time
 import numpy as np
 
+from backend.rag import packed
+from backend.rag.ann import IVFIndex
+from backend.utils.settings import settings
+from backend.utils.logger import get_logger
+
+log = get_logger("vector-store")
+
+DTYPES = ("float32", "float16", "int8")
+INDEXES = ("flat", "ivf")
+MANIFEST = "manifest.json"
+IVF_FILE = "ivf.npz"
+MIGRATE_LOCK = ".migrate.lock"
+_BLOCK_ROWS = 16384  # квантованную матрицу скорим блоками: BLAS по float32 без копии всей матрицы
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    m = np.asarray(m, dtype=np.float32)
+    return m / (np.linalg.norm(m, axis=-1, keepdims=True) + 1e-12)
+
+def _quantize(vn: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray | None]:
+    """Нормированные векторы -> (матрица для поиска, построчный масштаб для int8)."""
+    if dtype == "float16":
+        return vn.astype(np.float16), None
+    if dtype == "int8":
+        scale = np.abs(vn).max(axis=1) / 127.0 + 1e-12
+        q = np.round(vn / scale[:, None]).astype(np.int8)
+        return q, scale.astype(np.float32)
+    return np.ascontiguousarray(vn, dtype=np.float32), None
+
+def _topk(scores: np.ndarray, k: int) -> np.ndarray:
+    """Индексы k лучших по убыванию: argpartition + сортировка только k элементов."""
+    n = scores.shape[0]
+    if k >= n:
+        return np.argsort(-scores)
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part])]
+
+class _Segment:
+    """
+    Неизменяемый кусок стора: записи + нормированные float32 + матрица поиска в dtype стора.
+    name — путь относительно каталога стора (None — legacy-данные, ещё не записанные в сегмент).
+    """
+    def __init__(self, name: Optional[str], records: Sequence[Dict[str, Any]], raw: np.ndarray,
+                 emb: np.ndarray, scale: np.ndarray | None):
+        self.name = name
+        self.records = records
+        self.raw = raw
+        self.emb = emb
+        self.scale = scale
+
+    @classmethod
+    def open(cls, root: str, name: str, dtype: str) -> "_Segment":
+        # всё открывается через mmap: N воркеров делят одну копию в page cache, старт за O(1)
+        path = os.path.join(root, name)
+        records = packed.PackedRecords(path)
+        raw = packed.load_array(path, "vectors")
+        emb, scale = (raw, None) if dtype == "float32" else (packed.load_array(path, f"vectors.{dtype}"), None)
+        if dtype == "int8":
+            scale = packed.load_array(path, "scales.int8")
+        if emb is None or (dtype == "int8" and scale is None):
+            # квантованной копии под этот dtype на диске нет — строим в памяти процесса
+            emb, scale = _quantize(np.asarray(raw), dtype)
+        return cls(name, records, raw, emb, scale)
+
+    @classmethod
+    def from_vectors(cls, name: Optional[str], records: List[Dict[str, Any]], vecs: np.ndarray, dtype: str) -> "_Segment":
+        raw = _normalize(vecs)
+        emb, scale = _quantize(raw, dtype)
+        return cls(name, records, raw, emb, scale)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def write(self, root: str, name: str, dtype: str) -> "_Segment":
+        arrays: Dict[str, np.ndarray] = {"vectors": np.asarray(self.raw, dtype=np.float32)}
+        if dtype != "float32":
+            arrays[f"vectors.{dtype}"] = np.asarray(self.emb)
+        if self.scale is not None:
+            arrays["scales.int8"] = np.asarray(self.scale)
+        packed.write_packed(os.path.join(root, name), self.records, arrays)
+        return _Segment.open(root, name, dtype)
+
+    def scores(self, Qt: np.ndarray) -> np.ndarray:
+        """Косинусы всех строк сегмента против пачки запросов: Qt — (D, q), результат — (N, q)."""
+        E = self.emb
+        if E.dtype == np.float32:
+            return E @ Qt
+        out = np.empty((E.shape[0], Qt.shape[1]), dtype=np.float32)
+        for s in range(0, E.shape[0], _BLOCK_ROWS):
+            out[s:s + _BLOCK_ROWS] = E[s:s + _BLOCK_ROWS].astype(np.float32) @ Qt
+        if self.scale is not None:
+            out *= self.scale[:, None]
+        return out
+
 class LocalVectorStore:
-    def __init__(self, dir_path: str = "data/embeddings"):
+    """
+    Append-only стор из сегментов (см. packed.py) + manifest.json со списком сегментов.
+    add_texts пишет только новый сегмент и атомарно подменяет manifest (os.replace),
+    поэтому стоимость вставки пропорциональна новым данным, а сбой посреди записи не портит стор.
+    Мелкие сегменты сливаются в фоне (compact), порядок строк при этом сохраняется.
+    Запись рассчитана на одного писателя (ingest); читателей-воркеров может быть сколько угодно.
+    Замена документа (add_texts(..., replace_sources=...)) не трогает старые сегменты: их строки помечаются
+    удалёнными в manifest (deleted) тем же атомарным os.replace и больше не попадают в выдачу.
+    """
+    def __init__(self, dir_path: str = "data/embeddings", dtype: str | None = None, rescore_factor: int | None = None,
+                 max_segments: int | None = None, auto_compact: bool | None = None,
+                 index: str | None = None, nprobe: int | None = None):
         self.dir = dir_path
         os.makedirs(self.dir, exist_ok=True)
         self.meta_path = os.path.join(self.dir, "store.jsonl")
         self.npy_path = os.path.join(self.dir, "embeddings.npy")
-        self._meta: List[Dict[str, Any]] = []
-        self._emb: np.ndarray | None = None
+        self.packed_dir = os.path.join(self.dir, "packed")
+        self.manifest_path = os.path.join(self.dir, MANIFEST)
+        self.index_path = os.path.join(self.dir, IVF_FILE)
+        self.dtype = (dtype or settings.VS_DTYPE).lower()
+        if self.dtype not in DTYPES:
+            raise ValueError(f"unsupported VS_DTYPE: {self.dtype} (expected one of {DTYPES})")
+        self.rescore_factor = max(1, rescore_factor or settings.VS_RESCORE_FACTOR)
+        self.max_segments = max(1, max_segments or settings.VS_MAX_SEGMENTS)
+        self.auto_compact = settings.VS_AUTO_COMPACT if auto_compact is None else auto_compact
+        self.index_kind = (index or settings.VS_INDEX).lower()
+        if self.index_kind not in INDEXES:
+            raise ValueError(f"unsupported VS_INDEX: {self.index_kind} (expected one of {INDEXES})")
+        self.nprobe = nprobe or settings.VS_IVF_NPROBE
+        self._ann: IVFIndex | None = None
+        self._ann_unsaved = 0
+        self.version = 0       # растёт на любой записи manifest (в т.ч. компакции)
+        self.kb_version = 0    # растёт только при изменении содержимого (add_texts) — ключ кэша ответов
+        # (сегменты, начало каждого сегмента в сквозной нумерации строк + итог) — подменяется целиком,
+        # так что читатели без блокировок всегда видят согласованную пару
+        self._view: Tuple[List[_Segment], np.ndarray] = ([], np.zeros(1, dtype=np.int64))
+        # сквозные номера удалённых строк (отсортированы); номера стабильны, поэтому сегменты не переписываем
+        self.deleted = np.zeros(0, dtype=np.int64)
+        self._lock = threading.Lock()                # мутации списка сегментов/manifest
+        self._compact_lock = threading.Lock()        # не больше одного компактора
+        self._compactor: threading.Thread | None = None
         self._load()
+        self._ensure_index()
+
+    # ---------- загрузка / manifest ----------
 
     def _load(self):
-        if os.path.exists(self.meta_path):
-            with open(self.meta_path, "r", encoding="utf-8") as f:
-                self._meta = [json.loads(line) for line in f if line.strip()]
-        else:
-            self._meta = []
+        for attempt in range(3):
+            try:
+                self._load_once()
+                return
+            except FileNotFoundError:
+                # компактор успел удалить сегмент между чтением manifest и открытием — перечитываем
+                if attempt == 2:
+                    raise
+                time.sleep(0.05)
+
+    def _load_once(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                man = json.load(f)
+            self.version = int(man.get("version", 0))
+            self.kb_version = int(man.get("kb_version", self.version))
+            self.deleted = np.asarray(man.get("deleted", []), dtype=np.int64)
+            self._set_segments([_Segment.open(self.dir, s["name"], self.dtype) for s in man.get("segments", [])])
+            return
 
-        if os.path.exists(self.npy_path):
-            self._emb = np.load(self.npy_path)
+        self.version = 0
+        self.kb_version = 0
+        if packed.exists(self.packed_dir):
+            # упакованный каталог без manifest — один сегмент
+            self._set_segments([_Segment.open(self.dir, "packed", self.dtype)])
+            return
+
+        # legacy-формат: store.jsonl + embeddings.npy — переводим в сегмент при открытии
+        if os.path.exists(self.meta_path) and os.path.exists(self.npy_path):
+            self._migrate_legacy()
         else:
-            self._emb = None
+            self._set_segments([])
 
-    def _save(self):
-        with open(self.meta_path, "w", encoding="utf-8") as f:
-            for rec in self._meta:
-                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
-        if self._emb is not None:
-            np.save(self.npy_path, self._emb)
+    def _legacy_segment(self) -> _Segment:
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            meta = [json.loads(line) for line in f if line.strip()]
+        return _Segment.from_vectors(None, meta, np.load(self.npy_path), self.dtype)
 
-    def add_texts(self, texts: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]] | None = None) -> List[str]:
-        metadatas = metadatas or [{} for _ in texts]
-        ids = []
-        vecs = np.array(embeddings, dtype=np.float32)
+    def _migrate_legacy(self):
+        """
+        Иначе каждый воркер держал бы в памяти float32-матрицу целиком и ещё квантованную копию (int8/float16
+        не экономили бы, а добавляли память). После записи сегмента raw открывается через mmap.
+        Мигрирует один процесс (lock-файл), остальные ждут его manifest; без прав на запись — как раньше, в памяти.
+        """
+        lock = os.path.join(self.dir, MIGRATE_LOCK)
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            deadline = time.monotonic() + 60
+            while os.path.exists(lock) and not os.path.exists(self.manifest_path) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            if os.path.exists(self.manifest_path):
+                self._load_once()
+                return
+            log.warning(f"legacy store migration lock {lock} is stale; loading legacy data into memory")
+            self._set_segments([self._legacy_segment()])
+            return
+        except OSError as e:
+            log.warning(f"legacy store is read-only ({e}); loading it into memory")
+            self._set_segments([self._legacy_segment()])
+            return
+        try:
+            t0 = time.perf_counter()
+            seg = self._legacy_segment()
+            with self._lock:
+                seg = seg.write(self.dir, self._new_segment_name(), self.dtype)
+                self._write_manifest([seg])   # содержимое то же — kb_version не меняется
+            log.info(f"legacy store migrated to segments: {len(seg)} rows in {time.perf_counter() - t0:.2f}s")
+        finally:
+            os.close(fd)
+            os.remove(lock)
 
-        if self._emb is None:
-            self._emb = vecs
-        else:
-            self._emb = np.vstack([self._emb, vecs])
+    @property
+    def _segments(self) -> List[_Segment]:
+        return self._view[0]
+
+    def _set_segments(self, segments: List[_Segment]):
+        self._view = (segments, np.cumsum([0] + [len(s) for s in segments]).astype(np.int64))
+
+    def _write_manifest(self, segments: List[_Segment], content_changed: bool = False,
+                        deleted: np.ndarray | None = None):
+        deleted = self.deleted if deleted is None else deleted
+        man = {
+            "version": self.version + 1,
+            "kb_version": self.kb_version + (1 if content_changed else 0),
+            "dim": int(segments[0].raw.shape[1]) if segments else 0,
+            "segments": [{"name": s.name, "rows": len(s)} for s in segments],
+            "deleted": deleted.tolist(),
+        }
+        tmp = f"{self.manifest_path}.tmp-{uuid.uuid4().hex[:8]}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(man, f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_path)
+        self.version = man["version"]
+        self.kb_version = man["kb_version"]
+        self.deleted = deleted
+        self._set_segments(segments)
+
+    def _new_segment_name(self) -> str:
+        return f"segments/seg-{self.version + 1:06d}-{uuid.uuid4().hex[:6]}"
+
+    def _persisted(self, segments: List[_Segment]) -> List[_Segment]:
+        # legacy-сегмент в памяти записываем один раз — дальше он живёт как обычный сегмент
+        return [s if s.name is not None else s.write(self.dir, self._new_segment_name(), self.dtype) for s in segments]
+
+    # ---------- ANN-индекс ----------
 
+    def _ensure_index(self):
+        if self.index_kind != "ivf" or len(self) < settings.VS_IVF_MIN_ROWS:
+            self._ann = None
+            return
+        if os.path.exists(self.index_path):
+            ann = IVFIndex.load(self.index_path)
+            if ann.rows <= len(self):
+                # индекс мог отстать от стора (вставки без сохранения индекса) — докладываем хвост
+                ann.add(self.vectors(np.arange(ann.rows, len(self))), start_row=ann.rows)
+                self._ann = ann
+                return
+        self.rebuild_index()
+
+    def rebuild_index(self, nlist: int | None = None):
+        t0 = time.perf_counter()
+        X = np.concatenate([np.asarray(s.raw) for s in self._segments])
+        self._ann = IVFIndex.build(X, nlist=nlist or settings.VS_IVF_NLIST)
+        self._ann.save(self.index_path)
+        self._ann_unsaved = 0
+        log.info(f"ivf index built: {len(X)} rows, nlist={self._ann.nlist} in {time.perf_counter() - t0:.2f}s")
+
+    def _index_append(self, seg: _Segment, start_row: int):
+        if self._ann is None:
+            if self.index_kind == "ivf" and len(self) >= settings.VS_IVF_MIN_ROWS:
+                self.rebuild_index()
+            return
+        self._ann.add(np.asarray(seg.raw), start_row=start_row)
+        self._ann_unsaved += len(seg)
+        # индекс пересохраняем не на каждую вставку: отставший хвост догружается при открытии стора
+        if self._ann_unsaved > 0.1 * len(self):
+            self._ann.save(self.index_path)
+            self._ann_unsaved = 0
+
+    # ---------- запись ----------
+
+    def add_texts(self, texts: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]] | None = None,
+                  replace_sources: Iterable[str] = ()) -> List[str]:
+        """replace_sources — документы, чьи прежние строки удаляются в той же записи manifest (новая версия файла)."""
+        replace_sources = set(replace_sources)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = []
+        records = []
         for t, m in zip(texts, metadatas):
             _id = m.get("id") or str(uuid.uuid4())
             ids.append(_id)
-            self._meta.append({"id": _id, "text": t, "meta": m})
+            records.append({"id": _id, "text": t, "meta": m})
+        if not records:
+            return ids
 
-        self._save()
+        seg = _Segment.from_vectors(None, records, np.array(embeddings, dtype=np.float32), self.dtype)
+        with self._lock:
+            segments = self._persisted(list(self._segments))
+            start_row = len(self)
+            seg = seg.write(self.dir, self._new_segment_name(), self.dtype)
+            deleted = self.deleted
+            if replace_sources:
+                old = [i for i, rec in enumerate(self.records()) if (rec.get("meta") or {}).get("source") in replace_sources]
+                deleted = np.union1d(deleted, np.asarray(old, dtype=np.int64))
+            segments.append(seg)
+            self._write_manifest(segments, content_changed=True, deleted=deleted)
+            self._index_append(seg, start_row)
+
+        if self.auto_compact and len(self._segments) > self.max_segments:
+            self.compact(background=True)
         return ids
 
+    def _compaction_run(self, segments: List[_Segment], full: bool) -> Tuple[int, int]:
+        """Диапазон [i, j) соседних сегментов для слияния (размеры держим примерно геометрическими)."""
+        n = len(segments)
+        if full:
+            return 0, n
+        i, run = n - 1, len(segments[-1])
+        while i > 0 and len(segments[i - 1]) <= 2 * run:
+            i -= 1
+            run += len(segments[i])
+        return (i, n) if n - i >= 2 else (n - 2, n)
+
+    def compact(self, background: bool = False, full: bool = False):
+        if background:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self.compact, kwargs={"full": full}, daemon=True, name="vs-compactor")
+            self._compactor.start()
+            return
+
+        with self._compact_lock:
+            with self._lock:
+                snapshot = self._persisted(list(self._segments))
+                if snapshot != self._segments:
+                    self._write_manifest(snapshot)
+            if len(snapshot) < 2:
+                return
+            i, j = self._compaction_run(snapshot, full)
+            victims = snapshot[i:j]
+            t0 = time.perf_counter()
+            records = [rec for s in victims for rec in s.records]
+            raw = np.concatenate([np.asarray(s.raw) for s in victims])
+            merged = _Segment.from_vectors(None, records, raw, self.dtype)
+            with self._lock:
+                merged = merged.write(self.dir, self._new_segment_name(), self.dtype)
+                # пока мы сливали, add_texts мог дописать сегменты в конец — сохраняем их
+                current = self._segments
+                self._write_manifest(current[:i] + [merged] + current[j:])
+            for s in victims:
+                shutil.rmtree(os.path.join(self.dir, s.name), ignore_errors=True)
+            log.info(f"compacted {len(victims)} segments ({len(records)} rows) in {time.perf_counter() - t0:.2f}s")
+
+    def wait_compaction(self, timeout: float | None = None):
+        if self._compactor is not None:
+            self._compactor.join(timeout)
+
+    # ---------- чтение ----------
+
+    def __len__(self) -> int:
+        return int(self._view[1][-1])
+
+    def _locate(self, row: int) -> Tuple[_Segment, int]:
+        # сквозные номера строк стабильны: add_texts дописывает в конец, compact сохраняет порядок
+        segments, offsets = self._view
+        k = int(np.searchsorted(offsets, row, side="right")) - 1
+        return segments[k], row - int(offsets[k])
+
+    def _record(self, row: int) -> Dict[str, Any]:
+        seg, i = self._locate(row)
+        # PackedRecords декодирует запись заново на каждое обращение — копировать незачем
+        rec = seg.records[i]
+        return dict(rec) if isinstance(seg.records, list) else rec
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        """Все строки по порядку, включая удалённые (нумерация совпадает со сквозными номерами строк)."""
+        for seg in list(self._segments):
+            yield from seg.records
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Нормированные float32-векторы по сквозным номерам строк (в порядке rows)."""
+        segments, offsets = self._view
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((len(rows), int(segments[0].raw.shape[1]) if segments else 0), dtype=np.float32)
+        which = np.searchsorted(offsets, rows, side="right") - 1
+        for k in np.unique(which):
+            mask = which == k
+            out[mask] = segments[int(k)].raw[rows[mask] - offsets[k]]
+        return out
+
     def search(self, query_vec: List[float], top_k: int = 4) -> List[Dict[str, Any]]:
-        if self._emb is None or len(self._meta) == 0:
+        return self.search_multi([query_vec], top_k=top_k)
+
+    def search_multi(self, query_vecs: List[List[float]], top_k: int = 4) -> List[Dict[str, Any]]:
+        """
+        Поиск сразу по нескольким вариантам запроса одним матричным произведением.
+        Скор строки — максимум по вариантам (fused top-k): это ровно объединение top-k
+        каждого варианта, отсортированное по лучшему скору и обрезанное до top_k.
+        """
+        segments = self._segments
+        if not segments or len(self) == 0 or len(query_vecs) == 0:
             return []
 
-        V = self._emb
-        q = np.array(query_vec, dtype=np.float32)
+        Q = _normalize(np.atleast_2d(np.asarray(query_vecs, dtype=np.float32)))
+        if self._ann is not None:
+            return self._search_ann(Q, top_k)
+        sims = np.concatenate([s.scores(Q.T) for s in segments]) if len(segments) > 1 else segments[0].scores(Q.T)
+        sims = sims.max(axis=1)
+        if len(self.deleted):
+            sims[self.deleted[self.deleted < len(sims)]] = -np.inf
+
+        if self.dtype == "float32":
+            idx = _topk(sims, top_k)
+            scores = sims[idx]
+        else:
+            # грубый отбор по квантованной матрице, затем точный float32-пересчёт короткого списка
+            rows = np.sort(_topk(sims, top_k * self.rescore_factor))
+            rows = rows[np.isfinite(sims[rows])]   # удалённые строки не пересчитываем
+            exact = (self.vectors(rows) @ Q.T).max(axis=1)
+            order = _topk(exact, top_k)
+            idx, scores = rows[order], exact[order]
+        return self.hits(idx, scores)
 
-        Vn = V / (np.linalg.norm(V, axis=1, keepdims=True) + 1e-12)
-        qn = q / (np.linalg.norm(q) + 1e-12)
-        sims = Vn @ qn
+    def _search_ann(self, Q: np.ndarray, top_k: int) -> List[Dict[str, Any]]:
+        # кандидаты из nprobe списков IVF (объединение по вариантам), точный float32-скоринг только по ним
+        rows = np.unique(np.concatenate([self._ann.candidates(q, self.nprobe) for q in Q]))
+        rows = rows[rows < len(self)]
+        if len(self.deleted):
+            rows = np.setdiff1d(rows, self.deleted, assume_unique=True)
+        if len(rows) == 0:
+            return []
+        exact = (self.vectors(rows) @ Q.T).max(axis=1)
+        order = _topk(exact, top_k)
+        return self.hits(rows[order], exact[order])
 
-        idx = np.argsort(-sims)[:top_k]
+    def hits(self, rows: np.ndarray, scores: np.ndarray) -> List[Dict[str, Any]]:
+        """Записи со скором по сквозным номерам строк (используют и внешние индексы, напр. BM25)."""
         out: List[Dict[str, Any]] = []
-        for i in idx:
-            rec = dict(self._meta[int(i)])
-            rec["score"] = float(sims[int(i)])
+        rows, scores = np.asarray(rows), np.asarray(scores)
+        if len(self.deleted):
+            # top-k мог добрать удалённые строки (-inf), если живых меньше k
+            keep = ~np.isin(rows, self.deleted)
+            rows, scores = rows[keep], scores[keep]
+        for i, sc in zip(rows, scores):
+            rec = self._record(int(i))
+            rec["score"] = float(sc)
+            rec["row"] = int(i)  # по номеру строки локальный reranker достаёт вектор без повторного поиска
             out.append(rec)
         return out
+
+    def stats(self) -> Dict[str, Any]:
+        segments = self._segments
+        return {
+            "rows": len(self),
+            "deleted": int(len(self.deleted)),
+            "dim": int(segments[0].raw.shape[1]) if segments else 0,
+            "dtype": self.dtype,
+            "version": self.version,
+            "kb_version": self.kb_version,
+            "segments": len(segments),
+            "index": "ivf" if self._ann is not None else "flat",
+            "nlist": self._ann.nlist if self._ann is not None else None,
+            "nprobe": self.nprobe if self._ann is not None else None,
+            "index_bytes": int(sum(s.emb.nbytes + (s.scale.nbytes if s.scale is not None else 0) for s in segments)),
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перевод store.jsonl + embeddings.npy в сегментный mmap-формат и компакция")
+    parser.add_argument("--dir", default="data/embeddings")
+    parser.add_argument("--dtype", default=None, help="float32 | float16 | int8 — какую квантованную копию положить рядом")
+    parser.add_argument("--compact", action="store_true", help="слить все сегменты в один")
+    parser.add_argument("--build-ivf", type=int, default=None, metavar="NLIST", help="перестроить IVF-индекс (0 — авто nlist)")
+    args = parser.parse_args()
+    store = LocalVectorStore(args.dir, dtype=args.dtype, auto_compact=False)
+    store.compact(full=args.compact)
+    if args.build_ivf is not None:
+        store.rebuild_index(nlist=args.build_ivf)
+    print(f"OK: {store.stats()} -> {store.manifest_path}")
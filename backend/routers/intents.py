@@ -21,14 +21,14 @@ class IntentResponse(BaseModel):
     fallback: str | None = None
 
 @router.post("/classify", response_model=IntentResponse)
-def classify(req: IntentRequest):
+async def classify(req: IntentRequest):
     try:
         sid = req.session_id or "default"
 
-        memory.append(sid, "user", req.text, meta={"endpoint":"intent"})
-        result = clf.predict(req.text, language=req.language, session_messages=memory.get_messages(sid))
+        history = await memory.aappend_and_get(sid, "user", req.text, meta={"endpoint":"intent"})
+        result = await clf.apredict(req.text, language=req.language, session_messages=history)
 
-        memory.append(sid, "assistant", f"[intent: {result['intent']}]", meta={"endpoint":"intent"})
+        await memory.aappend(sid, "assistant", f"[intent: {result['intent']}]", meta={"endpoint":"intent"})
         return result
     except Exception as e:
         log.exception("intent classify failed")
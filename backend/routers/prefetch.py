@@ -0,0 +1,81 @@
+# backend/routers/prefetch.py
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+import asyncio, time
+
+from backend.agents.registry import registry
+from backend.utils.settings import settings
+
+class _Speculation:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.t0 = time.perf_counter()
+        self.done_at: Optional[float] = None
+        task.add_done_callback(self._done)
+
+    def _done(self, _task: asyncio.Task):
+        self.done_at = time.perf_counter()
+
+class Prefetcher:
+    """
+    Спекулятивный retrieve в /route: стартует вместе с классификацией интента.
+    Если интент ушёл в RAG-агента с общим Retriever — результат отдаётся агенту, иначе задача отменяется.
+    Считает попадания/промахи и сэкономленное время (сколько retrieve успел пройти параллельно классификации).
+    """
+    def __init__(self):
+        self.intents = {s.strip() for s in settings.PREFETCH_INTENTS.split(",") if s.strip()}
+        self.started = 0
+        self.used = 0
+        self.wasted = 0
+        self.saved_ms = 0.0
+        self.wasted_ms = 0.0
+
+    def start(self, query: str, history: List[Dict[str, Any]]) -> Optional[_Speculation]:
+        if not settings.PREFETCH_ENABLE or not self.intents:
+            return None
+        retriever = registry.retriever()
+        self.started += 1
+        return _Speculation(asyncio.create_task(retriever.aretrieve(query, history=history)))
+
+    def resolve(self, spec: Optional[_Speculation], intent: str, agent: Any) -> Optional[asyncio.Task]:
+        """Задача с хитами для агента или None (спекуляция отменена)."""
+        if spec is None:
+            return None
+        now = time.perf_counter()
+        if intent in self.intents and getattr(agent, "retriever", None) is registry.retriever():
+            self.used += 1
+            self.saved_ms += ((spec.done_at or now) - spec.t0) * 1000
+            return spec.task
+        self.cancel(spec)
+        return None
+
+    def cancel(self, spec: Optional[_Speculation]):
+        if spec is None:
+            return
+        spec.task.cancel()
+        self.wasted += 1
+        self.wasted_ms += ((spec.done_at or time.perf_counter()) - spec.t0) * 1000
+
+    def release(self, task: Optional[asyncio.Task]):
+        """Запрос завершён: prefetch, который агент так и не дождался (ошибка, клиент отключился), отменяем,
+        а исключение забираем — иначе asyncio пишет "Task exception was never retrieved"."""
+        if task is None:
+            return
+        if not task.done():
+            task.cancel()
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.PREFETCH_ENABLE,
+            "intents": sorted(self.intents),
+            "started": self.started,
+            "used": self.used,
+            "wasted": self.wasted,
+            "hit_rate": round(self.used / self.started, 4) if self.started else 0.0,
+            "saved_ms_total": round(self.saved_ms, 1),
+            "saved_ms_avg": round(self.saved_ms / self.used, 1) if self.used else 0.0,
+            "wasted_ms_total": round(self.wasted_ms, 1),
+        }
+
+prefetcher = Prefetcher()
@@ -1,10 +1,15 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, Tuple
+import json
 from backend.utils.logger import get_logger
 from backend.nlp.intent_llm import LLMIntentClassifier
 from backend.agents.base import make_agent
 from backend.memory.session import memory
+from backend.routers.prefetch import prefetcher
+from backend.metrics import token_meter, tracing
 
 router = APIRouter(prefix="/route", tags=["router"])
 log = get_logger("processing-router")
@@ -25,25 +30,52 @@ class RouteResponse(BaseModel):
     fallback: str | None = None
     extra: Dict[str, Any] | None = None
 
-@router.post("", response_model=RouteResponse)
-def route(req: RouteRequest):
+async def _dispatch(req: RouteRequest) -> Tuple[str, Dict[str, Any], Any, Dict[str, Any]]:
+    """Общая часть /route и /route/stream: память, prefetch, классификация, выбор агента."""
+    sid = req.session_id or "default"
+
+    with tracing.span("history"):
+        history = await memory.aappend_and_get(sid, "user", req.text, meta={"endpoint":"route"})
+    # retrieve для RAG-интентов стартует сразу, не дожидаясь классификации
+    spec = prefetcher.start(req.text, history)
     try:
-        sid = req.session_id or "default"
+        with tracing.span("classify") as attrs:
+            intent_result = await clf.apredict(req.text, language=req.language, session_messages=history)
+            if attrs is not None:
+                attrs["intent"] = intent_result["intent"]
+    except BaseException:
+        prefetcher.cancel(spec)
+        raise
+    intent = intent_result["intent"]
 
-        memory.append(sid, "user", req.text, meta={"endpoint":"route"})
+    agent = make_agent(intent)
+    context = {"session_id": sid, "history": history, **(req.context or {})}
+    prefetch = prefetcher.resolve(spec, intent, agent)
+    if prefetch is not None:
+        context["prefetch"] = prefetch
+    return sid, intent_result, agent, context
 
-        history = memory.get_messages(sid)
-        intent_result = clf.predict(req.text, language=req.language, session_messages=history)
+@router.post("", response_model=RouteResponse)
+async def route(req: RouteRequest):
+    meter = token_meter.start()
+    trace = tracing.begin("route", session=req.session_id or "default")
+    context: Dict[str, Any] = {}
+    try:
+        sid, intent_result, agent, context = await _dispatch(req)
         intent = intent_result["intent"]
         confidence = float(intent_result["confidence"])
 
-        agent = make_agent(intent)
-        agent_output = agent.run(req.text, context={"session_id": sid, "history": history, **(req.context or {})})
+        with tracing.span("agent", agent=agent.name):
+            agent_output = await agent.arun(req.text, context=context)
 
         answer = str(agent_output.get("answer", ""))
         extra = {k: v for k, v in agent_output.items() if k != "answer"}
+        extra["usage"] = token_meter.finish(meter)
+        if trace is not None:
+            extra["trace_id"] = trace.trace_id
 
-        memory.append(sid, "assistant", answer, meta={"endpoint":"route","agent":agent.name,"intent":intent})
+        await memory.aappend(sid, "assistant", answer, meta={"endpoint":"route","agent":agent.name,"intent":intent})
+        tracing.end(trace, intent=intent, agent=agent.name)
 
         return RouteResponse(
             intent=intent,
@@ -55,5 +87,75 @@ def route(req: RouteRequest):
             extra=extra or None
         )
     except Exception as e:
+        tracing.end(trace, error=str(e))
         log.exception("route failed")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        prefetcher.release(context.get("prefetch"))
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/stream")
+async def route_stream(req: RouteRequest):
+    """
+    SSE-вариант /route: событие meta (интент/агент) уходит сразу после классификации,
+    затем token-события по мере генерации и done с extra. Память пишется, только когда поток завершён.
+    """
+    meter = token_meter.start()
+    trace = tracing.begin("route.stream", session=req.session_id or "default")
+    try:
+        sid, intent_result, agent, context = await _dispatch(req)
+    except Exception as e:
+        tracing.end(trace, error=str(e))
+        log.exception("route stream failed")
+        raise HTTPException(status_code=500, detail=str(e))
+    intent = intent_result["intent"]
+    prefetch = context.get("prefetch")
+
+    async def events() -> AsyncIterator[str]:
+        # генератор выполняется уже в контексте StreamingResponse
+        token_meter.bind(meter)
+        tracing.bind(trace)
+        try:
+            yield _sse("meta", {
+                "intent": intent,
+                "confidence": float(intent_result["confidence"]),
+                "agent": agent.name,
+                "llm": intent_result.get("llm"),
+                "fallback": intent_result.get("fallback"),
+            })
+            result: Dict[str, Any] = {}
+            try:
+                with tracing.span("agent", agent=agent.name):
+                    async for ev in agent.astream(req.text, context=context):
+                        if ev["event"] == "token":
+                            yield _sse("token", {"text": ev["text"]})
+                        else:
+                            result = ev["result"]
+            except Exception as e:
+                tracing.end(trace, error=str(e))
+                log.exception("route stream failed")
+                yield _sse("error", {"detail": str(e)})
+                return
+
+            answer = str(result.get("answer", ""))
+            extra = {k: v for k, v in result.items() if k != "answer"}
+            extra["usage"] = token_meter.finish(meter)
+            if trace is not None:
+                extra["trace_id"] = trace.trace_id
+            await memory.aappend(sid, "assistant", answer, meta={"endpoint":"route","agent":agent.name,"intent":intent})
+            tracing.end(trace, intent=intent, agent=agent.name)
+            yield _sse("done", {"extra": extra})
+        finally:
+            prefetcher.release(prefetch)
+
+    # клиент может отключиться до первой итерации генератора — тогда его finally не выполнится,
+    # а background StreamingResponse запускается и после обрыва
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                             background=BackgroundTask(prefetcher.release, prefetch))
+
+@router.get("/prefetch/stats")
+def prefetch_stats():
+    return prefetcher.stats()
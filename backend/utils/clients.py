@@ -0,0 +1,34 @@
+# backend/utils/clients.py
+from __future__ import annotations
+from functools import lru_cache
+from openai import AsyncOpenAI, OpenAI
+import httpx
+
+from backend.utils.settings import settings
+
+@lru_cache(maxsize=None)
+def openai_client(timeout: int | None = None) -> OpenAI:
+    """
+    Общий OpenAI-клиент на процесс (один пул соединений httpx на каждый timeout).
+    OpenAI/httpx.Client потокобезопасны, поэтому их можно делить между воркерами threadpool.
+    """
+    t = timeout or settings.REQUEST_TIMEOUT_SECONDS
+    return OpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        base_url=settings.OPENAI_BASE_URL,
+        timeout=t,
+        max_retries=2,
+        http_client=httpx.Client(timeout=t),
+    )
+
+@lru_cache(maxsize=None)
+def async_openai_client(timeout: int | None = None) -> AsyncOpenAI:
+    """Асинхронный двойник openai_client для async-пути /route и /intent (общий пул на цикл событий uvicorn)."""
+    t = timeout or settings.REQUEST_TIMEOUT_SECONDS
+    return AsyncOpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        base_url=settings.OPENAI_BASE_URL,
+        timeout=t,
+        max_retries=2,
+        http_client=httpx.AsyncClient(timeout=t),
+    )
@@ -13,14 +13,72 @@ class Settings(BaseModel):
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     REQUEST_TIMEOUT_SECONDS: int = int(os.getenv("REQUEST_TIMEOUT_SECONDS", "30"))
 
+    # Локальный классификатор интентов перед LLM (см. backend/nlp/intent_local.py)
+    INTENT_LOCAL_MODEL: str = os.getenv("INTENT_LOCAL_MODEL", "data/models/intent_local.npz").strip()
+    INTENT_LOCAL_THRESHOLD: float = float(os.getenv("INTENT_LOCAL_THRESHOLD", "0.85"))
+    INTENT_LOG_PATH: str = os.getenv("INTENT_LOG_PATH", "").strip()   # JSONL решений LLM для обучения; пусто — не пишем
+    # Семантический кэш классификаций: ближайший сосед по эмбеддингу сообщения в корзине контекста истории
+    INTENT_CACHE: bool = os.getenv("INTENT_CACHE", "1") in ("1", "true", "True")
+    INTENT_CACHE_THRESHOLD: float = float(os.getenv("INTENT_CACHE_THRESHOLD", "0.95"))
+    INTENT_CACHE_TTL: int = int(os.getenv("INTENT_CACHE_TTL", "3600"))
+    INTENT_CACHE_SIZE: int = int(os.getenv("INTENT_CACHE_SIZE", "10000"))
+
     USE_RERANK: bool = os.getenv("USE_RERANK", "0") in ("1", "true", "True")
     RERANK_TOP_K: int = int(os.getenv("RERANK_TOP_K", "4"))
     RERANK_MODEL: str = os.getenv("RERANK_MODEL", "default")
+    RERANK_PASSAGE_TOKENS: int = int(os.getenv("RERANK_PASSAGE_TOKENS", "200"))   # бюджет на пассаж в промпте (0 — без обрезки)
+    RERANK_BATCH_SIZE: int = int(os.getenv("RERANK_BATCH_SIZE", "4"))             # документов на один параллельный вызов
+    RERANK_CONCURRENCY: int = int(os.getenv("RERANK_CONCURRENCY", "8"))           # потоков общего пула sync-rerank на процесс
+    RERANK_CACHE: bool = os.getenv("RERANK_CACHE", "1") in ("1", "true", "True")
+    RERANK_CACHE_TTL: int = int(os.getenv("RERANK_CACHE_TTL", "3600"))
+    RERANK_CACHE_SIZE: int = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+    RERANK_MODE: str = os.getenv("RERANK_MODE", "llm").strip().lower()   # llm | mmr (локально, без сети)
+    MMR_LAMBDA: float = float(os.getenv("MMR_LAMBDA", "0.7"))           # 1.0 — только релевантность, меньше — больше разнообразия
+    MMR_LEX_WEIGHT: float = float(os.getenv("MMR_LEX_WEIGHT", "0.3"))   # вес лексического перекрытия в релевантности
 
     USE_VECTOR_API: bool = os.getenv("USE_VECTOR_API", "0") in ("1", "true", "True")
     VECTOR_STORE_ID: str = os.getenv("VECTOR_STORE_ID", "").strip()
     CHUNK_SIZE: int = int(os.getenv("CHUNK_SIZE", "900"))
     CHUNK_OVERLAP: int = int(os.getenv("CHUNK_OVERLAP", "150"))
+    # Ingest (backend/rag/ingest.py): разбор в пуле процессов, эмбеддинги батчами с ограничением параллелизма
+    INGEST_WORKERS: int = int(os.getenv("INGEST_WORKERS", "0"))               # 0 — по числу CPU
+    INGEST_CONCURRENCY: int = int(os.getenv("INGEST_CONCURRENCY", "4"))       # запросов к embeddings API в полёте
+    INGEST_BATCH_SIZE: int = int(os.getenv("INGEST_BATCH_SIZE", "256"))       # чанков на запрос
+    INGEST_BATCH_TOKENS: int = int(os.getenv("INGEST_BATCH_TOKENS", "60000")) # токенов на запрос
+    INGEST_FLUSH_ROWS: int = int(os.getenv("INGEST_FLUSH_ROWS", "2000"))      # строк на сегмент стора + checkpoint
+    INGEST_RETRIES: int = int(os.getenv("INGEST_RETRIES", "3"))
+
+    # LocalVectorStore: float32 | float16 | int8 (для квантованных — точный пересчёт кандидатов во float32)
+    VS_DTYPE: str = os.getenv("VS_DTYPE", "float32").strip().lower()
+    VS_RESCORE_FACTOR: int = int(os.getenv("VS_RESCORE_FACTOR", "4"))
+    VS_MAX_SEGMENTS: int = int(os.getenv("VS_MAX_SEGMENTS", "8"))
+    VS_AUTO_COMPACT: bool = os.getenv("VS_AUTO_COMPACT", "1") in ("1", "true", "True")
+    # ANN-индекс: flat (полный перебор) | ivf; до VS_IVF_MIN_ROWS строк всегда перебор
+    VS_INDEX: str = os.getenv("VS_INDEX", "flat").strip().lower()
+    VS_IVF_NLIST: int = int(os.getenv("VS_IVF_NLIST", "0"))      # 0 — авто (~4*sqrt(N))
+    VS_IVF_NPROBE: int = int(os.getenv("VS_IVF_NPROBE", "8"))
+    VS_IVF_MIN_ROWS: int = int(os.getenv("VS_IVF_MIN_ROWS", "5000"))
+
+    # Retriever: dense | hybrid (dense + BM25, RRF) | lexical (только BM25, без embeddings API)
+    RETRIEVAL_MODE: str = os.getenv("RETRIEVAL_MODE", "dense").strip().lower()
+    RRF_K: int = int(os.getenv("RRF_K", "60"))
+    # медленнее EMBED_TIMEOUT_MS или ошибка — запрос идёт в BM25; EMBED_FAILURES_TO_TRIP таких подряд —
+    # BM25-only на EMBED_COOLDOWN_SECONDS
+    EMBED_TIMEOUT_MS: int = int(os.getenv("EMBED_TIMEOUT_MS", "3000"))
+    EMBED_FAILURES_TO_TRIP: int = int(os.getenv("EMBED_FAILURES_TO_TRIP", "3"))
+    EMBED_COOLDOWN_SECONDS: int = int(os.getenv("EMBED_COOLDOWN_SECONDS", "30"))
+
+    # Кэш эмбеддингов: LRU в памяти + SQLite на диске (EMB_CACHE_PATH пуст — только память;
+    # дисковый уровень включается явно, чтобы процессы и тесты не писали в рабочее дерево)
+    EMB_CACHE: bool = os.getenv("EMB_CACHE", "1") in ("1", "true", "True")
+    EMB_CACHE_PATH: str = os.getenv("EMB_CACHE_PATH", "").strip()
+    EMB_CACHE_MEM_ITEMS: int = int(os.getenv("EMB_CACHE_MEM_ITEMS", "4096"))
+    EMB_CACHE_DISK_ITEMS: int = int(os.getenv("EMB_CACHE_DISK_ITEMS", "200000"))
+
+    # Кэш ответов RAG-агентов (ключ: запрос + id чанков + kb_version стора)
+    ANSWER_CACHE: bool = os.getenv("ANSWER_CACHE", "1") in ("1", "true", "True")
+    ANSWER_CACHE_TTL: int = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+    ANSWER_CACHE_SIZE: int = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
 
     QT_ENABLE: bool = os.getenv("QT_ENABLE", "1") in ("1", "true", "True")
     QT_MULTI: bool = os.getenv("QT_MULTI", "1") in ("1", "true", "True")
@@ -28,6 +86,38 @@ class Settings(BaseModel):
     QT_MULTI_K: int = int(os.getenv("QT_MULTI_K", "3"))
     QT_LANG_MIRROR: bool = os.getenv("QT_LANG_MIRROR", "1") in ("1", "true", "True")
 
+    # Спекулятивный retrieval в /route параллельно с классификацией интента
+    PREFETCH_ENABLE: bool = os.getenv("PREFETCH_ENABLE", "1") in ("1", "true", "True")
+    PREFETCH_INTENTS: str = os.getenv("PREFETCH_INTENTS", "general_knowledge,product_recommendation")
+
+    # Память диалогов: memory (процесс) | redis (общая для воркеров/реплик, TTL на сервере)
+    SESSION_BACKEND: str = os.getenv("SESSION_BACKEND", "memory").strip().lower()
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    REDIS_PREFIX: str = os.getenv("REDIS_PREFIX", "zaman:")
+    # медленный или недоступный Redis должен давать быструю ошибку, а не вешать воркер
+    REDIS_SOCKET_TIMEOUT: float = float(os.getenv("REDIS_SOCKET_TIMEOUT", "1.0"))
+    REDIS_CONNECT_TIMEOUT: float = float(os.getenv("REDIS_CONNECT_TIMEOUT", "1.0"))
+    SESSION_LOCK_TIMEOUT: float = float(os.getenv("SESSION_LOCK_TIMEOUT", "5"))   # замок состояния сессии в Redis, сек
+    # in-memory: лимит сессий (LRU), TTL и период фонового sweeper
+    SESSION_MAX: int = int(os.getenv("SESSION_MAX", "10000"))
+    SESSION_MAX_MESSAGES: int = int(os.getenv("SESSION_MAX_MESSAGES", "18"))
+    SESSION_TTL_SECONDS: int = int(os.getenv("SESSION_TTL_SECONDS", str(60*60*12)))
+    SESSION_SWEEP_SECONDS: float = float(os.getenv("SESSION_SWEEP_SECONDS", "60"))
+    SESSION_LOCK_STRIPES: int = int(os.getenv("SESSION_LOCK_STRIPES", "64"))
+    # Сводка истории обновляется на append: окно последних реплик + (опционально) фоновое LLM-сжатие старых
+    HISTORY_WINDOW: int = int(os.getenv("HISTORY_WINDOW", "10"))
+    HISTORY_COMPACT: bool = os.getenv("HISTORY_COMPACT", "0") in ("1", "true", "True")
+    HISTORY_COMPACT_MODEL: str = os.getenv("HISTORY_COMPACT_MODEL", "gpt-4o-mini")
+    HISTORY_COMPACT_EVERY: int = int(os.getenv("HISTORY_COMPACT_EVERY", "6"))     # строк за окном до запуска сжатия
+    HISTORY_COMPACT_CHARS: int = int(os.getenv("HISTORY_COMPACT_CHARS", "400"))   # предел сжатой части
+
+    # Трассировка стадий /route: сэмплированные и медленные trace'ы — в кольцевой буфер /debug/traces
+    TRACE_ENABLE: bool = os.getenv("TRACE_ENABLE", "1") in ("1", "true", "True")
+    TRACE_SAMPLE_RATE: float = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+    TRACE_SLOW_MS: float = float(os.getenv("TRACE_SLOW_MS", "2000"))   # медленнее — в лог с разбивкой по стадиям
+    TRACE_BUFFER: int = int(os.getenv("TRACE_BUFFER", "200"))
+
+    # Цена за 1K токенов для token_meter (стоимость в extra.usage /route и на /metrics)
     PRICE_PROMPT_PER_1K: float = float(os.getenv("PRICE_PROMPT_PER_1K", "0"))
     PRICE_COMPLETION_PER_1K: float = float(os.getenv("PRICE_COMPLETION_PER_1K", "0"))
 
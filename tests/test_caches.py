@@ -0,0 +1,162 @@
+from types import SimpleNamespace
+from backend.rag.embed_cache import EmbeddingCache
+from backend.rag.embedder import Embedder
+
+class _FakeEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def create(self, model, input):
+        self.calls.append(list(input))
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(t)), 1.0]) for t in input])
+
+def _embedder(cache):
+    emb = Embedder()
+    emb.cache = cache
+    emb.client = SimpleNamespace(embeddings=_FakeEmbeddings())
+    return emb
+
+def test_embedder_skips_network_on_repeats(tmp_path):
+    emb = _embedder(EmbeddingCache(str(tmp_path / "emb.sqlite")))
+    assert emb.encode(["a", "bb", "a"]) == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert emb.encode(["bb", "ccc"]) == [[2.0, 1.0], [3.0, 1.0]]
+    assert emb.client.embeddings.calls == [["a", "bb"], ["ccc"]]
+
+    # новый процесс: память пустая, но диск отдаёт без сети
+    cold = _embedder(EmbeddingCache(str(tmp_path / "emb.sqlite")))
+    assert cold.encode(["a", "ccc"]) == [[1.0, 1.0], [3.0, 1.0]]
+    assert cold.client.embeddings.calls == []
+    assert cold.cache.stats()["hits_disk"] == 2
+    # atime попаданий с диска пишется пачкой со следующей вставкой, а не UPDATE на каждый hit
+    assert len(cold.cache._touched) == 2
+    cold.encode(["dddd"])
+    assert cold.cache._touched == {}
+
+def test_cache_is_size_bounded(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "emb.sqlite"), mem_items=2, disk_items=10)
+    for i in range(30):
+        cache.put_many("m", [f"t{i}"], [[float(i)]])
+    st = cache.stats()
+    assert st["mem_items"] == 2 and st["disk_items"] <= 10
+    assert cache.get_many("m", ["t29"])[0][0] == 29.0
+    assert cache.get_many("m", ["t0"]) == [None]
+
+    # попадание в память не ждёт SQLite: дисковый уровень под своей блокировкой
+    with cache._db_lock:
+        assert cache.get_many("m", ["t29"])[0][0] == 29.0
+
+def test_intent_cache_neighbours_buckets_and_lru(monkeypatch):
+    import time
+    from backend.nlp.intent_cache import SemanticIntentCache, history_bucket
+
+    cache = SemanticIntentCache(threshold=0.95, ttl_seconds=60, capacity=2)
+    cache.put([1.0, 0.0, 0.0], "", {"intent": "analytics", "confidence": 0.9})
+    hit = cache.get([0.99, 0.05, 0.0], "")
+    assert hit["intent"] == "analytics" and hit["cache"] == "semantic"
+    assert cache.get([0.0, 1.0, 0.0], "") is None           # далеко
+    assert cache.get([1.0, 0.0, 0.0], "wellness") is None   # другой контекст истории
+    assert history_bucket([{"role": "assistant", "content": "ok", "meta": {"intent": "wellness"}},
+                           {"role": "user", "content": "а ещё?", "meta": {}}]) == "wellness"
+
+    cache.put([0.0, 1.0, 0.0], "", {"intent": "wellness", "confidence": 0.8})
+    cache.get([1.0, 0.0, 0.0], "")                           # analytics — свежий, вытесняется wellness
+    cache.put([0.0, 0.0, 1.0], "", {"intent": "goal_planning", "confidence": 0.8})
+    assert cache.get([0.0, 1.0, 0.0], "") is None
+    assert cache.get([1.0, 0.0, 0.0], "")["intent"] == "analytics"
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)     # TTL истёк
+    assert cache.get([1.0, 0.0, 0.0], "") is None
+    st = cache.stats()
+    assert st["items"] == 2 and st["evictions"] == 1 and st["hits"] == 3
+    # протухший слот переиспользуется без LRU-вытеснения живой записи
+    cache.put([0.0, 1.0, 0.0], "", {"intent": "wellness", "confidence": 0.8})
+    st = cache.stats()
+    assert st["items"] == 2 and st["evictions"] == 1 and st["expired"] == 1
+    assert cache.get([0.0, 1.0, 0.0], "")["intent"] == "wellness"
+
+    big = SemanticIntentCache(capacity=10_000)
+    big.put([1.0, 0.0, 0.0], "", {"intent": "analytics", "confidence": 0.9})
+    assert big._vecs.shape[0] < 100                          # матрица растёт по мере заполнения
+
+def test_intent_llm_is_not_called_on_semantic_cache_hit():
+    import asyncio
+    from types import SimpleNamespace
+    from backend.nlp.intent_cache import SemanticIntentCache
+    from backend.nlp.intent_llm import LLMIntentClassifier
+
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs["messages"][-1]["content"])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='{"intent":"analytics"}'))])
+
+    async def aencode(texts):
+        return [[1.0, 0.0, 0.0] if "тревожно" in t else [0.0, 1.0, 0.0] for t in texts]
+
+    clf = LLMIntentClassifier.__new__(LLMIntentClassifier)
+    clf.model, clf.local, clf.cache = "m", None, SemanticIntentCache()
+    clf.embedder = SimpleNamespace(aencode=aencode)
+    clf.aclient = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    clf.cache.put([1.0, 0.0, 0.0], "", {"intent": "wellness", "confidence": 0.8})
+
+    out = asyncio.run(clf.apredict("мне тревожно"))
+    assert out["intent"] == "wellness" and out["cache"] == "semantic" and calls == []
+    assert asyncio.run(clf.apredict("расходы за май"))["intent"] == "analytics" and calls == ["расходы за май"]
+
+def test_answer_cache_bypasses_generation_until_kb_changes():
+    from backend.agents.general_agent import GeneralAgent
+    from backend.rag.answer_cache import AnswerCache
+    from backend.rag.retriever import Retriever
+
+    hits = [{"id": "c1", "text": "Мурабаха — продажа с наценкой", "meta": {"source": "faq.md", "chunk": 0}, "score": 0.9}]
+    calls = []
+
+    def create(**kw):
+        calls.append(kw)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"ответ {len(calls)}"))])
+
+    retriever = SimpleNamespace(store=SimpleNamespace(kb_version=1), format_context=Retriever.format_context,
+                                retrieve=lambda q, history=None: hits)
+    agent = GeneralAgent(retriever=retriever)
+    agent.cache = AnswerCache()
+    agent.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    assert agent.run("Что такое мурабаха?")["answer"] == "ответ 1"
+    again = agent.run("  что такое МУРАБАХА ")
+    assert again["answer"] == "ответ 1" and again["cache"] == "answer" and len(calls) == 1
+
+    retriever.store.kb_version = 2   # переиндексация БЗ
+    assert agent.run("Что такое мурабаха?")["answer"] == "ответ 2"
+    assert agent.cache.stats()["invalidations"] == 1
+
+def test_reranker_batches_truncates_and_caches():
+    import asyncio, json, re, time
+    from backend.rag.reranker import Reranker, ScoreCache
+
+    prompts = []
+
+    class _Completions:
+        async def create(self, **kw):
+            user = kw["messages"][1]["content"]
+            prompts.append(user)
+            await asyncio.sleep(0.05)
+            # оценка = номер документа из текста "docN"
+            ranking = [{"index": int(i), "score": int(n) / 10} for i, n in re.findall(r"\[(\d+)\] doc(\d+)", user)]
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps({"ranking": ranking})))])
+
+    rr = Reranker()
+    rr.cache, rr.batch_size, rr.passage_tokens = ScoreCache(), 4, 5
+    rr.aclient = SimpleNamespace(chat=SimpleNamespace(completions=_Completions()))
+    docs = [f"doc{i} " + "очень длинный пассаж " * 50 for i in range(10)]
+    ids = [f"c{i}" for i in range(10)]
+
+    t0 = time.perf_counter()
+    out = asyncio.run(rr.arerank("вклад", docs, top_k=3, ids=ids))
+    assert [r["index"] for r in out] == [9, 8, 7]
+    assert len(prompts) == 3 and time.perf_counter() - t0 < 0.14   # пачки 4+4+2 параллельно
+    assert all(len(p) < 400 for p in prompts)                     # пассажи обрезаны до бюджета
+
+    out = asyncio.run(rr.arerank("Вклад ", docs[:6], top_k=2, ids=ids[:6]))
+    assert [r["index"] for r in out] == [5, 4] and len(prompts) == 3
+    assert rr.cache.stats()["hits"] == 6
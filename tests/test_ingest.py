@@ -0,0 +1,87 @@
+import hashlib
+import numpy as np
+import pytest
+
+from backend.rag import ingest
+from backend.rag.store import LocalVectorStore
+
+class _Embedder:
+    """Детерминированные векторы по тексту; fail_after — сколько вызовов пройдёт до сбоя."""
+    def __init__(self, fail_after=None):
+        self.calls = []
+        self.fail_after = fail_after
+
+    def encode(self, texts):
+        if self.fail_after is not None and len(self.calls) >= self.fail_after:
+            raise RuntimeError("embeddings API down")
+        self.calls.append(len(texts))
+        return [np.random.default_rng(int(hashlib.md5(t.encode()).hexdigest()[:8], 16)).normal(size=8).tolist()
+                for t in texts]
+
+def _docs(root, n=6):
+    for i in range(n):
+        sections = "\n".join(f"## Раздел {j}\nДокумент {i}, раздел {j}: мурабаха и иджара." for j in range(5))
+        (root / f"doc{i}.md").write_text(f"# Документ {i}\n{sections}\n", encoding="utf-8")
+
+def test_directory_ingest_batches_and_resumes(tmp_path):
+    docs, store_dir = tmp_path / "docs", tmp_path / "store"
+    docs.mkdir()
+    _docs(docs)
+    paths = ingest.discover(dirs=[str(docs)])
+    assert len(paths) == 6
+
+    with pytest.raises(RuntimeError):
+        ingest.ingest(paths, str(store_dir), embedder=_Embedder(fail_after=3), workers=2, concurrency=1,
+                      batch_size=4, flush_rows=1, retries=0)
+    partial = len(LocalVectorStore(str(store_dir)))
+    assert 0 < partial < 36
+
+    emb = _Embedder()
+    report = ingest.ingest(paths, str(store_dir), embedder=emb, workers=2, concurrency=2, batch_size=4, retries=0)
+    assert report["skipped"] > 0 and max(emb.calls) <= 4
+    store = LocalVectorStore(str(store_dir))
+    # каждый чанк каждого документа — ровно один раз
+    keys = [(r["meta"]["source"], r["meta"]["chunk"]) for r in store.records()]
+    assert len(keys) == len(set(keys)) == 36
+
+    again = ingest.ingest(paths, str(store_dir), embedder=_Embedder(), workers=1)
+    assert again["skipped"] == 6 and again["chunks"] == 0
+
+def test_failed_store_write_is_not_retried_on_exit(tmp_path, monkeypatch):
+    docs, store_dir = tmp_path / "docs", tmp_path / "store"
+    docs.mkdir()
+    _docs(docs, n=3)
+    writes = []
+
+    def add_texts(self, texts, embeddings, metadatas=None, **kwargs):
+        writes.append(len(texts))
+        raise OSError("disk full")
+
+    monkeypatch.setattr(LocalVectorStore, "add_texts", add_texts)
+    with pytest.raises(OSError):
+        ingest.ingest(ingest.discover(dirs=[str(docs)]), str(store_dir), embedder=_Embedder(), workers=2,
+                      concurrency=1, batch_size=4, flush_rows=1, retries=0)
+    assert len(writes) == 1 and not (store_dir / ingest.CHECKPOINT).exists()
+
+def test_changed_file_replaces_its_old_chunks(tmp_path):
+    docs, store_dir = tmp_path / "docs", tmp_path / "store"
+    docs.mkdir()
+    _docs(docs, n=2)
+    paths = ingest.discover(dirs=[str(docs)])
+    ingest.ingest(paths, str(store_dir), embedder=_Embedder(), workers=1)
+
+    # регламент обновили и укоротили: из 5 разделов остался 1
+    (docs / "doc0.md").write_text("# Документ 0\n## Раздел 0\nНовая редакция: ставка 12%.\n", encoding="utf-8")
+    report = ingest.ingest(paths, str(store_dir), embedder=_Embedder(), workers=1)
+    assert report["replaced"] == 1 and report["skipped"] == 1
+
+    store = LocalVectorStore(str(store_dir))
+    dead = set(store.deleted.tolist())
+    live = [r for i, r in enumerate(store.records()) if i not in dead]
+    doc0 = [r["text"] for r in live if r["meta"]["source"].endswith("doc0.md")]
+    assert len(doc0) == 2 and "Новая редакция" in "\n".join(doc0) and "мурабаха" not in "\n".join(doc0)
+    assert len(live) == 6 + 2 and store.stats()["deleted"] == 6
+
+    emb = _Embedder()
+    hits = store.search(emb.encode([live[0]["text"]])[0], top_k=len(store))
+    assert len(hits) == len(live) and not {h["row"] for h in hits} & dead
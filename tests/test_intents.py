@@ -20,3 +20,42 @@ def test_llm_or_fallback():
     assert r.status_code == 200
     data = r.json()
     assert data["intent"] in {"product_recommendation","general_knowledge","analytics","goal_planning","wellness"}
+
+def test_local_model_gates_llm(tmp_path, monkeypatch):
+    import asyncio
+    from types import SimpleNamespace
+    from backend.nlp.intent_local import LocalIntentModel, evaluate
+    from backend.nlp.intent_llm import LLMIntentClassifier
+    from backend.utils.settings import settings
+
+    data = [
+        ("Хочу открыть вклад", "product_recommendation"), ("Какая карта без комиссии?", "product_recommendation"),
+        ("Нужен кредит на авто", "product_recommendation"), ("Оформить депозит в тенге", "product_recommendation"),
+        ("Покажи расходы за месяц", "analytics"), ("Сколько я потратил на еду", "analytics"),
+        ("Анализ транзакций по категориям", "analytics"), ("Статистика расходов за сентябрь", "analytics"),
+        ("Хочу накопить на отпуск", "goal_planning"), ("Составь бюджет на год", "goal_planning"),
+        ("Коплю на квартиру", "goal_planning"), ("План накоплений на машину", "goal_planning"),
+        ("Мне тревожно из-за денег", "wellness"), ("Грустно, долги давят", "wellness"),
+        ("Стресс из-за кредитов", "wellness"), ("Поддержи меня, плохое настроение", "wellness"),
+        ("Что такое мурабаха?", "general_knowledge"), ("Объясни сукук", "general_knowledge"),
+        ("Принципы исламского финансирования", "general_knowledge"), ("Что запрещает шариат в финансах", "general_knowledge"),
+    ]
+    model = LocalIntentModel.train([t for t, _ in data], [l for _, l in data], dim=1 << 14, epochs=30)
+    assert evaluate(model, [t for t, _ in data], [l for _, l in data], thresholds=(0.0,))[0]["agreement"] == 1.0
+    path = tmp_path / "intent_local.npz"
+    model.save(str(path))
+
+    monkeypatch.setattr(settings, "INTENT_LOCAL_MODEL", str(path))
+    monkeypatch.setattr(settings, "INTENT_LOCAL_THRESHOLD", 0.0)
+    calls = []
+
+    class _NoLLM:
+        def __init__(self):
+            self.chat = SimpleNamespace(completions=SimpleNamespace(create=lambda **kw: calls.append(kw)))
+
+    clf = LLMIntentClassifier()
+    clf.client, clf.aclient = _NoLLM(), _NoLLM()
+    out = asyncio.run(clf.apredict("Хочу открыть вклад"))
+    assert out["intent"] == "product_recommendation" and out["llm"] == "local-ngram"
+    assert clf.predict("Покажи расходы за месяц")["intent"] == "analytics"
+    assert calls == []
@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace as NS
+from backend.metrics import token_meter
+
+def test_token_meter_groups_calls_per_request():
+    def create(**kw):
+        return NS(usage=NS(prompt_tokens=100, completion_tokens=20))
+    async def acreate(**kw):
+        return NS(usage=NS(prompt_tokens=50, total_tokens=50))   # embeddings: без completion_tokens
+    def broken(**kw):
+        raise RuntimeError("timeout")
+
+    m = token_meter.start()
+    token_meter.metered("intent", create, model="m1")
+    asyncio.run(token_meter.ametered("embed", acreate, model="e1"))   # asyncio.run копирует контекст
+    try:
+        token_meter.metered("rerank", broken, model="m1")
+    except RuntimeError:
+        pass
+    s = token_meter.finish(m)
+    assert s["calls"] == 3 and s["prompt_tokens"] == 150 and s["completion_tokens"] == 20
+    assert s["by_component"]["rerank:m1"]["errors"] == 1 and s["by_component"]["embed:e1"]["prompt_tokens"] == 50
+
+    text = token_meter.meter.render()
+    assert 'llm_calls_total{component="intent",model="m1"}' in text
+    assert 'llm_call_seconds_bucket{component="embed",model="e1",le="+Inf"}' in text
+    assert "route_request_tokens_count" in text
+
+def test_prometheus_label_values_are_escaped():
+    reg = token_meter.MeterRegistry()
+    reg.observe_call('agent:my"agent', "org\\model\nv2", 1, 1, 0.1, ok=True)
+    text = reg.render()
+    assert 'llm_calls_total{component="agent:my\\"agent",model="org\\\\model\\nv2"} 1' in text
+    # ни одна строка экспозиции не разорвана переводом строки из метки
+    assert all(line.startswith(("#", "llm_", "route_")) for line in text.splitlines())
+
+def test_tracing_spans_nest_and_slow_requests_are_kept(monkeypatch):
+    from backend.metrics import tracing
+    from backend.utils.settings import settings
+    monkeypatch.setattr(settings, "TRACE_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(settings, "TRACE_SLOW_MS", 0.0)   # любой запрос — медленный
+
+    @tracing.traced("retrieve")
+    async def retrieve():
+        with tracing.span("vector_search", queries=2):
+            pass
+        token_meter.metered("embed", lambda **kw: NS(usage=NS(prompt_tokens=7)), model="e1")
+
+    trace = tracing.begin("route", session="s")
+    with tracing.span("classify") as attrs:
+        attrs["intent"] = "general_knowledge"
+    asyncio.run(retrieve())
+    tracing.end(trace, agent="general_knowledge")
+    tracing.bind(None)
+
+    d = tracing.buffer.recent(limit=1)[0]
+    assert d["trace_id"] == trace.trace_id and d["attrs"]["agent"] == "general_knowledge"
+    spans = {s["name"]: s for s in d["spans"]}
+    assert spans["classify"]["attrs"] == {"intent": "general_knowledge"} and spans["classify"]["parent"] == 0
+    assert spans["vector_search"]["parent"] == spans["retrieve"]["id"]
+    assert spans["llm:embed"]["parent"] == spans["retrieve"]["id"] and spans["llm:embed"]["attrs"]["tokens"] == 7
+    assert "    vector_search" in trace.breakdown()
@@ -0,0 +1,12 @@
+from backend.bench import retrieval
+from backend.rag.store import LocalVectorStore
+
+def test_golden_set_points_to_existing_chunks():
+    ids = {retrieval.chunk_id(r["meta"]) for r in LocalVectorStore("data/embeddings").records()}
+    golden = retrieval.load_golden()
+    assert {g["lang"] for g in golden} == {"ru", "en"}
+    assert all(set(g["relevant"]) <= ids for g in golden)
+
+def test_score_ranking():
+    row = retrieval.score_ranking(["a#1", "a#2", "a#3"], ["a#2", "a#9"], [1, 3])
+    assert row == {"recall@1": 0.0, "recall@3": 0.5, "rr": 0.5}
@@ -0,0 +1,101 @@
+from backend.agents.registry import AgentRegistry
+
+def test_registry_reuses_agents():
+    reg = AgentRegistry()
+    reg.warm()
+    a = reg.get("general_knowledge")
+    b = reg.get("general_knowledge")
+    assert a is b
+    # RAG-агенты делят один Retriever
+    assert reg.get("product_recommendation").retriever is a.retriever
+    # неизвестный интент -> агент по умолчанию
+    assert reg.get("unknown") is a
+    st = reg.stats()
+    assert st["warmed"] and st["builds"]["general_knowledge"] == 1
+    assert st["reuses"]["general_knowledge"] == 3
+
+def test_atransform_runs_expansion_and_hyde_concurrently(monkeypatch):
+    import asyncio, time
+    from types import SimpleNamespace
+    from backend.rag.query_transform import QueryTransformer
+    from backend.utils.settings import settings
+
+    class _Completions:
+        async def create(self, **kw):
+            await asyncio.sleep(0.1)
+            content = '{"queries": ["a", "b"]}' if kw.get("response_format") else "text"
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    monkeypatch.setattr(settings, "QT_MULTI", True)
+    monkeypatch.setattr(settings, "QT_HYDE", True)
+    qt = QueryTransformer()
+    qt.aclient = SimpleNamespace(chat=SimpleNamespace(completions=_Completions()))
+    t0 = time.perf_counter()
+    out = asyncio.run(qt.atransform("что такое мурабаха"))
+    # rewrite, затем multi_expand || hyde: ~2 задержки вместо 3
+    assert time.perf_counter() - t0 < 0.28
+    assert out["alternatives"] == ["a", "b"] and out["hyde"] == "text"
+
+def test_rag_agent_streams_tokens_then_result():
+    import asyncio
+    from types import SimpleNamespace
+    from backend.agents.general_agent import GeneralAgent
+    from backend.rag.answer_cache import AnswerCache
+    from backend.rag.retriever import Retriever
+
+    class _Stream:
+        closed = False
+        async def __aiter__(self):
+            for tok in ["Мура", "баха", None]:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=tok))])
+        async def close(self):
+            _Stream.closed = True
+
+    class _Completions:
+        async def create(self, **kw):
+            assert kw["stream"] is True
+            return _Stream()
+
+    async def aretrieve(q, history=None):
+        return [{"id": "c1", "text": "ctx", "meta": {"source": "kb.md", "chunk": 0}, "score": 0.5}]
+
+    agent = GeneralAgent(retriever=SimpleNamespace(store=None, format_context=Retriever.format_context, aretrieve=aretrieve))
+    agent.cache = AnswerCache()
+    agent.aclient = SimpleNamespace(chat=SimpleNamespace(completions=_Completions()))
+
+    async def collect():
+        return [ev async for ev in agent.astream("что такое мурабаха")]
+
+    events = asyncio.run(collect())
+    assert [e["text"] for e in events if e["event"] == "token"] == ["Мура", "баха"]
+    assert events[-1]["event"] == "done" and events[-1]["result"]["answer"] == "Мурабаха"
+    assert _Stream.closed
+    # повтор отдаётся из кэша ответов одним куском
+    assert asyncio.run(collect())[0] == {"event": "token", "text": "Мурабаха"}
+
+def test_prefetch_release_cancels_unused_task_and_retrieves_its_error():
+    import asyncio, gc
+    from backend.routers.prefetch import Prefetcher
+
+    unhandled = []
+
+    async def scenario():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, ctx: unhandled.append(ctx["message"]))
+        pending = asyncio.create_task(asyncio.sleep(10))
+
+        async def boom():
+            raise RuntimeError("retrieve failed")
+        failed = asyncio.create_task(boom())
+        await asyncio.sleep(0)
+
+        p = Prefetcher()
+        p.release(pending)   # стрим оборвался до того, как агент дождался prefetch
+        p.release(failed)
+        p.release(None)
+        await asyncio.sleep(0)
+        return pending, failed
+
+    pending, failed = asyncio.run(scenario())
+    del failed
+    gc.collect()
+    assert pending.cancelled() and not unhandled
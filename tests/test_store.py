@@ -0,0 +1,177 @@
+import numpy as np
+from backend.rag.store import LocalVectorStore
+
+def _fill(path, n=300, dim=64, seed=0, **kw):
+    rng = np.random.default_rng(seed)
+    vecs = rng.normal(size=(n, dim)).astype(np.float32)
+    store = LocalVectorStore(str(path), **kw)
+    store.add_texts([f"t{i}" for i in range(n)], vecs.tolist(), [{"chunk": i} for i in range(n)])
+    return store, vecs
+
+def test_search_exact_top1(tmp_path):
+    store, vecs = _fill(tmp_path)
+    hits = store.search(vecs[42].tolist(), top_k=3)
+    assert hits[0]["meta"]["chunk"] == 42
+    assert abs(hits[0]["score"] - 1.0) < 1e-5
+    assert hits[0]["score"] >= hits[1]["score"] >= hits[2]["score"]
+
+def test_quantized_modes_match_float32(tmp_path):
+    _, vecs = _fill(tmp_path)
+    q = vecs[7] + 0.1
+    ref = [h["id"] for h in LocalVectorStore(str(tmp_path)).search(q.tolist(), top_k=5)]
+    for dtype in ("float16", "int8"):
+        store = LocalVectorStore(str(tmp_path), dtype=dtype)
+        hits = store.search(q.tolist(), top_k=5)
+        assert [h["id"] for h in hits] == ref
+        assert store.stats()["index_bytes"] < 300 * 64 * 4
+
+def test_legacy_jsonl_migrates_to_segments(tmp_path):
+    import json, os
+    vecs = np.eye(3, 8, dtype=np.float32)
+    with open(tmp_path / "store.jsonl", "w", encoding="utf-8") as f:
+        for i in range(3):
+            f.write(json.dumps({"id": f"id{i}", "text": f"текст {i}", "meta": {"chunk": i}}, ensure_ascii=False) + "\n")
+    np.save(tmp_path / "embeddings.npy", vecs)
+
+    legacy = LocalVectorStore(str(tmp_path), dtype="int8")
+    assert os.path.exists(tmp_path / "manifest.json") and not os.path.exists(tmp_path / ".migrate.lock")
+    # после миграции float32 читается через mmap, в памяти воркера — только квантованная копия
+    assert isinstance(legacy._segments[0].raw, np.memmap) and legacy.kb_version == 0
+
+    store = LocalVectorStore(str(tmp_path), dtype="int8")
+    assert isinstance(store._segments[0].raw, np.memmap)
+    hit = store.search(vecs[2].tolist(), top_k=1)[0]
+    assert hit["id"] == "id2" and hit["text"] == "текст 2"
+
+def test_segments_append_and_compact(tmp_path):
+    import os
+    rng = np.random.default_rng(1)
+    vecs = rng.normal(size=(40, 16)).astype(np.float32)
+    store = LocalVectorStore(str(tmp_path), auto_compact=False)
+    for b in range(0, 40, 5):
+        store.add_texts([f"t{i}" for i in range(b, b + 5)], vecs[b:b + 5].tolist(), [{"chunk": i} for i in range(b, b + 5)])
+    assert store.stats()["segments"] == 8 and len(store) == 40
+
+    before = [h["id"] for h in store.search(vecs[33].tolist(), top_k=5)]
+    store.compact(full=True)
+    assert store.stats()["segments"] == 1
+    assert len(os.listdir(tmp_path / "segments")) == 1
+
+    reopened = LocalVectorStore(str(tmp_path))
+    assert [h["id"] for h in reopened.search(vecs[33].tolist(), top_k=5)] == before
+    assert [r["meta"]["chunk"] for r in reopened.records()] == list(range(40))
+
+def test_ivf_index_recall_and_inserts(tmp_path, monkeypatch):
+    from backend.utils.settings import settings
+    monkeypatch.setattr(settings, "VS_IVF_MIN_ROWS", 0)
+    rng = np.random.default_rng(2)
+    centers = rng.normal(size=(20, 32))
+    vecs = (centers[rng.integers(0, 20, size=2000)] + 0.3 * rng.normal(size=(2000, 32))).astype(np.float32)
+
+    flat = LocalVectorStore(str(tmp_path), auto_compact=False)
+    flat.add_texts([f"t{i}" for i in range(1500)], vecs[:1500].tolist())
+    ivf = LocalVectorStore(str(tmp_path), index="ivf", nprobe=4, auto_compact=False)
+    assert ivf.stats()["index"] == "ivf"
+
+    # инкрементальная вставка уходит в индекс без перестроения
+    ivf.add_texts([f"t{i}" for i in range(1500, 2000)], vecs[1500:].tolist())
+    flat = LocalVectorStore(str(tmp_path), auto_compact=False)
+
+    hits = 0
+    for i in range(0, 2000, 40):
+        ref = {h["id"] for h in flat.search(vecs[i].tolist(), top_k=5)}
+        got = {h["id"] for h in ivf.search(vecs[i].tolist(), top_k=5)}
+        hits += len(ref & got)
+    assert hits / (50 * 5) > 0.9
+
+    reopened = LocalVectorStore(str(tmp_path), index="ivf")
+    assert reopened.stats()["nlist"] == ivf.stats()["nlist"]
+    assert reopened.search(vecs[1999].tolist(), top_k=1)[0]["text"] == "t1999"
+
+def test_search_multi_equals_merged_single_searches(tmp_path):
+    store, vecs = _fill(tmp_path, dtype="int8")
+    qs = [vecs[3] + 0.2, vecs[50], vecs[99] - 0.1]
+    merged = {}
+    for q in qs:
+        for h in store.search(q.tolist(), top_k=6):
+            merged[h["id"]] = max(merged.get(h["id"], -1.0), h["score"])
+    expected = sorted(merged, key=lambda i: -merged[i])[:6]
+    assert [h["id"] for h in store.search_multi([q.tolist() for q in qs], top_k=6)] == expected
+
+def test_hybrid_retrieval_degrades_to_bm25(tmp_path, monkeypatch):
+    import asyncio
+    from types import SimpleNamespace
+    from backend.rag import bm25
+    from backend.rag.retriever import Retriever
+    from backend.utils.settings import settings
+
+    texts = ["Мурабаха — продажа товара с наценкой", "Сукук — исламские ценные бумаги",
+             "Иджара — аренда с правом выкупа", "Вклад Вакала на 12 месяцев"]
+    vecs = np.eye(4, 8, dtype=np.float32)
+    store = LocalVectorStore(str(tmp_path))
+    store.add_texts(texts, vecs.tolist(), [{"source": "kb.md", "chunk": i} for i in range(4)])
+    index = bm25.build_for_store(store)
+    assert bm25.load_for_store(store).vocab == index.vocab
+    rows, _ = index.search_multi(["что такое сукуки?"], top_k=2)
+    assert rows.tolist() == [1]
+
+    class _Down:
+        def encode(self, texts):
+            raise ConnectionError("embeddings down")
+        async def aencode(self, texts):
+            raise ConnectionError("embeddings down")
+
+    monkeypatch.setattr(settings, "RETRIEVAL_MODE", "hybrid")
+    monkeypatch.setattr(settings, "EMBED_FAILURES_TO_TRIP", 2)
+    r = Retriever()
+    r.store, r.bm25, r.qt, r.reranker, r.embedder = store, None, None, None, _Down()
+    assert r.retrieve("мурабаха")[0]["meta"]["chunk"] == 0
+    # единичный сбой не выключает dense, второй подряд — выключает
+    assert not r.stats()["dense_down"] and r.degraded == 1
+    r.retrieve("мурабаха")
+    assert r.stats()["dense_down"] and r.degraded == 2
+
+    # embeddings снова доступны: ранги dense и BM25 сливаются через RRF
+    r._dense_down_until = 0.0
+    qvec = (0.6 * vecs[0] + 0.8 * vecs[2]).tolist()
+    r.embedder = SimpleNamespace(aencode=lambda t: asyncio.sleep(0, result=[qvec] * len(t)))
+    hits = asyncio.run(r.aretrieve("мурабаха"))
+    assert [h["meta"]["chunk"] for h in hits[:2]] == [0, 2]   # BM25 поднял чанк 0 над более близким по косинусу
+    # score — по-прежнему косинус, rrf — отдельно; min_score отсекает по косинусу
+    assert abs(hits[0]["score"] - 0.6) < 1e-5 and hits[0]["bm25_score"] > 0 and "rrf" in hits[0]
+    assert all(h["score"] == h["dense_score"] for h in hits)
+    assert {h["meta"]["chunk"] for h in hits} == {0, 2}
+
+def test_retriever_never_builds_bm25_on_request_path(tmp_path, monkeypatch):
+    from backend.rag import bm25
+    from backend.rag.retriever import Retriever
+    from backend.utils.settings import settings
+
+    store = LocalVectorStore(str(tmp_path))
+    store.add_texts(["Мурабаха — продажа с наценкой", "Сукук — ценные бумаги"],
+                    np.eye(2, 4, dtype=np.float32).tolist(), [{"source": "kb.md", "chunk": i} for i in range(2)])
+    builds = []
+    monkeypatch.setattr(bm25.BM25Index, "build", classmethod(lambda cls, texts, **kw: builds.append(1)))
+    monkeypatch.setattr(settings, "RETRIEVAL_MODE", "lexical")
+    r = Retriever(store=store)
+    assert r.bm25 is None and r._lexical(["сукук"], 2) == [] and not builds   # индекса на диске нет — лексика выкл.
+
+    monkeypatch.undo()
+    bm25.build_for_store(store)                                    # ingest / CLI
+    assert r._lexical(["сукук"], 2)[0]["meta"]["chunk"] == 1
+
+def test_mmr_reranker_prefers_diverse_relevant_chunks(tmp_path):
+    from backend.rag.mmr import LocalReranker
+
+    vecs = np.array([[1, 0, 0], [0.99, 0.14, 0], [0.7, 0, 0.7], [0, 1, 0]], dtype=np.float32)
+    texts = ["мурабаха наценка", "мурабаха наценка банк", "мурабаха рассрочка", "вклад вакала"]
+    store = LocalVectorStore(str(tmp_path))
+    store.add_texts(texts, vecs.tolist(), [{"chunk": i} for i in range(4)])
+    candidates = store.search_multi([[1, 0, 0]], top_k=4)
+    assert [c["row"] for c in candidates][:2] == [0, 1]
+
+    ranking = LocalReranker(store, lam=0.5, lex_weight=0.3).rank("мурабаха", candidates, [[1, 0, 0]], top_k=2)
+    # почти дубликат строки 0 уступает место менее похожему, но релевантному чанку
+    assert [candidates[r["index"]]["row"] for r in ranking] == [0, 2]
+    # без векторов запроса (BM25-only) работает лексическое перекрытие
+    assert LocalReranker(store).rank("вклад", candidates, None, top_k=1)[0]["index"] == 3